@@ -1,10 +1,17 @@
 import os
 import glob
 import math
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import rasterio
+from rasterio.enums import Resampling
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.cm import ScalarMappable
 from matplotlib.colors import BoundaryNorm, ListedColormap
+from matplotlib.figure import Figure
+import overviews
+import nodata
 
 def display_all_tifs(folder, boundaries):
     # Trova tutti i file TIFF nella cartella specificata
@@ -32,8 +39,7 @@ def display_all_tifs(folder, boundaries):
     # Visualizza ogni file TIFF con colorbar discreta
     for ax, tif_file in zip(axes, tif_files):
         with rasterio.open(tif_file) as src:
-            img = src.read(1)
-            img = np.where(img == src.nodata, np.nan, img)
+            img, _ = nodata.read_band(src, 1, nodata.layer_for_file(os.path.basename(tif_file)))
             cmap = plt.get_cmap('plasma', len(boundaries) - 1)
             cmap.set_bad(color='white')  # Imposta il colore per i valori no data
             norm = BoundaryNorm(boundaries, cmap.N)
@@ -54,8 +60,96 @@ def display_all_tifs(folder, boundaries):
     plt.subplots_adjust(top=0.95, bottom=0.05, left=0.05, right=0.95, hspace=0.5, wspace=0.4)
     plt.show()
 
+# ====================================================
+# Contact sheet: molte immagini, memoria limitata, senza finestra
+# ====================================================
+# Ogni raster viene letto già ridotto a tile_size pixel sul lato lungo, dal
+# livello di overview più piccolo che basta (interne o .tif.ovr, vedi
+# overviews.py; anche le cartelle come temp_dp con i soli .tif.ovr),
+# in parallelo con un pool di thread. Le pagine della griglia vengono scritte
+# una alla volta, quindi in memoria c'è al massimo una pagina di tile ridotti.
+# Colormap e norm sono gli stessi per tutti i file, con una sola colorbar per pagina.
+
+def raster_files(folder):
+    # I .tif e i raster presenti solo come overview esterne (.tif.ovr senza .tif)
+    tif_files = glob.glob(os.path.join(folder, '*.tif'))
+    tif_files += [f[:-len('.ovr')] for f in glob.glob(os.path.join(folder, '*.tif.ovr'))
+                  if not os.path.exists(f[:-len('.ovr')])]
+    return sorted(tif_files)
+
+def read_decimated(tif_file, tile_size):
+    with overviews.open_level(tif_file, overviews.pick_level(tif_file, tile_size)) as src:
+        scale = max(src.width, src.height) / tile_size
+        out_shape = (max(1, round(src.height / max(scale, 1))), max(1, round(src.width / max(scale, 1))))
+        img, _ = nodata.read_band(src, 1, nodata.layer_for_file(os.path.basename(tif_file)),
+                                  out_shape=out_shape, resampling=Resampling.nearest)
+    return img
+
+def contact_sheet(folder, boundaries, out_dir, cols=6, rows=5, tile_size=256, workers=8,
+                  label='Popolazione per km²', write_tiles=False):
+    tif_files = raster_files(folder)
+    if not tif_files:
+        print("Nessun file .tif trovato nella cartella:", folder)
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+
+    cmap = plt.get_cmap('plasma', len(boundaries) - 1)
+    cmap.set_bad(color='white')  # Imposta il colore per i valori no data
+    norm = BoundaryNorm(boundaries, cmap.N)
+
+    def load_tile(tif_file):
+        img = read_decimated(tif_file, tile_size)
+        if write_tiles:
+            name = os.path.splitext(os.path.basename(tif_file))[0] + '.png'
+            plt.imsave(os.path.join(out_dir, 'tiles', name), cmap(norm(np.ma.masked_invalid(img))))
+        return tif_file, img
+
+    if write_tiles:
+        os.makedirs(os.path.join(out_dir, 'tiles'), exist_ok=True)
+
+    per_page = cols * rows
+    n_pages = math.ceil(len(tif_files) / per_page)
+    pages = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for page in range(n_pages):
+            page_files = tif_files[page * per_page:(page + 1) * per_page]
+            page_rows = math.ceil(len(page_files) / cols)
+            # Figure senza pyplot: nessuna finestra e nessun backend interattivo
+            fig = Figure(figsize=(cols * 2.5, page_rows * 2.5 + 0.8))
+            axes = fig.subplots(page_rows, cols, squeeze=False).flatten()
+            for ax, (tif_file, img) in zip(axes, pool.map(load_tile, page_files)):
+                ax.imshow(img, cmap=cmap, norm=norm, interpolation='nearest')
+                ax.set_title(os.path.basename(tif_file), fontsize=7)
+                ax.set_axis_off()
+            for ax in axes[len(page_files):]:
+                fig.delaxes(ax)
+            cbar = fig.colorbar(ScalarMappable(norm=norm, cmap=cmap), ax=axes[:len(page_files)].tolist(),
+                                orientation='horizontal', fraction=0.03, pad=0.02, ticks=boundaries)
+            cbar.set_label(label, fontsize=8)
+            fig.suptitle(f"{os.path.basename(os.path.normpath(folder))} ({page + 1}/{n_pages})", fontsize=10)
+            path = os.path.join(out_dir, f'contact_sheet_{page + 1:03d}.png')
+            fig.savefig(path, dpi=100)
+            pages.append(path)
+            print(f"Pagina {page + 1}/{n_pages}: {path}")
+    return pages
+
 if __name__ == '__main__':
-    folder_path = 'Datasets_Hackathon/MODIS_Gross_Primary_Production_GPP'
-    boundaries = [1000, 2000, 5000, 10000]
-    display_all_tifs(folder_path, boundaries)
+    parser = argparse.ArgumentParser(description="Mostra i raster di una cartella o ne crea un contact sheet")
+    parser.add_argument('folder', nargs='?', default='Datasets_Hackathon/MODIS_Gross_Primary_Production_GPP')
+    parser.add_argument('--boundaries', default='1000,2000,5000,10000', help="Classi della colormap discreta")
+    parser.add_argument('--contact-sheet', metavar='OUT_DIR', help="Scrive pagine PNG invece di aprire una finestra")
+    parser.add_argument('--cols', type=int, default=6)
+    parser.add_argument('--rows', type=int, default=5)
+    parser.add_argument('--tile-size', type=int, default=256, help="Lato lungo di ogni miniatura in pixel")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--label', default='Popolazione per km²')
+    parser.add_argument('--tiles', action='store_true', help="Salva anche ogni miniatura come PNG")
+    args = parser.parse_args()
+
+    boundaries = [float(b) for b in args.boundaries.split(',')]
+    if args.contact_sheet:
+        contact_sheet(args.folder, boundaries, args.contact_sheet, args.cols, args.rows,
+                      args.tile_size, args.workers, args.label, args.tiles)
+    else:
+        display_all_tifs(args.folder, boundaries)
 
@@ -3,54 +3,116 @@ import os
 import glob
 import math
 import argparse
-import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import shapely
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from vector_cache import read_vector
+
+# Lettura tramite pyogrio + Arrow (o dalla cache FlatGeobuf/GeoParquet se è
+# stata creata con vector_cache.py); bbox è (minx, miny, maxx, maxy) in lon/lat
+def read_layer(shp_file, bbox=None):
+    return read_vector(shp_file, bbox)
+
+def read_layers(shapefiles, bbox=None, workers=4):
+    # Le letture avvengono in GDAL, che rilascia il GIL: i thread lavorano davvero in parallelo
+    def read(shp_file):
+        try:
+            return shp_file, read_layer(shp_file, bbox), None
+        except Exception as e:
+            return shp_file, None, e
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(shapefiles)))) as pool:
+        return list(pool.map(read, shapefiles))
+
+def line_segments(geometries):
+    # Tutte le linee (e i contorni dei poligoni) come lista di array Nx2,
+    # pronta per una sola LineCollection invece di un artist per feature
+    geoms = np.asarray(geometries)
+    geoms = geoms[~shapely.is_missing(geoms)]
+    polygons = shapely.get_type_id(geoms) >= 3
+    geoms[polygons] = shapely.boundary(geoms[polygons])
+    parts = shapely.get_parts(geoms)
+    parts = parts[shapely.get_type_id(parts) != 0]  # i punti non hanno segmenti
+    parts = shapely.get_parts(parts)
+    coords, index = shapely.get_coordinates(parts, return_index=True)
+    if len(coords) == 0:
+        return []
+    return np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+
+def draw_layer(ax, gdf, color='black', linewidth=0.6):
+    segments = line_segments(gdf.geometry.values)
+    if segments:
+        ax.add_collection(LineCollection(segments, colors=color, linewidths=linewidth))
+    points = gdf.geometry[shapely.get_type_id(gdf.geometry.values) == 0]
+    if len(points):
+        ax.scatter(points.x, points.y, s=2, c=color)
+    minx, miny, maxx, maxy = gdf.total_bounds
+    if np.all(np.isfinite([minx, miny, maxx, maxy])):
+        ax.set_xlim(minx, maxx)
+        ax.set_ylim(miny, maxy)
+    ax.set_aspect('equal')
 
 def main():
     # Imposta gli argomenti della riga di comando:
     # - directory: cartella contenente i file .shp
     parser = argparse.ArgumentParser(description="Visualizza tutti i file shapefile presenti in una cartella")
     parser.add_argument("directory", type=str, help="Percorso alla cartella contenente i file .shp")
+    parser.add_argument("--bbox", type=str, help="Legge solo le feature in minx,miny,maxx,maxy (lon/lat)")
+    parser.add_argument("--workers", type=int, default=4, help="Shapefile letti in parallelo")
+    parser.add_argument("--combined", action="store_true", help="Disegna tutti i layer sugli stessi assi")
+    parser.add_argument("--output", type=str, help="Salva la figura invece di mostrarla")
     args = parser.parse_args()
+    bbox = tuple(float(v) for v in args.bbox.split(",")) if args.bbox else None
 
     # Ricerca tutti i file .shp nella directory specificata
-    shapefiles = glob.glob(os.path.join(args.directory, "*.shp"))
+    shapefiles = sorted(glob.glob(os.path.join(args.directory, "*.shp")))
     if not shapefiles:
         print("Nessun file .shp trovato nella directory specificata.")
         return
 
-    # Determina la dimensione della griglia per i grafici in base al numero di shapefile trovati
-    n = len(shapefiles)
+    layers = []
+    for shp_file, gdf, error in read_layers(shapefiles, bbox, args.workers):
+        if error is not None:
+            print(f"Errore nella lettura del file {shp_file}: {error}")
+            continue
+        layers.append((shp_file, gdf))
+    if not layers:
+        return
+
+    # Determina la dimensione della griglia per i grafici in base al numero di shapefile letti
+    n = 1 if args.combined else len(layers)
     cols = math.ceil(math.sqrt(n))
     rows = math.ceil(n / cols)
 
     # Crea la figura e gli assi
-    fig, axes = plt.subplots(rows, cols, figsize=(15, 15))
-    # Assicuriamoci di avere una lista di assi anche se c'è un solo grafico
-    if n == 1:
-        axes = [axes]
-    else:
-        axes = axes.flatten()
+    fig, axes = plt.subplots(rows, cols, figsize=(15, 15), squeeze=False)
+    axes = axes.flatten()
 
-    # Itera su ogni file shapefile e crea il grafico corrispondente
-    for i, shp_file in enumerate(shapefiles):
-        try:
-            gdf = gpd.read_file(shp_file)
-        except Exception as e:
-            print(f"Errore nella lettura del file {shp_file}: {e}")
-            continue
-        ax = axes[i]
-        gdf.plot(ax=ax, edgecolor='black')
-        ax.set_title(os.path.basename(shp_file))
+    colors = plt.get_cmap('tab10')
+    for i, (shp_file, gdf) in enumerate(layers):
+        ax = axes[0] if args.combined else axes[i]
+        if args.combined and gdf.crs is not None and layers[0][1].crs is not None:
+            gdf = gdf.to_crs(layers[0][1].crs)
+        draw_layer(ax, gdf, color=colors(i % 10) if args.combined else 'black')
+        ax.set_title("" if args.combined else os.path.basename(shp_file))
         ax.set_xlabel("Longitudine")
         ax.set_ylabel("Latitudine")
+    if args.combined:
+        ax = axes[0]
+        ax.autoscale()
+        ax.legend(handles=[plt.Line2D([], [], color=colors(i % 10), label=os.path.basename(f))
+                           for i, (f, _) in enumerate(layers)])
 
-    # Se ci sono più assi di quanti file siano stati trovati, rimuove quelli inutilizzati
-    for j in range(i + 1, len(axes)):
+    # Se ci sono più assi di quanti layer siano stati letti, rimuove quelli inutilizzati
+    for j in range(n, len(axes)):
         fig.delaxes(axes[j])
-    
+
     plt.tight_layout()
-    plt.show()
+    if args.output:
+        fig.savefig(args.output, dpi=150)
+    else:
+        plt.show()
 
 if __name__ == "__main__":
     main()
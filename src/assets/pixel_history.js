@@ -0,0 +1,70 @@
+/* assets/pixel_history.js */
+/* Serie storica del pixel cliccato calcolata nel browser dal cubo degli anni
+   (year_cube.py) già caricato nel dcc.Store "pixel-cube". Se il cubo non c'è
+   (layer non raster o regione troppo grande) la richiesta passa al server
+   tramite lo store "history-request". */
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    pixelHistory: {
+        _cache: {key: null, values: null},
+
+        _decode: async function (cube) {
+            var key = cube.map_type + "|" + cube.region + "|" + cube.data.length;
+            if (this._cache.key !== key) {
+                var bytes = Uint8Array.from(atob(cube.data), function (c) { return c.charCodeAt(0); });
+                var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate"));
+                var buffer = await new Response(stream).arrayBuffer();
+                this._cache = {key: key, values: new Uint16Array(buffer)};
+            }
+            return this._cache.values;
+        },
+
+        plot: async function (clickData, mapType, currentYear, language, region, cube, labels) {
+            var text = labels[language] || labels.en;
+            if (!clickData) {
+                return [{data: [], layout: {title: {text: text.click_pixel_msg}}}, window.dash_clientside.no_update];
+            }
+            var request = {clickData: clickData, map_type: mapType, year: currentYear, language: language, region: region};
+            if (!cube || cube.map_type !== mapType || cube.region !== (region || cube.region)
+                    || typeof DecompressionStream === "undefined") {
+                return [window.dash_clientside.no_update, request];
+            }
+            var point = clickData.points && clickData.points[0];
+            if (!point || point.x === undefined || point.y === undefined) {
+                return [{data: [], layout: {title: {text: text.error_click_data}}}, window.dash_clientside.no_update];
+            }
+            var lon = point.x, lat = point.y;
+            var values = await this._decode(cube);
+
+            // Inversa della trasformazione affine dell'array (come GridGeometry.rowcol in grid.py):
+            // x = a*col + b*row + c, y = d*col + e*row + f; floor = pixel che contiene il punto
+            var t = cube.transform, det = t[0] * t[4] - t[1] * t[3];
+            var col = Math.floor((t[4] * (lon - t[2]) - t[1] * (lat - t[5])) / det);
+            var row = Math.floor((t[0] * (lat - t[5]) - t[3] * (lon - t[2])) / det);
+            var n = cube.shape[0], height = cube.shape[1], width = cube.shape[2];
+            var inside = row >= 0 && row < height && col >= 0 && col < width;
+            var series = [];
+            for (var i = 0; i < n; i++) {
+                var code = inside ? values[i * height * width + row * width + col] : cube.nodata;
+                series.push(code === cube.nodata ? null : code * cube.scale + cube.offset);
+            }
+
+            var data = [{x: cube.years, y: series, mode: "lines+markers", name: text.value}];
+            var index = cube.years.findIndex(function (y) { return String(y) === String(currentYear); });
+            if (index >= 0) {
+                data.push({x: [cube.years[index]], y: [series[index]], mode: "markers",
+                           marker: {size: 12, color: "red"}, name: text.current_year});
+            }
+            var figure = {
+                data: data,
+                layout: {
+                    title: {text: text.historic_trend + " (" + lon.toFixed(2) + ", " + lat.toFixed(2) + ")"},
+                    xaxis: {title: {text: text.year}},
+                    yaxis: {title: {text: text.value}},
+                    height: 700,
+                    margin: {r: 10, t: 50, l: 10, b: 10}
+                }
+            };
+            return [figure, window.dash_clientside.no_update];
+        }
+    }
+});
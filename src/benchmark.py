@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic
+
+# ====================================================
+# Benchmark dei percorsi dati e figure del dashboard
+# ====================================================
+# Ogni caso gira in un processo figlio separato: la memoria di picco è
+# misurata senza interferenze tra casi e un caso troppo lento può essere
+# interrotto con --timeout senza perdere gli altri risultati.
+#
+# Dataset:
+#   bundled        la cartella Datasets_Hackathon del repository
+#   synthetic-N    dataset sintetico (synthetic.py) con raster N x N pixel e la stessa struttura di cartelle
+#
+# Esempi:
+#   python benchmark.py --output bench.json
+#   python benchmark.py --sizes 1000,5000 --cases update_map --compare bench.json
+#   python benchmark.py --cases zoom_map --shared-store   # zoom a finestra con RASTER_SHARED_CACHE_DIR
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLED_ROOT = os.path.join(SRC_DIR, "Datasets_Hackathon")
+DEFAULT_SIZES = "1000,2000,5000,10000"
+
+
+# ====================================================
+# Dataset sintetici (synthetic.py)
+# ====================================================
+def build_synthetic_root(size, workdir):
+    # Seed = dimensione: ogni dimensione ha sempre gli stessi file
+    return synthetic.build_root(os.path.join(workdir, f"synthetic-{size}"), size, seed=size)
+
+
+# ====================================================
+# Casi di benchmark
+# ====================================================
+MAP_TYPES = ["admin_layers", "climate_precipitations", "population_density", "gross_primary_production",
+             "land_cover", "streams_roads", "deforestation", "climate_change", "land_cover_change"]
+RASTER_TYPES = [t for t in MAP_TYPES if t not in ("admin_layers", "streams_roads")]
+
+
+def all_cases():
+    cases = ["scan_directories_for_years", "update_price_graph"]
+    cases += [f"load_geotiff:{t}" for t in RASTER_TYPES]
+    cases += [f"load_data:{t}" for t in MAP_TYPES]
+    cases += [f"generate_map_figure:{t}" for t in MAP_TYPES]
+    cases += [f"update_map:{t}" for t in MAP_TYPES]
+    cases += [f"zoom_map:{t}" for t in RASTER_TYPES]
+    cases += [f"update_historical_plot:{t}" for t in RASTER_TYPES]
+    return cases
+
+
+def _payload_bytes(result):
+    from plotly.io.json import to_json_plotly
+    try:
+        return len(to_json_plotly(result).encode())
+    except Exception:
+        return None
+
+
+def _prepare_case(dashboard, case):
+    name, _, map_type = case.partition(":")
+    year = None
+    if map_type:
+        years = [y for y in dashboard.get_years_for_map_type(map_type) if y != "N/A"]
+        year = years[-1] if years else "N/A"
+
+    if name == "scan_directories_for_years":
+        return dashboard.scan_directories_for_years, None
+    if name == "update_price_graph":
+        price_df = dashboard.get_price_df()
+        region, commodity = price_df["admin2"].iloc[0], price_df["commodity"].iloc[0]
+        return lambda: dashboard.update_price_graph(region, commodity), None
+    if name == "load_geotiff":
+        _, tif_files = dashboard.load_available_files(map_type, year)
+        if not tif_files:
+            raise RuntimeError(f"nessun file per {map_type} {year}")
+        return lambda: dashboard.load_geotiff(tif_files[0]), None
+    if name == "load_data":
+        # Misura il caricamento a freddo: la cache viene svuotata prima di ogni ripetizione
+        return lambda: dashboard.load_data(map_type, year), dashboard.raster_cache.clear
+    if name == "generate_map_figure":
+        return lambda: dashboard.generate_map_figure(map_type, year, "en"), None
+    if name == "update_map":
+        return lambda: dashboard.update_map(map_type, year, "en"), None
+    if name == "zoom_map":
+        # Zoom sul quarto centrale: con le overview serve un livello più fine e
+        # si legge solo la finestra visibile. Le cache locali vengono svuotate
+        # prima di ogni ripetizione, quindi con lo store condiviso il raster
+        # viene riaperto da disco (metadati passati per JSON)
+        data, error = dashboard.load_data(map_type, year, max_size=dashboard.MAP_MAX_SIZE)
+        if error:
+            raise RuntimeError(error)
+        minx, miny, maxx, maxy = data["bounds"]
+        dx, dy = (maxx - minx) / 8, (maxy - miny) / 8
+        cx, cy = (minx + maxx) / 2, (miny + maxy) / 2
+        relayout = {"xaxis.range[0]": cx - dx, "xaxis.range[1]": cx + dx,
+                    "yaxis.range[0]": cy - dy, "yaxis.range[1]": cy + dy}
+
+        def zoom():
+            max_size = dashboard.map_max_size(map_type, year, relayout=relayout)
+            _, window = dashboard.map_window(map_type, year, max_size=max_size, relayout=relayout)
+            return dashboard.render_main_map(map_type, year, "en", max_size=max_size, window=window)
+
+        def clear():
+            dashboard.raster_cache.clear()
+            dashboard.index_cache.clear()
+        return zoom, clear
+    if name == "update_historical_plot":
+        data, error = dashboard.load_data(map_type, year)
+        if error:
+            raise RuntimeError(error)
+        minx, miny, maxx, maxy = data["bounds"]
+        click = {"points": [{"x": (minx + maxx) / 2, "y": (miny + maxy) / 2}]}
+        return lambda: dashboard.update_historical_plot(click, map_type, year, "en"), None
+    raise ValueError(f"caso sconosciuto: {case}")
+
+
+def run_case(case, repeat):
+    import resource
+    import warnings
+    warnings.filterwarnings("ignore")
+    import dashboard
+
+    func, before_each = _prepare_case(dashboard, case)
+    wall = []
+    result = None
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        t0 = time.perf_counter()
+        result = func()
+        wall.append(time.perf_counter() - t0)
+
+    # Un'ulteriore esecuzione sotto tracemalloc per la memoria di picco (numpy è tracciato)
+    if before_each:
+        before_each()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    dashboard.prefetcher.shutdown()
+
+    return {
+        "wall_s": wall,
+        "wall_first_s": wall[0],
+        "wall_median_s": statistics.median(wall),
+        "peak_alloc_mb": peak / 1e6,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "payload_bytes": _payload_bytes(result),
+    }
+
+
+def run_case_subprocess(dataset, root, case, repeat, timeout, workdir, shared_store=False):
+    env = dict(os.environ, DASHBOARD_DATA_ROOT=root,
+               DASHBOARD_CATALOG_MANIFEST=os.path.join(workdir, f"{dataset}.manifest.json"))
+    if shared_store:
+        env["RASTER_SHARED_CACHE_DIR"] = os.path.join(workdir, f"{dataset}.shared")
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-case", case, "--repeat", str(repeat)]
+    record = {"dataset": dataset, "case": case}
+    try:
+        proc = subprocess.run(cmd, cwd=SRC_DIR, env=env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        record.update(status="timeout")
+        return record
+    if proc.returncode != 0:
+        record.update(status="error", error=proc.stderr.strip().splitlines()[-1:] or [""])
+        record["error"] = record["error"][0]
+        return record
+    record.update(status="ok", **json.loads(proc.stdout.strip().splitlines()[-1]))
+    return record
+
+
+def print_comparison(results, previous_path):
+    with open(previous_path) as f:
+        previous = {(r["dataset"], r["case"]): r for r in json.load(f)["results"]}
+    print(f"\n{'dataset':<16}{'case':<48}{'median s':>10}{'prev s':>10}{'ratio':>8}")
+    for r in results:
+        old = previous.get((r["dataset"], r["case"]))
+        if r.get("status") != "ok" or not old or old.get("status") != "ok":
+            continue
+        ratio = r["wall_median_s"] / old["wall_median_s"] if old["wall_median_s"] else float("nan")
+        print(f"{r['dataset']:<16}{r['case']:<48}{r['wall_median_s']:>10.4f}{old['wall_median_s']:>10.4f}{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi dati e figure del dashboard")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="Lati dei raster sintetici separati da virgola (vuoto = solo dati del repository)")
+    parser.add_argument("--no-bundled", action="store_true", help="Salta i dati di Datasets_Hackathon")
+    parser.add_argument("--cases", default="", help="Filtro sui nomi dei casi (sottostringhe separate da virgola)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=600, help="Secondi massimi per caso")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "dashboard-bench"),
+                        help="Cartella per i dataset sintetici (riusati tra le esecuzioni)")
+    parser.add_argument("--compare", help="JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--shared-store", action="store_true",
+                        help="Casi eseguiti con lo store condiviso dei raster (RASTER_SHARED_CACHE_DIR nella workdir)")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.repeat)))
+        return
+
+    sys.path.insert(0, SRC_DIR)
+    datasets = [] if args.no_bundled else [("bundled", BUNDLED_ROOT)]
+    os.makedirs(args.workdir, exist_ok=True)
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        t0 = time.perf_counter()
+        root = build_synthetic_root(size, args.workdir)
+        print(f"dataset synthetic-{size}: {root} ({time.perf_counter() - t0:.1f} s)", flush=True)
+        datasets.append((f"synthetic-{size}", root))
+
+    filters = [f for f in args.cases.split(",") if f]
+    cases = [c for c in all_cases() if not filters or any(f in c for f in filters)]
+
+    results = []
+    for dataset, root in datasets:
+        for case in cases:
+            record = run_case_subprocess(dataset, root, case, args.repeat, args.timeout, args.workdir,
+                                         args.shared_store)
+            results.append(record)
+            if record["status"] == "ok":
+                payload = record["payload_bytes"]
+                print(f"{dataset:<16}{case:<48}{record['wall_median_s']:>9.4f}s "
+                      f"{record['peak_alloc_mb']:>9.1f}MB {payload if payload is not None else '-':>12}B", flush=True)
+            else:
+                print(f"{dataset:<16}{case:<48} {record['status']} {record.get('error', '')}", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "shared_store": args.shared_store,
+            "datasets": {name: root for name, root in datasets},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nRisultati salvati in {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
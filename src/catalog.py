@@ -0,0 +1,165 @@
+import glob
+import json
+import os
+import re
+
+import cog
+
+# ====================================================
+# Catalogo dei dataset con manifest persistito
+# ====================================================
+# La scansione delle cartelle (glob + regex sui nomi dei file) viene fatta una
+# volta sola e salvata in un manifest JSON accanto ai dati. Ai riavvii
+# successivi il manifest viene riusato finché le cartelle non cambiano
+# (confronto sugli mtime delle directory dei layer).
+# I raster convertiti in COG con cog.py vengono restituiti da layer_files al
+# posto dei sorgenti, finché il sorgente non cambia.
+
+DATA_ROOT = os.environ.get("DASHBOARD_DATA_ROOT", "./Datasets_Hackathon")
+MANIFEST_NAME = ".catalog_manifest.json"
+MANIFEST_VERSION = 3
+
+LAYER_SUBDIRS = {
+    "admin_layers": "Admin_layers",
+    "climate_precipitations": "Climate_Precipitation_Data",
+    "population_density": "Gridded_Population_Density_Data",
+    "gross_primary_production": "MODIS_Gross_Primary_Production_GPP",
+    "land_cover": "Modis_Land_Cover_Data",
+    "streams_roads": "Streamwater_Line_Road_Network",
+    "deforestation": "Deforestation",
+    "climate_change": "ClimateChange",
+    "land_cover_change": "land_coverage_change_over_time",
+}
+
+# Layer i cui file sono indicizzati per coppia di anni (es. 2010_2011)
+YEAR_PAIR_LAYERS = ["deforestation", "climate_change", "land_cover_change"]
+
+PRICE_DATA_FILE = "confronto_barkeol_kankossa.csv"
+
+
+def data_dirs(root=DATA_ROOT, layers=None):
+    return {data_type: os.path.join(root, subdir) for data_type, subdir in (layers or LAYER_SUBDIRS).items()}
+
+
+def scan_years(file_paths, year_pairs_mode):
+    years = set()
+    year_pairs = set()
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        year_pair_match = re.findall(r'(?<!\d)(\d{4})_(\d{4})(?!\d)', filename)
+        if year_pair_match:
+            start_year, end_year = int(year_pair_match[0][0]), int(year_pair_match[0][1])
+            if 1900 <= start_year <= 2030 and 1900 <= end_year <= 2030:
+                year_pairs.add(f"{start_year}_{end_year}")
+            continue
+        year_matches = re.findall(r'(?<!\d)(\d{4})(?!\d)', filename)
+        if year_matches:
+            for year_str in year_matches:
+                year = int(year_str[:4])
+                if 1900 <= year <= 2030:
+                    years.add(year)
+        else:
+            years.add("N/A")
+
+    if year_pairs_mode:
+        return sorted(year_pairs)
+    if not years:
+        years.add("N/A")
+    # "N/A" e anni interi non sono confrontabili: N/A va in coda
+    return sorted(years, key=lambda y: (y == "N/A", y if y != "N/A" else 0))
+
+
+def _signature(root, layers=None):
+    # mtime di ogni cartella dei layer, sottocartelle comprese (la scansione è
+    # ricorsiva): aggiungere o rimuovere un file cambia l'mtime della sua cartella
+    signature = {}
+    for data_type, directory in data_dirs(root, layers).items():
+        if not os.path.isdir(directory):
+            signature[data_type] = None
+            continue
+        mtimes = {}
+        for dirpath, _, _ in os.walk(directory):
+            try:
+                mtimes[os.path.relpath(dirpath, directory)] = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                pass
+        signature[data_type] = mtimes
+    return signature
+
+
+def build_catalog(root=DATA_ROOT, subdirs=None):
+    subdirs = dict(subdirs or LAYER_SUBDIRS)
+    layers = {}
+    for data_type, directory in data_dirs(root, subdirs).items():
+        abs_directory = os.path.abspath(directory)
+        if not os.path.exists(abs_directory):
+            continue
+        shp_files = sorted(glob.glob(os.path.join(abs_directory, "**/*.shp"), recursive=True))
+        tif_files = glob.glob(os.path.join(abs_directory, "**/*.tif"), recursive=True)
+        # Raster distribuiti solo come overview esterne (.tif.ovr senza .tif, es. temp_dp):
+        # vengono letti tramite overviews.source_path
+        tif_files = sorted(tif_files + [f[:-len(".ovr")] for f in glob.glob(os.path.join(abs_directory, "**/*.tif.ovr"), recursive=True)
+                                        if not os.path.exists(f[:-len(".ovr")])])
+        layers[data_type] = {
+            "years": scan_years(shp_files + tif_files, data_type in YEAR_PAIR_LAYERS),
+            "shp": [os.path.relpath(f, abs_directory) for f in shp_files],
+            "tif": [os.path.relpath(f, abs_directory) for f in tif_files],
+        }
+    return {
+        "version": MANIFEST_VERSION,
+        "root": os.path.abspath(root),
+        "subdirs": subdirs,
+        "signature": _signature(root, subdirs),
+        "layers": layers,
+    }
+
+
+def manifest_path(root=DATA_ROOT, name=None):
+    # name distingue i manifest di più regioni che condividono la stessa cartella
+    path = os.environ.get("DASHBOARD_CATALOG_MANIFEST", os.path.join(root, MANIFEST_NAME))
+    if name:
+        base, ext = os.path.splitext(path)
+        path = f"{base}.{name}{ext}"
+    return path
+
+
+def save_manifest(catalog, root=DATA_ROOT, name=None):
+    path = manifest_path(root, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(catalog, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Cartella dati in sola lettura: il catalogo resta valido in memoria
+        pass
+
+
+def load_catalog(root=DATA_ROOT, subdirs=None, name=None):
+    subdirs = dict(subdirs or LAYER_SUBDIRS)
+    try:
+        with open(manifest_path(root, name)) as f:
+            catalog = json.load(f)
+        if (catalog.get("version") == MANIFEST_VERSION
+                and catalog.get("root") == os.path.abspath(root)
+                and catalog.get("subdirs") == subdirs
+                and catalog.get("signature") == _signature(root, subdirs)):
+            catalog["from_manifest"] = True
+            return catalog
+    except (OSError, ValueError):
+        pass
+    catalog = build_catalog(root, subdirs)
+    save_manifest(catalog, root, name)
+    catalog["from_manifest"] = False
+    return catalog
+
+
+def layer_files(catalog, data_type, use_cog=True):
+    layer = catalog["layers"].get(data_type)
+    if layer is None:
+        return [], []
+    abs_directory = os.path.abspath(data_dirs(catalog["root"], catalog["subdirs"])[data_type])
+    tif_files = [os.path.join(abs_directory, f) for f in layer["tif"]]
+    if use_cog:
+        tif_files = [cog.resolve(f) for f in tif_files]
+    return [os.path.join(abs_directory, f) for f in layer["shp"]], tif_files
@@ -9,6 +9,8 @@ import os
 import glob
 import pandas as pd
 
+import synthetic
+
 # Inizializza l'app Dash
 app = dash.Dash(__name__)
 
@@ -226,84 +228,38 @@ def load_geotiff(map_type, year, tif_files):
             except Exception as e:
                 return None, f"Errore nel caricamento del file {filename}: {str(e)}"
     
-    # Se non troviamo file reali, creiamo dati simulati
+    # Se non troviamo file reali, creiamo dati simulati (synthetic.py, seed fisso per anno)
     width, height = 100, 100
     data = None
+    seed_year = int(year) if str(year).isdigit() else 0
     
     if map_type == "climate_precipitations":
-        # Dati di precipitazioni simulati
-        data = np.random.gamma(2, 10, (height, width))
-        # Aggiungi un pattern geografico
-        x, y = np.meshgrid(np.linspace(-17, -8, width), np.linspace(16, 26, height))
-        data = data * np.exp(-((x+12)**2 + (y-21)**2) / 50)
+        data = synthetic.layer_array(map_type, height, width, year=seed_year)[0]
         title = f"Precipitazioni {year} (mm)"
         units = "mm"
         
     elif map_type == "population_density":
-        # Dati di densità di popolazione simulati
-        data = np.zeros((height, width))
-        # Aggiungi alcuni centri urbani
-        centers = [
-            (width//3, height//3, 100),  # (x, y, popolazione massima)
-            (2*width//3, height//3, 50),
-            (width//2, 2*height//3, 80)
-        ]
-        for x, y, pop in centers:
-            for i in range(height):
-                for j in range(width):
-                    dist = np.sqrt((i - y)**2 + (j - x)**2)
-                    if dist < 15:
-                        data[i, j] += pop * np.exp(-dist/8)
+        data = synthetic.layer_array(map_type, height, width, year=seed_year)[0]
         title = f"Densità di popolazione {year} (persone/km²)"
         units = "persone/km²"
         
     elif map_type == "gross_primary_production":
-        # Dati di produzione primaria lorda simulati
-        data = np.random.normal(5, 2, (height, width))
-        # Aggiungi un pattern geografico
-        x, y = np.meshgrid(np.linspace(-17, -8, width), np.linspace(16, 26, height))
-        data = data * (1 - np.exp(-((x+12)**2 + (y-21)**2) / 200))
-        data = np.clip(data, 0, None)  # Non può essere negativo
+        # Valori MODIS (kgC/m²/anno x 10000) convertiti in gC/m²/giorno, acqua (65533) esclusa
+        gpp = synthetic.layer_array(map_type, height, width, year=seed_year)[0]
+        data = np.where(gpp == 65533, np.nan, gpp * 0.0001 * 1000 / 365)
         title = f"Produzione primaria lorda {year} (gC/m²/giorno)"
         units = "gC/m²/giorno"
         
     elif map_type == "land_cover":
-        # Dati di copertura del suolo simulati (valori categorici)
-        data = np.zeros((height, width))
-        # Crea diverse aree con diversi tipi di copertura del suolo
+        # Classi IGBP ricondotte alle categorie della mappa:
         # 1: Foresta, 2: Prateria, 3: Coltivazione, 4: Urbano, 5: Acqua, 6: Desertico
-        
-        # Principalmente desertico
-        data.fill(6)
-        
-        # Aggiungi alcune aree di prateria
-        for _ in range(3):
-            x, y = np.random.randint(0, width), np.random.randint(0, height)
-            radius = np.random.randint(5, 15)
-            for i in range(height):
-                for j in range(width):
-                    if ((i-y)**2 + (j-x)**2) < radius**2:
-                        data[i, j] = 2
-        
-        # Aggiungi aree di coltivazione vicino ai fiumi
-        y = np.linspace(0, height-1, height)
-        x = width//2 + width//10 * np.sin(y/10)
-        for i in range(height):
-            for j in range(width):
-                if abs(j - x[i]) < 3:
-                    data[i, j] = 5  # Acqua (fiume)
-                elif abs(j - x[i]) < 8:
-                    data[i, j] = 3  # Coltivazione
-        
-        # Aggiungi aree urbane
-        for _ in range(2):
-            x, y = np.random.randint(0, width), np.random.randint(0, height)
-            radius = np.random.randint(2, 5)
-            for i in range(height):
-                for j in range(width):
-                    if ((i-y)**2 + (j-x)**2) < radius**2:
-                        data[i, j] = 4
-        
+        igbp = synthetic.layer_array(map_type, height, width, year=seed_year)[0]
+        categories = np.full(256, 6, dtype=float)
+        categories[[synthetic.OPEN_SHRUBLANDS, synthetic.GRASSLANDS, synthetic.SAVANNAS]] = 2
+        categories[synthetic.CROPLANDS] = 3
+        categories[synthetic.URBAN] = 4
+        categories[synthetic.WATER] = 5
+        data = categories[igbp]
         title = f"Copertura del suolo {year}"
         units = "categorie"
     
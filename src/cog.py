@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import nodata
+
+# ====================================================
+# Conversione dei GeoTIFF in Cloud-Optimized GeoTIFF
+# ====================================================
+# python cog.py riscrive ogni .tif dei dataset come COG: tile 256x256,
+# compressione DEFLATE con predictor, overview interne e nodata originale.
+# Il file convertito sta in una cartella che prende il nome dallo SHA-256 del
+# sorgente (il nome del file resta lo stesso, così i filtri per anno e per
+# nome del dashboard continuano a funzionare) e l'indice
+# (cog_index.json) registra per ogni sorgente hash, dimensione e mtime.
+# Il catalogo (catalog.layer_files) restituisce il COG al posto del sorgente
+# quando dimensione e mtime del sorgente coincidono con quelli registrati:
+# le letture a finestre o ridotte (out_shape) usano così tile e overview.
+# Le overview sono ricampionate per layer: classi e anomalie (anche se float,
+# come change_image) con MODE/NEAREST, mai mediate; il nodata dichiarato del
+# layer (nodata.LAYER_NODATA, es. -1 fuori area) viene scritto nel COG quando
+# il sorgente non ne ha uno, così non entra nelle medie delle overview.
+
+COG_DIR = os.environ.get("DASHBOARD_COG_DIR", "./.cog_cache")
+COG_INDEX_NAME = "cog_index.json"
+COG_BLOCKSIZE = 256
+
+# Ricampionamento delle overview per layer; gli altri: media per i float, nearest per gli interi
+LAYER_RESAMPLING = {
+    "land_cover": "MODE",
+    "land_cover_change": "MODE",
+    # Due bande (classe + differenza): nearest tiene la differenza del pixel della classe
+    "deforestation": "NEAREST",
+    "climate_change": "NEAREST",
+}
+
+_index_cache = {"mtime": None, "index": {}}
+
+
+def index_path(cog_dir=COG_DIR):
+    return os.path.join(cog_dir, COG_INDEX_NAME)
+
+
+def index_mtime(cog_dir=COG_DIR):
+    try:
+        return os.stat(index_path(cog_dir)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_index(cog_dir=COG_DIR):
+    mtime = index_mtime(cog_dir)
+    if mtime != _index_cache["mtime"]:
+        try:
+            with open(index_path(cog_dir)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        _index_cache.update(mtime=mtime, index=index)
+    return _index_cache["index"]
+
+
+def save_index(index, cog_dir=COG_DIR):
+    path = index_path(cog_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _matches_source(entry, source_path):
+    try:
+        st = os.stat(source_path)
+    except OSError:
+        return False
+    return entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns
+
+
+def resolve(source_path, cog_dir=COG_DIR):
+    # Percorso del COG per il sorgente, oppure il sorgente se non convertito o modificato
+    abs_source = os.path.abspath(source_path)
+    entry = load_index(cog_dir).get(abs_source)
+    if entry is None or not _matches_source(entry, abs_source):
+        return source_path
+    cog_path = os.path.join(cog_dir, entry["cog"])
+    return cog_path if os.path.exists(cog_path) else source_path
+
+
+def cog_options(src, map_type=None):
+    # (ricampionamento, nodata) del COG per un sorgente aperto
+    if map_type in LAYER_RESAMPLING:
+        resampling = LAYER_RESAMPLING[map_type]
+    else:
+        # Media per i dati continui; per gli interi (valori di riempimento di GPP)
+        # nearest, per non inventare valori nelle overview
+        resampling = "AVERAGE" if src.dtypes[0].startswith("float") else "NEAREST"
+    declared = nodata.LAYER_NODATA.get(map_type, ())
+    return resampling, src.nodata if src.nodata is not None or not declared else declared[0]
+
+
+def _nodata_vrt(src, nodata_value):
+    # VRT che espone il sorgente con il nodata dichiarato: il driver COG lavora
+    # solo per copia, quindi il nodata va impostato sul dataset da copiare
+    from xml.sax.saxutils import escape
+
+    bands = "".join(
+        f'<VRTRasterBand dataType="{gdal_type}" band="{band}"><NoDataValue>{nodata_value!r}</NoDataValue>'
+        f'<SimpleSource><SourceFilename relativeToVRT="0">{escape(os.path.abspath(src.name))}</SourceFilename>'
+        f'<SourceBand>{band}</SourceBand></SimpleSource></VRTRasterBand>'
+        for band, gdal_type in enumerate((_GDAL_TYPES[dtype] for dtype in src.dtypes), start=1))
+    srs = f"<SRS>{escape(src.crs.to_wkt())}</SRS>" if src.crs else ""
+    transform = ", ".join(repr(v) for v in src.transform.to_gdal())
+    return (f'<VRTDataset rasterXSize="{src.width}" rasterYSize="{src.height}">{srs}'
+            f"<GeoTransform>{transform}</GeoTransform>{bands}</VRTDataset>")
+
+
+_GDAL_TYPES = {"uint8": "Byte", "int8": "Int8", "uint16": "UInt16", "int16": "Int16", "uint32": "UInt32",
+               "int32": "Int32", "float32": "Float32", "float64": "Float64"}
+
+
+def convert(source_path, cog_path, map_type=None):
+    import rasterio
+    from rasterio.shutil import copy as rio_copy
+
+    map_type = map_type or nodata.layer_for_file(os.path.basename(source_path))
+    with rasterio.open(source_path) as src:
+        resampling, nodata_value = cog_options(src, map_type)
+        tmp_path = f"{cog_path}.{os.getpid()}.tmp.tif"
+        with (rasterio.open(_nodata_vrt(src, nodata_value)) if nodata_value != src.nodata else src) as source:
+            rio_copy(source, tmp_path, driver="COG", COMPRESS="DEFLATE", PREDICTOR="YES",
+                     BLOCKSIZE=COG_BLOCKSIZE, OVERVIEWS="AUTO", RESAMPLING=resampling,
+                     BIGTIFF="IF_SAFER")
+    os.replace(tmp_path, cog_path)
+
+
+def _resampling_for(source_path, map_type):
+    import rasterio
+
+    with rasterio.open(source_path) as src:
+        return cog_options(src, map_type)[0]
+
+
+def convert_all(tif_files, cog_dir=COG_DIR, force=False, log=print, layers=None):
+    # layers: {sorgente: layer} per ricampionamento e nodata (altrimenti dal nome del file)
+    os.makedirs(cog_dir, exist_ok=True)
+    index = dict(load_index(cog_dir))
+    layers = layers or {}
+    for source_path in tif_files:
+        abs_source = os.path.abspath(source_path)
+        entry = index.get(abs_source)
+        map_type = layers.get(source_path) or nodata.layer_for_file(os.path.basename(source_path))
+        resampling = _resampling_for(abs_source, map_type)
+        # I COG convertiti con un altro ricampionamento (es. media delle classi) vengono rifatti
+        current = entry is not None and entry.get("resampling") == resampling
+        if current and not force and _matches_source(entry, abs_source) \
+                and os.path.exists(os.path.join(cog_dir, entry["cog"])):
+            log(f"{os.path.basename(source_path)}: aggiornato")
+            continue
+        t0 = time.perf_counter()
+        sha = file_sha256(abs_source)
+        cog_name = os.path.join(sha[:16], os.path.basename(abs_source))
+        cog_path = os.path.join(cog_dir, cog_name)
+        if force or not current or not os.path.exists(cog_path):
+            os.makedirs(os.path.dirname(cog_path), exist_ok=True)
+            convert(abs_source, cog_path, map_type)
+        st = os.stat(abs_source)
+        index[abs_source] = {"sha256": sha, "cog": cog_name, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                             "layer": map_type, "resampling": resampling}
+        log(f"{os.path.basename(source_path)} -> {cog_name} "
+            f"({st.st_size / 1e6:.1f} -> {os.path.getsize(cog_path) / 1e6:.1f} MB, {time.perf_counter() - t0:.1f} s)")
+    save_index(index, cog_dir)
+    return index
+
+
+def main():
+    from catalog import DATA_ROOT, build_catalog, layer_files
+
+    parser = argparse.ArgumentParser(description="Converte i GeoTIFF dei dataset in Cloud-Optimized GeoTIFF")
+    parser.add_argument("--root", default=DATA_ROOT, help="Cartella dei dataset")
+    parser.add_argument("--cog-dir", default=COG_DIR)
+    parser.add_argument("--layers", help="Solo questi layer (separati da virgola)")
+    parser.add_argument("--force", action="store_true", help="Riconverte anche i file aggiornati")
+    parser.add_argument("--prune", action="store_true", help="Rimuove i COG non più referenziati dall'indice")
+    args = parser.parse_args()
+
+    # Scansione diretta dei sorgenti: il catalogo normale restituirebbe già i COG
+    catalog = build_catalog(args.root)
+    layers = set(args.layers.split(",")) if args.layers else None
+    tif_layers = {}
+    for data_type in catalog["layers"]:
+        if layers is None or data_type in layers:
+            tif_layers.update((path, data_type) for path in layer_files(catalog, data_type, use_cog=False)[1])
+    index = convert_all(list(tif_layers), args.cog_dir, args.force, layers=tif_layers)
+
+    if args.prune:
+        referenced = {entry["cog"] for entry in index.values()}
+        for dirpath, _, filenames in os.walk(args.cog_dir):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(dirpath, filename), args.cog_dir)
+                if filename.endswith(".tif") and name not in referenced:
+                    os.remove(os.path.join(args.cog_dir, name))
+                    print(f"rimosso {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,67 @@
 import dash
-from dash import dcc, html, Input, Output, State
-import plotly.express as px
+from dash import dcc, html, Input, Output, State, callback, clientside_callback, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
-import geopandas as gpd
-import rasterio
 import numpy as np
 import os
-import glob
-import pandas as pd
-import re
+import sys
+import time
+import argparse
+import subprocess
+import functools
+import threading
 
 import dash_bootstrap_components as dbc
+from flask import jsonify
 
 import warnings
 
+from raster_cache import DEFAULT_CACHE_MB, MAX_ACTIVE_REGIONS, RasterCache, RegionCaches
+from prefetch import Prefetcher
+from shared_store import SHARED_CACHE_DIR, SharedRasterStore
+import metrics
+import profiling
+from metrics import instrument, stage
+from catalog import data_dirs, build_catalog, load_catalog, save_manifest, layer_files
+from regions import REGIONS, DEFAULT_REGION, get_region, region_options
+import overviews
+import masks
+import nodata
+import quantize
+import year_cube
+import grid
+import market_join
+import exports
+
+# geopandas, rasterio, pandas e plotly.express vengono importati dentro le
+# funzioni che li usano: l'import del modulo resta leggero e il server parte
+# prima di aver toccato i dati.
+
 # Ignora tutti i warning
 # warnings.filterwarnings("ignore")
 
-# Inizializza l'app con un tema Bootstrap
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
-#app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
-
 # ====================================================
 # Directory per i diversi tipi di dati e configurazioni
 # ====================================================
-ADMIN_LAYERS_DIR = "./Datasets_Hackathon/Admin_layers/"
-CLIMATE_PRECIPITATIONS_DIR = "./Datasets_Hackathon/Climate_Precipitation_Data/"
-POPULATION_DENSITY_DIR = "./Datasets_Hackathon/Gridded_Population_Density_Data/"
-GROSS_PRIMARY_PRODUCTION_DIR = "./Datasets_Hackathon/MODIS_Gross_Primary_Production_GPP/"
-LAND_COVER_DIR = "./Datasets_Hackathon/Modis_Land_Cover_Data/"
-STREAMS_ROADS_DIR = "./Datasets_Hackathon/Streamwater_Line_Road_Network/"
-DEFORESTATION_DIR = "./Datasets_Hackathon/Deforestation/"
-CLIMATECHANGE_DIR = "./Datasets_Hackathon/ClimateChange/"
-LANDCOVERCHANGE_DIR = "./Datasets_Hackathon/land_coverage_change_over_time"
-
-DATA_DIRS = {
-    "admin_layers": ADMIN_LAYERS_DIR,
-    "climate_precipitations": CLIMATE_PRECIPITATIONS_DIR,
-    "population_density": POPULATION_DENSITY_DIR,
-    "gross_primary_production": GROSS_PRIMARY_PRODUCTION_DIR,
-    "land_cover": LAND_COVER_DIR,
-    "streams_roads": STREAMS_ROADS_DIR,
-    "deforestation": DEFORESTATION_DIR,
-    "climate_change": CLIMATECHANGE_DIR,
-    "land_cover_change": LANDCOVERCHANGE_DIR
-}
-
-# Caricamento dati prezzi Assaba
-PRICE_DATA_PATH = "./Datasets_Hackathon/confronto_barkeol_kankossa.csv"
-price_df = pd.read_csv(PRICE_DATA_PATH)
-price_df['date'] = pd.to_datetime(price_df['date'])
+# Cartelle e file della regione predefinita; le altre regioni (regions.py)
+# dichiarano i propri e vengono lette solo quando selezionate
+DATA_ROOT = get_region()["root"]
+DATA_DIRS = data_dirs(DATA_ROOT, get_region()["layers"])
+
+def region_dirs(region=None):
+    region = get_region(region)
+    return data_dirs(region["root"], region["layers"])
+
+# Caricamento dati prezzi della regione (al primo utilizzo)
+@functools.lru_cache(maxsize=None)
+def get_price_df(region=None):
+    import pandas as pd
+    price_file = get_region(region)["price_file"]
+    if not price_file:
+        return pd.DataFrame(columns=["date", "admin2", "commodity", "usdprice"])
+    price_df = pd.read_csv(os.path.join(get_region(region)["root"], price_file))
+    price_df['date'] = pd.to_datetime(price_df['date'])
+    return price_df
 
 
 # ====================================================
@@ -67,47 +79,35 @@ AVAILABLE_YEARS_BY_TYPE = {
     "land_cover_change": []
 }
 
-def scan_directories_for_years():
-    for data_type, directory in DATA_DIRS.items():
-        abs_directory = os.path.abspath(directory)
-        years = set()
-        year_pairs = set()
-
-        if not os.path.exists(abs_directory):
-            continue  
-
-        shp_files = glob.glob(os.path.join(abs_directory, "**/*.shp"), recursive=True)
-        tif_files = glob.glob(os.path.join(abs_directory, "**/*.tif"), recursive=True)
-        all_files = shp_files + tif_files
-
-        for file_path in all_files:
-            filename = os.path.basename(file_path)
-            year_pair_match = re.findall(r'(?<!\d)(\d{4})_(\d{4})(?!\d)', filename)
-            if year_pair_match:
-                start_year, end_year = int(year_pair_match[0][0]), int(year_pair_match[0][1])
-                if 1900 <= start_year <= 2030 and 1900 <= end_year <= 2030:
-                    year_pairs.add(f"{start_year}_{end_year}")
-                continue
-            year_matches = re.findall(r'(?<!\d)(\d{4})(?!\d)', filename)
-            if year_matches:
-                for year_str in year_matches:
-                    try:
-                        year = int(year_str[:4])
-                        if 1900 <= year <= 2030:
-                            years.add(year)
-                    except ValueError:
-                        continue
-            else:
-                years.add("N/A")
-
-        if not years:
-            years.add("N/A")
-        if data_type not in ["deforestation", "climate_change", "land_cover_change"]:
-            AVAILABLE_YEARS_BY_TYPE[data_type] = sorted(list(years))
-        else:
-            AVAILABLE_YEARS_BY_TYPE[data_type] = list(year_pairs)
-
-scan_directories_for_years()
+_catalogs = {}
+
+# Gli anni statici sopra valgono solo per la regione predefinita; per le altre
+# regioni gli anni vengono tutti dal catalogo
+def _apply_catalog(region, catalog):
+    _catalogs[region] = catalog
+    if region == DEFAULT_REGION:
+        for data_type, layer in catalog["layers"].items():
+            AVAILABLE_YEARS_BY_TYPE[data_type] = list(layer["years"])
+    return catalog
+
+def _manifest_name(region):
+    return None if region == DEFAULT_REGION else region
+
+# Il catalogo di una regione viene letto dal manifest persistito (o ricostruito) al primo uso
+def get_catalog(region=None):
+    region = region or DEFAULT_REGION
+    if region not in _catalogs:
+        config = get_region(region)
+        _apply_catalog(region, load_catalog(config["root"], config["layers"], _manifest_name(region)))
+    return _catalogs[region]
+
+# Forza una nuova scansione delle cartelle e aggiorna il manifest
+def scan_directories_for_years(region=None):
+    region = region or DEFAULT_REGION
+    config = get_region(region)
+    catalog = build_catalog(config["root"], config["layers"])
+    save_manifest(catalog, config["root"], _manifest_name(region))
+    return _apply_catalog(region, catalog)
 
 
 # ====================================================
@@ -135,15 +135,70 @@ units_mapping = {
     # oppure "Stato" se i valori sono binari (0/1)
 }
 
-def load_available_files(data_type, year):
-    data_dir = DATA_DIRS.get(data_type)
-    if not data_dir:
-        return [], []
-    abs_directory = os.path.abspath(data_dir)
-    if not os.path.exists(abs_directory):
-        return [], []
-    shp_files = glob.glob(os.path.join(abs_directory, "**/*.shp"), recursive=True)
-    tif_files = glob.glob(os.path.join(abs_directory, "**/*.tif"), recursive=True)
+# ====================================================
+# Cache dei raster e prefetch degli anni/layer adiacenti
+# ====================================================
+# Coppie di layer che gli utenti tendono ad alternare (es. nella vista Compare):
+# un anno "storico" Y è collegato ai prodotti di anomalia Y-1_Y e Y_Y+1.
+PREFETCH_RELATED_LAYERS = {
+    "climate_precipitations": ["climate_change"],
+    "climate_change": ["climate_precipitations"],
+    "gross_primary_production": ["deforestation"],
+    "deforestation": ["gross_primary_production"],
+    "land_cover": ["land_cover_change"],
+    "land_cover_change": ["land_cover"],
+}
+
+# Con RASTER_SHARED_CACHE_DIR impostata i raster decodificati vengono condivisi
+# tra i worker tramite file .npy mappati in memoria (vedi shared_store.py)
+shared_store = SharedRasterStore(SHARED_CACHE_DIR) if SHARED_CACHE_DIR else None
+
+# Una cache per regione (le chiavi iniziano con l'id della regione); il budget
+# RASTER_CACHE_MB è diviso tra le regioni attive contemporaneamente
+REGION_CACHE_BYTES = DEFAULT_CACHE_MB * 1024 * 1024 // min(MAX_ACTIVE_REGIONS, len(REGIONS))
+
+def _new_region_cache(region):
+    return RasterCache(REGION_CACHE_BYTES,
+                       on_evict=(lambda key, value: shared_store.release(value)) if shared_store else None,
+                       on_lookup=lambda key, hit: metrics.record_cache("raster", hit))
+
+raster_cache = RegionCaches(_new_region_cache)
+
+# Raster di indici colore uint8 per (layer, anno, scala colori), vedi quantize.py
+index_cache = RegionCaches(lambda region: RasterCache(REGION_CACHE_BYTES // 4,
+                                                      on_lookup=lambda key, hit: metrics.record_cache("color_index", hit)))
+# I candidati portano il lato massimo della vista (MAP_MAX_SIZE o PREVIEW_MAX_SIZE):
+# si scalda lo stesso livello di overview che la mappa leggerà, non la risoluzione piena
+prefetcher = Prefetcher(raster_cache,
+                        lambda region, map_type, year, max_size=None:
+                            load_data(map_type, year, prefetch=True, region=region, max_size=max_size),
+                        key=lambda region, map_type, year, max_size=None:
+                            raster_key(map_type, year, region, max_size))
+
+def prefetch_candidates(map_type, year, region=None, max_size=None):
+    region = region or DEFAULT_REGION
+    if year is None or year == "N/A" or data_type_mapping.get(map_type, {}).get("type") != "geotiff":
+        return []
+    candidates = []
+    years = [y for y in get_years_for_map_type(map_type, region) if y != "N/A"]
+    if year in years:
+        index = years.index(year)
+        candidates += [(region, map_type, years[i], max_size) for i in (index + 1, index - 1) if 0 <= i < len(years)]
+
+    year_str = str(year)
+    for related in PREFETCH_RELATED_LAYERS.get(map_type, []):
+        related_years = [y for y in get_years_for_map_type(related, region) if y != "N/A"]
+        if "_" in year_str:
+            # Da una coppia di anni "A_B" ai due anni storici A e B
+            wanted = [int(y) for y in year_str.split("_")]
+        else:
+            # Da un anno Y alle anomalie che lo contengono
+            wanted = [f"{int(year) - 1}_{year}", f"{year}_{int(year) + 1}"]
+        candidates += [(region, related, y, max_size) for y in wanted if y in related_years]
+    return candidates
+
+def load_available_files(data_type, year, region=None):
+    shp_files, tif_files = layer_files(get_catalog(region), data_type)
     if data_type in ["admin_layers", "streams_roads"]:
         return shp_files, tif_files
     year_str = str(year)
@@ -168,26 +223,31 @@ map_types_deforestation = [
     {"label": "Land Cover Changes", "value": "land_cover_change"}
     ]
 
-def get_years_for_map_type(map_type):
-    years = AVAILABLE_YEARS_BY_TYPE.get(map_type, [])
+def get_years_for_map_type(map_type, region=None):
+    catalog = get_catalog(region)
+    if (region or DEFAULT_REGION) == DEFAULT_REGION:
+        years = AVAILABLE_YEARS_BY_TYPE.get(map_type, [])
+    else:
+        years = catalog["layers"].get(map_type, {}).get("years", [])
     if not years:
         return ["N/A"]
     return sorted(years)
 
 default_map_type = map_types_storic[0]['value']
-default_years = get_years_for_map_type(default_map_type)
-default_year = default_years[-1] if default_years else None
 
 # ====================================================
 # Dizionario per le traduzioni
 # ====================================================
 translations = {
     "en": {
-         "header": "Assaba Climatic Data",
+         "header": "{region} Climatic Data",
          "data_type_label": "Select Data Type:",
          "year_label": "Select Year:",
          "info_title": "Info",
          "language_label": "Select Language:",
+         "region_label": "Select Region:",
+         "clip_label": "Clip to:",
+         "clip_none": "Whole raster",
          "dropdown_option_admin_layers": "Admin Layers",
          "dropdown_option_climate_precipitations": "Climate Precipitations",
          "dropdown_option_population_density": "Population Density",
@@ -217,14 +277,28 @@ translations = {
          "district_id": "District ID",
          "minimum_value": "Minimum value",
          "maximum_value": "Maximum value",
-         "average_value": "Average value"
+         "average_value": "Average value",
+         "select_area_msg": "Draw a box or lasso on the map to plot the trend of an area",
+         "area_trend": "Historic trend of the selected area",
+         "pixels": "pixels",
+         "mean": "Mean",
+         "median": "Median",
+         "percentiles_10_90": "10th-90th percentile",
+         "percentiles_25_75": "25th-75th percentile",
+         "price_overlay_none": "None",
+         "download_layer": "Download layer values",
+         "download_zonal": "Download district statistics",
+         "download_prices": "Download price series"
     },
     "fr": {
-         "header": "Données Climatiques Assaba",
+         "header": "Données Climatiques {region}",
          "data_type_label": "Sélectionnez le type de données:",
          "year_label": "Sélectionnez l'année:",
          "info_title": "Informations",
          "language_label": "Choisir la langue:",
+         "region_label": "Choisir la région:",
+         "clip_label": "Découper sur:",
+         "clip_none": "Raster entier",
          "dropdown_option_admin_layers": "Couches Administratives",
          "dropdown_option_climate_precipitations": "Précipitations Climatiques",
          "dropdown_option_population_density": "Densité de Population",
@@ -254,14 +328,29 @@ translations = {
          "district_id": "ID du District",
          "minimum_value": "Valeur minimale",
          "maximum_value": "Valeur maximale",
-         "average_value": "Valeur moyenne"
+         "average_value": "Valeur moyenne",
+         "select_area_msg": "Dessinez un rectangle ou un lasso sur la carte pour afficher la tendance d'une zone",
+         "area_trend": "Tendance historique de la zone sélectionnée",
+         "pixels": "pixels",
+         "mean": "Moyenne",
+         "median": "Médiane",
+         "percentiles_10_90": "10e-90e percentile",
+         "percentiles_25_75": "25e-75e percentile",
+         "price_overlay_none": "Aucune",
+         "download_layer": "Télécharger les valeurs de la couche",
+         "download_zonal": "Télécharger les statistiques par district",
+         "download_prices": "Télécharger la série des prix"
     }
 }
 
+# Testi usati dalla serie storica calcolata nel browser (assets/pixel_history.js)
+HISTORY_LABELS = ["click_pixel_msg", "error_click_data", "historic_trend", "year", "value", "current_year"]
+
 # ====================================================
 # Layout con Sidebar Fissa e selezione della lingua
 # ====================================================
-app.layout = html.Div([
+# Le opzioni dei prezzi vengono riempite da una callback: il layout non legge dati
+layout = html.Div([
     # Sidebar fissa a sinistra
     html.Div(
         [
@@ -273,6 +362,20 @@ app.layout = html.Div([
                        style={"width": "100%"}),
             dbc.Button("Compare", id="compare-btn", n_clicks=0, color="secondary",
                        style={"width": "100%", "marginTop": "8px"}),
+            # Dropdown della regione: nascosto se è configurata una sola regione
+            html.Div(
+                [
+                    html.Label("Select Region:", id="wilaya-label", className="fw-bold", style={"marginTop": "20px"}),
+                    dcc.Dropdown(
+                        id="wilaya-dropdown",
+                        options=region_options(),
+                        value=DEFAULT_REGION,
+                        clearable=False,
+                        style={"width": "100%"}
+                    )
+                ],
+                style={"display": "block" if len(REGIONS) > 1 else "none"}
+            ),
             # Dropdown per la lingua posizionato in basso (spostato più in alto rispetto al precedente)
             html.Div(
                 [
@@ -306,7 +409,7 @@ app.layout = html.Div([
     html.Div(
         dbc.Container([
             dbc.Row([
-                dbc.Col(html.H1(id="header-title", children="Assaba Climatic Data", className="text-center text-primary mb-4"), width=12)
+                dbc.Col(html.H1(id="header-title", children=translations["en"]["header"].format(region=get_region()["name"]), className="text-center text-primary mb-4"), width=12)
             ]),
             dbc.Row([
                 dbc.Col([
@@ -319,7 +422,7 @@ app.layout = html.Div([
                             ),
                         ])
                     ], className="shadow-sm p-3"),
-                ], width=6),
+                ], width=4),
                 dbc.Col([
                     dbc.Card([
                         dbc.CardBody([
@@ -330,21 +433,41 @@ app.layout = html.Div([
                             ),
                         ])
                     ], className="shadow-sm p-3"),
-                ], width=6),
+                ], width=4),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.Label(id="clip-label", children="Clip to:", className="fw-bold"),
+                            dcc.Dropdown(
+                                id='clip-dropdown',
+                                value="none",
+                                clearable=False
+                            ),
+                        ])
+                    ], className="shadow-sm p-3"),
+                ], width=4),
             ], className="mb-4"),
             # Riga con mappa principale e grafico storico
             dbc.Row([
                 dbc.Col([
                     dbc.Card([
                         dbc.CardBody([
-                            dcc.Graph(id='main-map', style={'height': '100%', 'width': '100%'}, config={'editable': True, 'scrollZoom': True})
+                            # Box e lasso: serie storica dell'area selezionata
+                            dcc.Graph(id='main-map', style={'height': '100%', 'width': '100%'},
+                                      config={'editable': True, 'scrollZoom': True,
+                                              'modeBarButtonsToAdd': ['select2d', 'lasso2d']}),
+                            dcc.Store(id='main-map-level')
                         ])
                     ], className="shadow-lg p-3"),
                 ], width=6),
                 dbc.Col([
                     dbc.Card([
                         dbc.CardBody([
-                            dcc.Graph(id='historical-plot', style={'height': '100%', 'width': '100%'})
+                            dcc.Graph(id='historical-plot', style={'height': '100%', 'width': '100%'}),
+                            dcc.Store(id='pixel-cube'),
+                            dcc.Store(id='history-request'),
+                            dcc.Store(id='history-labels',
+                                      data={lang: {k: translations[lang][k] for k in HISTORY_LABELS} for lang in translations})
                         ])
                     ], className="shadow-lg p-3"),
                 ], width=6),
@@ -354,7 +477,8 @@ app.layout = html.Div([
                     dbc.Card([
                         dbc.CardBody([
                             html.H4(id="info-title", children="Info", className="text-primary"),
-                            html.Div(id='map-info')
+                            html.Div(id='map-info'),
+                            html.Div(id='download-links')
                         ])
                     ], className="shadow-sm p-3"),
                 ], width=12)
@@ -374,33 +498,42 @@ app.layout = html.Div([
                             html.Label("Select Subregion:", className="fw-bold"),
                             dcc.Dropdown(
                                 id='region-dropdown',
-                                options=[{'label': region, 'value': region} for region in sorted(price_df['admin2'].unique())],
-                                value=price_df['admin2'].unique()[0],
                                 clearable=False
                             ),
                         ])
                     ], className="shadow-sm p-3"),
-                ], width=6),
+                ], width=4),
                 dbc.Col([
                     dbc.Card([
                         dbc.CardBody([
                             html.Label("Select Commodity:", className="fw-bold"),
                             dcc.Dropdown(
                                 id='commodity-dropdown',
-                                options=[{'label': com, 'value': com} for com in sorted(price_df['commodity'].unique())],
-                                value=price_df['commodity'].unique()[0],
                                 clearable=False
                             ),
                         ])
                     ], className="shadow-sm p-3"),
-                ], width=6),
+                ], width=4),
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardBody([
+                            html.Label("Overlay Climate Layer:", className="fw-bold"),
+                            dcc.Dropdown(
+                                id='price-overlay-dropdown',
+                                value="none",
+                                clearable=False
+                            ),
+                        ])
+                    ], className="shadow-sm p-3"),
+                ], width=4),
             ], className="mb-4"),
 
             dbc.Row([
                 dbc.Col([
                     dbc.Card([
                         dbc.CardBody([
-                            dcc.Graph(id='price-trend-graph', style={'height': '500px'})
+                            dcc.Graph(id='price-trend-graph', style={'height': '500px'}),
+                            html.Div(id='price-download')
                         ])
                     ], className="shadow-lg p-3"),
                 ], width=12)
@@ -446,21 +579,23 @@ html.Div(
 )
 ])
 
-@app.callback(
+@callback(
     Output("compare-container", "style"),
     Input("compare-btn", "n_clicks"),
     prevent_initial_call=True
 )
+@instrument
 def toggle_compare(n_clicks):
     if n_clicks and n_clicks % 2 == 1:
         return {"display": "block", "marginLeft": "270px", "padding": "20px"}
     else:
         return {"display": "none", "marginLeft": "270px"}
-@app.callback(
+@callback(
     [Output("compare-map-type-1", "options"),
      Output("compare-map-type-2", "options")],
     Input("language-dropdown", "value")
 )
+@instrument
 def populate_compare_dropdowns(lang):
     all_options = [
         {"label": translations[lang]["dropdown_option_climate_precipitations"], "value": "climate_precipitations"},
@@ -473,19 +608,21 @@ def populate_compare_dropdowns(lang):
     ]
     return all_options, all_options
 
-@app.callback(
+@callback(
     [Output("compare-year-1", "options"),
      Output("compare-year-2", "options")],
     [Input("compare-map-type-1", "value"),
-     Input("compare-map-type-2", "value")]
+     Input("compare-map-type-2", "value"),
+     Input("wilaya-dropdown", "value")]
 )
-def populate_years_compare(type1, type2):
+@instrument
+def populate_years_compare(type1, type2, region=None):
     return (
-        [{"label": str(y), "value": y} for y in get_years_for_map_type(type1)],
-        [{"label": str(y), "value": y} for y in get_years_for_map_type(type2)]
+        [{"label": str(y), "value": y} for y in get_years_for_map_type(type1, region)],
+        [{"label": str(y), "value": y} for y in get_years_for_map_type(type2, region)]
     )
 
-def generate_map_figure(map_type, year, language):
+def generate_map_figure(map_type, year, language, region=None, max_size=None):
     fig = go.Figure()
     
     if year is None:
@@ -498,7 +635,7 @@ def generate_map_figure(map_type, year, language):
         )
         return fig
 
-    data, error = load_data(map_type, year)
+    data, error = load_data(map_type, year, region=region, max_size=max_size)
     if error:
         fig.update_layout(
             title=f"{translations[language]['error']}: {error}",
@@ -525,92 +662,66 @@ def generate_map_figure(map_type, year, language):
             gdf["index_col"] = gdf.index.astype(str)
             color_column = "index_col"
 
-        fig = px.choropleth_mapbox(
-            gdf,
-            geojson=gdf.geometry.__geo_interface__,
-            locations=gdf.index,
-            color=color_column,
-            color_continuous_scale=px.colors.sequential.Viridis,
-            mapbox_style="carto-positron",
-            zoom=6,
-            center={"lat": 16.7, "lon": -11.5},
-            opacity=0.7,
-            labels={color_column: color_column.replace("_", " ").title()}
-        )
+        import plotly.express as px
+        with stage("figure_build"):
+            fig = px.choropleth_mapbox(
+                gdf,
+                geojson=gdf.geometry.__geo_interface__,
+                locations=gdf.index,
+                color=color_column,
+                color_continuous_scale=px.colors.sequential.Viridis,
+                mapbox_style="carto-positron",
+                zoom=get_region(region)["zoom"],
+                center=get_region(region)["center"],
+                opacity=0.7,
+                labels={color_column: color_column.replace("_", " ").title()}
+            )
 
     elif data_info["type"] == "geotiff":
         raster_data = data.get("data")
-        bounds = data.get("bounds", (-17.0, 16.0, -8.0, 26.0))
-        minx, miny, maxx, maxy = bounds
-        height, width = raster_data.shape
-        lons = np.linspace(minx, maxx, width)
-        lats = np.linspace(maxy, miny, height)
-
-        if map_type == "gross_primary_production":
-            bp = [0, 150, 300, 450, 600, 750, 900, 1100, 1500, 4000, 60000]
-            normalized_ticks = np.linspace(0, 1, len(bp))
-            normalized_data = np.interp(raster_data, bp, normalized_ticks)
-            colorbar = dict(
-                tickmode="array",
-                tickvals=list(normalized_ticks),
-                ticktext=[str(v) for v in bp],
-                title=units_mapping.get(map_type, "")
-            )
-            fig.add_trace(go.Heatmap(
-                z=normalized_data, x=lons, y=lats,
-                colorscale="Viridis", showscale=True,
-                zmin=0, zmax=1,
-                colorbar=colorbar
-            ))
+        # Assi ai centri dei pixel, in cache per griglia
+        geometry = grid.raster_geometry(data)
+        lons, lats = geometry.x, geometry.y
+
+        # GPP, land cover, anomalie e cambi: indici uint8 in cache con scala discreta
+        style = quantize.heatmap_style(quantize.SCHEMES[map_type], units_mapping.get(map_type, "")) \
+            if map_type in quantize.SCHEMES else None
+        if map_type in ["gross_primary_production", "land_cover"]:
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, data, region)
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **style))
 
         elif map_type in ["deforestation", "climate_change"]:
-            diff_data = data.get("difference")
-            visualization_mask = np.full_like(diff_data, np.nan)
-            visualization_mask[(raster_data == 1) & (diff_data < 0)] = 0
-            visualization_mask[(raster_data == 1) & (diff_data > 0)] = 1
-            visualization_mask[raster_data == 0] = 0.5
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, data, region)
+                hover = anomaly_hover(data, "Value", "Diff")
 
-            hover_text = np.array([
-                [
-                    f"Value: {int(raster_data[i, j]) if not np.isnan(raster_data[i, j]) else 'N/A'}<br>"
-                    f"Diff: {diff_data[i, j]:.2f}" if not np.isnan(diff_data[i, j]) else "N/A"
-                    for j in range(width)
-                ]
-                for i in range(height)
-            ])
-
-            fig.add_trace(go.Heatmap(
-                z=visualization_mask, x=lons, y=lats,
-                colorscale=[[0.0, "red"], [0.5, "lightgray"], [1.0, "green"]],
-                showscale=True,
-                hoverinfo="text",
-                text=hover_text,
-                zmin=0, zmax=1
-            ))
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **hover, **style))
 
         elif map_type == "land_cover_change":
-            raster_data[raster_data == -1] = np.nan
-            fig.add_trace(go.Heatmap(
-                z=raster_data, x=lons, y=lats,
-                colorscale=[[0.0, "red"], [0.5, "lightgray"], [1.0, "green"]],
-                showscale=True,
-                zmin=0, zmax=1
-            ))
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, data, region)
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **style))
 
         else:
-            fig.add_trace(go.Heatmap(
-                z=raster_data,
-                x=lons,
-                y=lats,
-                colorscale="Viridis",
-                showscale=True,
-                colorbar=dict(title=units_mapping.get(map_type, ""))
-            ))
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(
+                    z=raster_data,
+                    x=lons,
+                    y=lats,
+                    colorscale="Viridis",
+                    showscale=True,
+                    colorbar=dict(title=units_mapping.get(map_type, ""))
+                ))
 
         fig.update_layout(
             title=f"{map_type.replace('_', ' ').title()} - {year}",
             xaxis=dict(title=translations[language]["xaxis_title"]),
-            yaxis=dict(title=translations[language]["yaxis_title"], scaleanchor="x", scaleratio=1),
+            yaxis=dict(title=translations[language]["yaxis_title"], scaleanchor="x", scaleratio=1,
+                       autorange="reversed" if geometry.y_reversed else True),
             autosize=True,
             height=500,
             margin={"r": 10, "t": 50, "l": 10, "b": 10}
@@ -618,52 +729,82 @@ def generate_map_figure(map_type, year, language):
 
     return fig
 
-@app.callback(
+@callback(
     [Output("compare-map-1", "figure"),
      Output("compare-map-2", "figure")],
     [Input("compare-map-type-1", "value"),
      Input("compare-year-1", "value"),
      Input("compare-map-type-2", "value"),
      Input("compare-year-2", "value"),
-     Input("language-dropdown", "value")]
+     Input("language-dropdown", "value"),
+     Input("wilaya-dropdown", "value")]
 )
-def update_compare_maps(type1, year1, type2, year2, language):
-    return (
-        generate_map_figure(type1, year1, language),
-        generate_map_figure(type2, year2, language)
-    )
+@instrument
+def update_compare_maps(type1, year1, type2, year2, language, region=None):
+    with prefetcher.foreground():
+        figures = (
+            generate_map_figure(type1, year1, language, region, PREVIEW_MAX_SIZE),
+            generate_map_figure(type2, year2, language, region, PREVIEW_MAX_SIZE)
+        )
+    prefetcher.schedule(prefetch_candidates(type1, year1, region, PREVIEW_MAX_SIZE)
+                        + prefetch_candidates(type2, year2, region, PREVIEW_MAX_SIZE))
+    return figures
 
 
 # ====================================================
 # Callback per aggiornare "Select Year" in base al Data Type
 # ====================================================
-@app.callback(
+@callback(
     [Output('year-dropdown', 'options'),
      Output('year-dropdown', 'value'),
      Output('year-dropdown', 'disabled')],
     [Input('map-type-dropdown', 'value'),
-     Input('language-dropdown', 'value')]
+     Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')]
 )
-def update_year_options(map_type, language):
-    years = get_years_for_map_type(map_type)
+@instrument
+def update_year_options(map_type, language, region=None):
+    years = get_years_for_map_type(map_type, region)
     options = [{"label": str(year), "value": year} for year in years]
     if not years or "N/A" in years:
         return options, "N/A", True
     default_year = max(years)
     return options, default_year, False
 
+# ====================================================
+# Opzioni del ritaglio: regione intera o uno dei suoi distretti
+# ====================================================
+@callback(
+    Output('clip-dropdown', 'options'),
+    [Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')]
+)
+@instrument
+def update_clip_options(language, region=None):
+    options = [{"label": translations[language]["clip_none"], "value": "none"}]
+    root = get_region(region)["root"]
+    try:
+        districts = masks.district_names(root)
+    except Exception:
+        return options
+    options.append({"label": get_region(region)["name"], "value": masks.REGION_TARGET})
+    options += [{"label": name, "value": str(i)} for i, name in enumerate(districts)]
+    return options
+
 # ====================================================
 # Callback per aggiornare il "Select Data Type" in base al pulsante premuto
 # ====================================================
-@app.callback(
+@callback(
     [Output('map-type-dropdown', 'options'),
      Output('map-type-dropdown', 'value'),
      Output('map-type-dropdown', 'disabled')],
     [Input('storic-data-btn', 'n_clicks'),
      Input('anomalies-btn', 'n_clicks'),
-     Input('language-dropdown', 'value')]
+     Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')]
 )
-def update_map_type_options(storic_clicks, anomalies_clicks, language):
+@instrument
+def update_map_type_options(storic_clicks, anomalies_clicks, language, region=None):
     ctx = dash.callback_context
     if not ctx.triggered:
         mode = 'storic_data'
@@ -684,7 +825,9 @@ def update_map_type_options(storic_clicks, anomalies_clicks, language):
             {"label": translations[language]["dropdown_option_land_cover"], "value": "land_cover"},
             {"label": translations[language]["dropdown_option_streams_roads"], "value": "streams_roads"}
         ]
-        default = options[0]["value"]
+        default = get_region(region)["default_map_type"]
+        if default not in [option["value"] for option in options]:
+            default = options[0]["value"]
         disabled = False
     else:
         options = [
@@ -699,52 +842,135 @@ def update_map_type_options(storic_clicks, anomalies_clicks, language):
 # ====================================================
 # Funzioni per caricare i dati (shapefile e geotiff)
 # ====================================================
-def load_data(map_type, year):
+# Area di interesse (lon/lat) per i layer vettoriali: con la cache di
+# vector_cache.py vengono lette solo le feature che la intersecano.
+# Di default è il bbox della regione attiva; DASHBOARD_VECTOR_BBOX lo sostituisce
+VECTOR_BBOX = tuple(float(v) for v in os.environ["DASHBOARD_VECTOR_BBOX"].split(",")) \
+    if os.environ.get("DASHBOARD_VECTOR_BBOX") else None
+
+def vector_bbox(region=None):
+    bbox = get_region(region)["bbox"]
+    return VECTOR_BBOX or (tuple(bbox) if bbox else None)
+
+# Pixel sul lato lungo sufficienti per la mappa principale (a zoom pieno) e per
+# le anteprime del confronto: i raster con overview vengono letti dal livello
+# più grossolano che li raggiunge. 0 = sempre risoluzione piena.
+MAP_MAX_SIZE = int(os.environ.get("DASHBOARD_MAP_MAX_SIZE", "1024"))
+PREVIEW_MAX_SIZE = int(os.environ.get("DASHBOARD_PREVIEW_MAX_SIZE", "512"))
+
+def overview_level(map_type, year, region=None, max_size=None):
+    if not max_size or data_type_mapping.get(map_type, {}).get("type") != "geotiff":
+        return None
+    shp_files, tif_files = load_available_files(map_type, year, region)
+    return overviews.pick_level(tif_files[0], max_size) if tif_files else None
+
+def _raster_key(region, map_type, year, tif_file, max_size=None, window=None):
+    # (chiave in cache, livello di overview letto da load_geotiff)
+    level = overviews.pick_level(tif_file, max_size) if max_size else None
+    key = (region, map_type, str(year)) + (() if level is None else (f"ovr{level}",))
+    if window is not None:
+        key += ("w" + ",".join(str(v) for v in window),)
+    return key, level
+
+def raster_key(map_type, year, region=None, max_size=None):
+    # Chiave in cache con cui load_data memorizzerebbe il raster (None senza file)
+    region = region or DEFAULT_REGION
+    _, tif_files = load_available_files(map_type, year, region)
+    return _raster_key(region, map_type, year, tif_files[0], max_size)[0] if tif_files else None
+
+# window = (riga, colonna, altezza, larghezza) nell'array del livello: si legge solo quella finestra
+def load_data(map_type, year, prefetch=False, region=None, max_size=None, window=None):
+    region = region or DEFAULT_REGION
     if year is None:
         return None, f"No data available for {map_type}"
     data_info = data_type_mapping.get(map_type)
     if not data_info:
         return None, "Data type not supported"
-    shp_files, tif_files = load_available_files(map_type, year)
+    with stage("catalog_lookup"):
+        shp_files, tif_files = load_available_files(map_type, year, region)
     if data_info["type"] == "shapefile" and shp_files:
-        return load_shapefile(shp_files[0])
+        return load_shapefile(shp_files[0], vector_bbox(region))
     elif data_info["type"] == "geotiff" and tif_files:
-        return load_geotiff(tif_files[0])
+        key, level = _raster_key(region, map_type, year, tif_files[0], max_size, window)
+        if shared_store is not None:
+            loader = lambda: shared_store.get_or_decode(key, overviews.source_path(tif_files[0]),
+                                                        lambda f: load_geotiff(f, level, map_type, window))
+        else:
+            loader = lambda: load_geotiff(tif_files[0], level, map_type, window)
+        return raster_cache.get_or_load(key, loader, prefetch=prefetch)
     return None, f"No file found {map_type} in {year}"
 
-def load_shapefile(shp_file):
+# raster è quello intero restituito da load_data; con clip_mask viene
+# ritagliata la finestra dell'indice già in cache
+def load_color_index(map_type, year, raster, region=None, clip_mask=None):
+    scheme = quantize.SCHEMES[map_type]
+    window = tuple(raster["window"]) if raster.get("window") is not None else None
+    key = (region or DEFAULT_REGION, map_type, str(year), raster.get("overview_level"), window, scheme["name"])
+    index, _ = index_cache.get_or_load(key, lambda: (quantize.index_raster(raster, scheme), None))
+    if clip_mask is not None:
+        index = masks.apply_clip(index, clip_mask, fill=quantize.nodata_index(scheme)).astype("uint8", copy=False)
+    return index
+
+# Tooltip delle anomalie: valore e differenza di ogni pixel come customdata
+# float32 [altezza, larghezza, 2] letto da un hovertemplate, invece di una
+# stringa Python per pixel costruita a ogni render
+def anomaly_hover(raster, value_label, diff_label):
+    customdata = np.stack([raster["data"], raster["difference"]], axis=-1).astype("float32", copy=False)
+    hovertemplate = f"{value_label}: %{{customdata[0]:.0f}}<br>{diff_label}: %{{customdata[1]:.2f}}<extra></extra>"
+    return dict(customdata=customdata, hovertemplate=hovertemplate)
+
+def load_shapefile(shp_file, bbox=VECTOR_BBOX):
+    from vector_cache import read_vector
     try:
-        gdf = gpd.read_file(shp_file)
+        with stage("vector_decode"):
+            gdf = read_vector(shp_file, bbox)
         return gdf, None
     except Exception as e:
         return None, f"Failed loading {os.path.basename(shp_file)}: {str(e)}"
 
-def load_geotiff(tif_file):
+def is_flipped(tif_file):
+    # Anomalie e cambi di copertura vengono capovolti al caricamento
+    name = os.path.basename(tif_file).lower()
+    return any(part in name for part in ("deforestation", "climatechange", "change_image"))
+
+def load_geotiff(tif_file, overview_level=None, map_type=None, window=None):
+    map_type = map_type or nodata.layer_for_file(os.path.basename(tif_file))
     try:
-        with rasterio.open(tif_file) as src:
-            raster_data = src.read(1).astype('float32')
+        from rasterio import windows
+        with stage("raster_decode"), overviews.open_level(tif_file, overview_level) as src:
+            # Anomalie e cambi di copertura vengono capovolti: la geometria della
+            # griglia (grid.py) ne tiene conto tramite 'flipped'
+            flipped = is_flipped(tif_file)
+            file_window = None
+            if window is not None:
+                # Finestra dell'array -> righe del file (capovolte per i raster capovolti)
+                row, col, height, width = window
+                file_window = windows.Window(col, src.height - row - height if flipped else row, width, height)
+            # Sentinelle del layer + nodata del file risolti una volta in una maschera
+            raster_data, nodata_mask = nodata.read_band(src, 1, map_type, window=file_window)
             if src.count > 1:
-                difference_data = src.read(2).astype('float32')
+                difference_data, _ = nodata.read_band(src, 2, window=file_window)
             else:
-                difference_data = np.full(raster_data.shape, np.nan)
-            if "deforestation" in os.path.basename(tif_file).lower() or "climatechange" in os.path.basename(tif_file).lower():
-                raster_data[raster_data == -1] = np.nan 
+                difference_data = np.full(raster_data.shape, np.nan, dtype='float32')
+            if flipped:
                 raster_data = np.flipud(raster_data)
+                nodata_mask = np.flipud(nodata_mask)
                 difference_data = np.flipud(difference_data)
-                
-            if "change_image" in os.path.basename(tif_file).lower():
-                raster_data[raster_data == -1] = np.nan 
-                raster_data = np.flipud(raster_data)
-            if src.nodata is not None:
-                raster_data = raster_data.astype('float32')
-                raster_data[raster_data == src.nodata] = np.nan
-                difference_data[difference_data == src.nodata] = np.nan
             return {
                 'data': raster_data,
                 'difference': difference_data,
-                'bounds': src.bounds,
+                'nodata': nodata_mask,
+                'statistics': nodata.valid_statistics(raster_data, nodata_mask),
+                'bounds': src.bounds if file_window is None else windows.bounds(file_window, src.transform),
                 'crs': src.crs,
-                'transform': src.transform,
+                'transform': src.transform if file_window is None else src.window_transform(file_window),
+                'flipped': flipped,
+                'overview_level': overview_level,
+                'window': window,
+                # Griglia intera del livello: le maschere di ritaglio sono in cache per griglia (masks.py)
+                'grid_transform': src.transform,
+                'grid_shape': src.shape,
+                'file_statistics': overviews.band_statistics(src),
                 'filename': os.path.basename(tif_file)
             }, None
     except Exception as e:
@@ -753,14 +979,96 @@ def load_geotiff(tif_file):
 # ====================================================
 # Callback per aggiornare la mappa e le info
 # ====================================================
-@app.callback(
+# Lato lungo richiesto per la vista corrente: zoomando la frazione visibile si
+# riduce e serve un livello di overview più fine (fino alla risoluzione piena)
+def map_max_size(map_type, year, region=None, relayout=None):
+    if not MAP_MAX_SIZE:
+        return None
+    if not relayout or "xaxis.range[0]" not in relayout:
+        return MAP_MAX_SIZE
+    data, error = load_data(map_type, year, region=region, max_size=MAP_MAX_SIZE)
+    if error or data is None:
+        return MAP_MAX_SIZE
+    minx, miny, maxx, maxy = data["bounds"]
+    fraction = abs(relayout["xaxis.range[1]"] - relayout["xaxis.range[0]"]) / max(maxx - minx, 1e-12)
+    if "yaxis.range[0]" in relayout:
+        fraction = min(fraction, abs(relayout["yaxis.range[1]"] - relayout["yaxis.range[0]"]) / max(maxy - miny, 1e-12))
+    return int(MAP_MAX_SIZE / max(min(fraction, 1.0), 1e-6))
+
+# Margine letto attorno all'area visibile (frazione del lato per parte): i pan
+# piccoli restano dentro la finestra già disegnata e non rileggono il raster
+VIEW_MARGIN = 0.5
+
+def map_window(map_type, year, region=None, max_size=None, relayout=None):
+    # (finestra visibile, finestra da leggere) nell'array del livello scelto, come
+    # (riga, colonna, altezza, larghezza); None se si disegna il livello intero, cioè
+    # senza zoom o se lo zoom non richiede un livello più fine di quello a zoom pieno
+    if not relayout or "xaxis.range[0]" not in relayout or "yaxis.range[0]" not in relayout:
+        return None, None
+    _, tif_files = load_available_files(map_type, year, region)
+    if not tif_files:
+        return None, None
+    level = overviews.pick_level(tif_files[0], max_size)
+    if level == overviews.pick_level(tif_files[0], MAP_MAX_SIZE):
+        return None, None
+    with overviews.open_level(tif_files[0], level) as src:
+        geometry = grid.geometry(tuple(src.transform)[:6], src.shape, is_flipped(tif_files[0]))
+    height, width = geometry.shape
+    xs = [relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]]
+    ys = [relayout["yaxis.range[0]"], relayout["yaxis.range[1]"]]
+    corners = [geometry.inverse * (x, y) for x in xs for y in ys]
+    col0, col1 = min(c[0] for c in corners), max(c[0] for c in corners)
+    row0, row1 = min(c[1] for c in corners), max(c[1] for c in corners)
+
+    def clamp(r0, r1, c0, c1):
+        r0, c0 = max(int(np.floor(r0)), 0), max(int(np.floor(c0)), 0)
+        r1, c1 = min(int(np.ceil(r1)), height), min(int(np.ceil(c1)), width)
+        return (r0, c0, r1 - r0, c1 - c0) if r1 > r0 and c1 > c0 else None
+
+    view = clamp(row0, row1, col0, col1)
+    if view is None:
+        return None, None
+    dr, dc = (row1 - row0) * VIEW_MARGIN, (col1 - col0) * VIEW_MARGIN
+    return view, clamp(row0 - dr, row1 + dr, col0 - dc, col1 + dc)
+
+def _window_contains(outer, inner):
+    row, col, height, width = outer
+    r, c, h, w = inner
+    return row <= r and col <= c and r + h <= row + height and c + w <= col + width
+
+@callback(
     [Output('main-map', 'figure'),
-     Output('map-info', 'children')],
+     Output('map-info', 'children'),
+     Output('main-map-level', 'data')],
     [Input('map-type-dropdown', 'value'),
      Input('year-dropdown', 'value'),
-     Input('language-dropdown', 'value')]
+     Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value'),
+     Input('clip-dropdown', 'value'),
+     Input('main-map', 'relayoutData')],
+    State('main-map-level', 'data')
 )
-def update_map(map_type, year, language):
+@instrument
+def update_map(map_type, year, language, region=None, clip=None, relayout=None, current_level=None):
+    zoomed = relayout is not None and dash.callback_context.triggered_id == "main-map"
+    if zoomed and data_type_mapping.get(map_type, {}).get("type") != "geotiff":
+        raise PreventUpdate
+    max_size = map_max_size(map_type, year, region, relayout if zoomed else None)
+    level = overview_level(map_type, year, region, max_size)
+    # Con uno zoom che richiede un livello più fine si legge solo la finestra visibile (più margine)
+    view, window = map_window(map_type, year, region, max_size, relayout) if zoomed else (None, None)
+    # Zoom e pan ridisegnano la mappa solo se cambia il livello o se l'area
+    # visibile esce dalla finestra già disegnata
+    current = current_level if isinstance(current_level, dict) else {"level": current_level, "window": None}
+    if zoomed and level == current["level"] and (
+            current["window"] is None or (view is not None and _window_contains(current["window"], view))):
+        raise PreventUpdate
+    with prefetcher.foreground():
+        fig, info = render_main_map(map_type, year, language, region, max_size, clip, window)
+    prefetcher.schedule(prefetch_candidates(map_type, year, region, MAP_MAX_SIZE))
+    return fig, info, {"level": level, "window": list(window) if window else None}
+
+def render_main_map(map_type, year, language, region=None, max_size=None, clip=None, window=None):
     fig = go.Figure()
     
     if year is None:
@@ -775,7 +1083,7 @@ def update_map(map_type, year, language):
         )
         return fig, html.P(title)
     
-    data, error = load_data(map_type, year)
+    data, error = load_data(map_type, year, region=region, max_size=max_size, window=window)
     if error:
         error_message = f"{translations[language]['error']}: {error}"
         fig.update_layout(
@@ -810,31 +1118,51 @@ def update_map(map_type, year, language):
             color_title = translations[language]["district_id"]
         else:
             color_title = color_column.replace('_', ' ').title()
-        fig = px.choropleth_mapbox(
-            gdf,
-            geojson=gdf.geometry.__geo_interface__,
-            locations=gdf.index,
-            color=color_column,
-            color_continuous_scale=px.colors.sequential.Viridis,
-            mapbox_style="carto-positron",
-            zoom=6,
-            center={"lat": 16.7, "lon": -11.5},
-            opacity=0.7,
-            labels={color_column: color_title}
-        )
+        import plotly.express as px
+        with stage("figure_build"):
+            fig = px.choropleth_mapbox(
+                gdf,
+                geojson=gdf.geometry.__geo_interface__,
+                locations=gdf.index,
+                color=color_column,
+                color_continuous_scale=px.colors.sequential.Viridis,
+                mapbox_style="carto-positron",
+                zoom=get_region(region)["zoom"],
+                center=get_region(region)["center"],
+                opacity=0.7,
+                labels={color_column: color_title}
+            )
         info = []
     
     elif data_info["type"] == "geotiff":
         raster = data
         if raster is None:
             return fig, html.P(translations[language]["error_loading_geotiff"])
+
+        # Ritaglio sulla regione o su un distretto: slice della finestra + maschera bit-packed in cache
+        clip_mask = None
+        full_raster = raster
+        if clip and clip != "none":
+            clip_mask = masks.raster_clip_mask(raster, clip, get_region(region)["root"])
+            if clip_mask is None and raster.get("window") is not None and raster.get("crs") is not None:
+                # Finestra zoomata fuori dal poligono: nessun pixel da mostrare
+                height, width = raster["data"].shape
+                clip_mask = {"window": (0, 0, height, width),
+                             "bits": np.packbits(np.zeros((height, width), dtype=bool), axis=1), "pixels": 0}
+        if clip_mask is not None:
+            with stage("transform"):
+                raster = data = dict(raster, data=masks.apply_clip(raster["data"], clip_mask),
+                                     difference=masks.apply_clip(raster["difference"], clip_mask),
+                                     nodata=masks.apply_clip(raster["nodata"], clip_mask, fill=True),
+                                     bounds=masks.clip_bounds(clip_mask, raster["transform"]))
+                raster["statistics"] = nodata.valid_statistics(raster["data"], raster["nodata"])
         
         raster_data = raster.get('data')
-        bounds = raster.get('bounds', (-17.0, 16.0, -8.0, 26.0))
-        minx, miny, maxx, maxy = bounds
-        height, width = raster_data.shape
-        lons = np.linspace(minx, maxx, width)
-        lats = np.linspace(maxy, miny, height)
+        # Assi ai centri dei pixel (della sola finestra se ritagliato), in cache per griglia
+        geometry = grid.raster_geometry(full_raster)
+        if clip_mask is not None:
+            geometry = geometry.window(*clip_mask["window"])
+        lons, lats = geometry.x, geometry.y
         fig = go.Figure()
         
         # Ottieni il nome tradotto del tipo di mappa
@@ -849,109 +1177,223 @@ def update_map(map_type, year, language):
             {"label": translations[language]["dropdown_option_climate_change"], "value": "climate_change"}
         ] if item["value"] == map_type), map_type.replace('_', ' ').title())
         
-        if map_type == "gross_primary_production":
-            bp = [0, 150, 300, 450, 600, 750, 900, 1100, 1500, 4000, 60000]
-            normalized_ticks = np.linspace(0, 1, len(bp))
-            normalized_data = np.interp(raster_data, bp, normalized_ticks)
-            colorbar = dict(
-                tickmode="array",
-                tickvals=list(normalized_ticks),
-                ticktext=[str(v) for v in bp],
-                title=units_mapping.get(map_type, "")
-            )
-            fig.add_trace(go.Heatmap(z=normalized_data, x=lons, y=lats,
-                                       colorscale="Viridis", showscale=True,
-                                       zmin=0, zmax=1, colorbar=colorbar))
+        # GPP, land cover, anomalie e cambi: indici uint8 in cache (quantize.py)
+        # inviati come z uint8 con una scala colori discreta
+        style = quantize.heatmap_style(quantize.SCHEMES[map_type], units_mapping.get(map_type, "")) \
+            if map_type in quantize.SCHEMES else None
+        if map_type in ["gross_primary_production", "land_cover"]:
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, full_raster, region, clip_mask)
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **style))
         elif map_type == "deforestation" or map_type == "climate_change":
-            raster_data = data["data"]
-            diff_data = data["difference"]
-            # Nuova scala colori: valori bassi in un colore neutro che sfuma in rosso per valori alti
-            # Maschera i valori dove raster_data != 1
-                # Inizializziamo la visualizzazione con NaN (punti esclusi)
-            visualization_mask = np.full_like(diff_data, np.nan)
-
-            # Dove `raster_data == 1` e `diff < 0`, coloriamo di rosso (0)
-            visualization_mask[(raster_data == 1) & (diff_data < 0)] = 0  
-
-            # Dove `raster_data == 1` e `diff > 0`, coloriamo di verde (1)
-            visualization_mask[(raster_data == 1) & (diff_data > 0)] = 1  
-
-            # Dove `raster_data == 0`, coloriamo di grigio (0.5) ma mostriamo il valore di `diff` nel tooltip
-            visualization_mask[raster_data == 0] = 0.5 
-            custom_colorscale = [
-                [0.0, "red"],
-                [0.5, "lightgray"],
-                [1.0, "green"]
-            ]
-            if map_type == "deforestation":
-                hover_text = np.array([
-                    [
-                        f"{translations[language]['dropdown_option_deforestation']}: {int(raster_data[i, j]) if not np.isnan(raster_data[i, j]) else 'N/A'}<br>"
-                        f"CO₂ Diff: {diff_data[i, j]:.2f}" if not np.isnan(diff_data[i, j]) else "N/A"
-                        for j in range(width)
-                    ] 
-                    for i in range(height)
-                ])
-            else:
-                hover_text = np.array([
-                    [
-                        f"Precipitation anomalies: {int(raster_data[i, j]) if not np.isnan(raster_data[i, j]) else 'N/A'}<br>"
-                        f"Prec Diff: {diff_data[i, j]:.2f}" if not np.isnan(diff_data[i, j]) else "N/A"
-                        for j in range(width)
-                    ] 
-                    for i in range(height)
-                ])
-            fig.add_trace(go.Heatmap(z=visualization_mask, x=lons, y=lats,
-                                       colorscale=custom_colorscale, showscale=True,
-                                       hoverinfo="text", text=hover_text, zmin=0, zmax=1))
+            # Rosso = anomalia con differenza negativa, verde = positiva,
+            # grigio = nessuna anomalia (il valore di `diff` resta nel tooltip)
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, full_raster, region, clip_mask)
+                if map_type == "deforestation":
+                    hover = anomaly_hover(data, translations[language]['dropdown_option_deforestation'], "CO₂ Diff")
+                else:
+                    hover = anomaly_hover(data, "Precipitation anomalies", "Prec Diff")
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **hover, **style))
         elif map_type == "land_cover_change":
-            raster_data[raster_data == -1] = np.nan
-            custom_colorscale = [
-                [0.0, "red"],
-                [0.5, "lightgray"],
-                [1.0, "green"]
-            ]
-            fig.add_trace(go.Heatmap(z=raster_data, x=lons, y=lats,
-                            colorscale=custom_colorscale, showscale=True,
-                            zmin=0, zmax=1))
+            with stage("transform"):
+                color_index = load_color_index(map_type, year, full_raster, region, clip_mask)
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=color_index, x=lons, y=lats, **style))
         else:
-            fig.add_trace(go.Heatmap(z=raster_data, x=lons, y=lats,
-                                       colorscale="Viridis", showscale=True,
-                                       colorbar=dict(title=units_mapping.get(map_type, ""))))
+            with stage("figure_build"):
+                fig.add_trace(go.Heatmap(z=raster_data, x=lons, y=lats,
+                                           colorscale="Viridis", showscale=True,
+                                           colorbar=dict(title=units_mapping.get(map_type, ""))))
         
         fig.update_layout(
             title=f"{map_type_display} - {year}",
             xaxis=dict(title=translations[language]["xaxis_title"]),
-            yaxis=dict(title=translations[language]["yaxis_title"], scaleanchor="x", scaleratio=1),
+            yaxis=dict(title=translations[language]["yaxis_title"], scaleanchor="x", scaleratio=1,
+                       autorange="reversed" if geometry.y_reversed else True),
             autosize=True,
             height=700,
-            margin={"r": 10, "t": 50, "l": 10, "b": 10}
+            margin={"r": 10, "t": 50, "l": 10, "b": 10},
+            # Mantiene lo zoom quando la mappa viene riletta da un altro livello di overview
+            uirevision=f"{region}-{map_type}-{year}-{clip}"
         )
-        masked_data = np.where(raster_data == 65533, np.nan, raster_data)
+        # Statistiche dei pixel validi calcolate al caricamento; se il raster è
+        # letto da un'overview o a finestra, quelle del file intero dal .aux.xml (se presenti)
+        statistics = raster.get('statistics')
+        partial = raster.get('overview_level') is not None or raster.get('window') is not None
+        if partial and clip_mask is None and raster.get('file_statistics'):
+            statistics = raster['file_statistics']
+        if statistics is not None:
+            minimum, maximum, mean = statistics["minimum"], statistics["maximum"], statistics["mean"]
+        else:
+            minimum = maximum = mean = np.nan
         # Informazioni tradotte
         info = [
            html.P([
-                html.Span(f"{translations[language]['minimum_value']}: {np.nanmin(masked_data):.2f}"),
+                html.Span(f"{translations[language]['minimum_value']}: {minimum:.2f}"),
                 html.Span("  |  "),
-                html.Span(f"{translations[language]['maximum_value']}: {np.nanmax(masked_data):.2f}"),
+                html.Span(f"{translations[language]['maximum_value']}: {maximum:.2f}"),
                 html.Span("  |  "),
-                html.Span(f"{translations[language]['average_value']}: {np.nanmean(masked_data):.2f}")
+                html.Span(f"{translations[language]['average_value']}: {mean:.2f}")
             ])
         ]
     
     return fig, info
 
 # ====================================================
-# Callback per aggiornare il grafico storico al click sulla mappa
+# Serie storica del pixel: nel browser dal cubo degli anni, se disponibile
 # ====================================================
-@app.callback(
-    Output('historical-plot', 'figure'),
+# Il cubo del layer selezionato (year_cube.py) viene spedito una volta nel
+# dcc.Store "pixel-cube"; la callback clientside (assets/pixel_history.js)
+# disegna la serie al click. Senza cubo (layer non raster o regione troppo
+# grande) la richiesta arriva al server in "history-request".
+cube_cache = RegionCaches(lambda region: RasterCache(REGION_CACHE_BYTES // 2,
+                                                     on_lookup=lambda key, hit: metrics.record_cache("year_cube", hit)))
+
+def history_value_key(map_type):
+    return "difference" if map_type in ["deforestation", "climate_change"] else "data"
+
+def load_year_cube(map_type, region=None):
+    region = region or DEFAULT_REGION
+
+    def build():
+        rasters = []
+        for year in get_years_for_map_type(map_type, region):
+            data, error = load_data(map_type, year, region=region)
+            if not error and data is not None:
+                rasters.append((year, data))
+        if not rasters:
+            return None, f"No data available for {map_type}"
+        with stage("transform"):
+            cube = year_cube.stack(rasters, history_value_key(map_type))
+        if cube is None:
+            return None, f"Rasters of {map_type} are not on the same grid"
+        return cube, None
+
+    return cube_cache.get_or_load((region, map_type, "cube"), build)
+
+@callback(
+    Output('pixel-cube', 'data'),
+    [Input('map-type-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')]
+)
+@instrument
+def update_pixel_cube(map_type, region=None):
+    if data_type_mapping.get(map_type, {}).get("type") != "geotiff" or get_years_for_map_type(map_type, region) == ["N/A"]:
+        return None
+    with prefetcher.foreground():
+        cube, error = load_year_cube(map_type, region)
+    if error or cube is None:
+        return None
+    with stage("serialize"):
+        return year_cube.client_payload(cube, map_type, region or DEFAULT_REGION)
+
+clientside_callback(
+    ClientsideFunction(namespace="pixelHistory", function_name="plot"),
+    [Output('historical-plot', 'figure'),
+     Output('history-request', 'data')],
     [Input('main-map', 'clickData'),
      Input('map-type-dropdown', 'value'),
      Input('year-dropdown', 'value'),
-     Input('language-dropdown', 'value')]
+     Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')],
+    [State('pixel-cube', 'data'),
+     State('history-labels', 'data')]
+)
+
+@callback(
+    Output('historical-plot', 'figure', allow_duplicate=True),
+    Input('history-request', 'data'),
+    prevent_initial_call=True
+)
+@instrument
+def pixel_history_fallback(request):
+    if not request:
+        raise PreventUpdate
+    return update_historical_plot(request.get("clickData"), request.get("map_type"), request.get("year"),
+                                  request.get("language", "en"), request.get("region"))
+
+# ====================================================
+# Serie storica di un'area (box o lasso sulla mappa principale)
+# ====================================================
+# Le statistiche per anno (media, mediana, percentili) vengono calcolate sul
+# cubo degli anni con una sola maschera booleana della selezione.
+def selection_polygon(selectedData):
+    # Vertici della selezione di Plotly: "range" per il box, "lassoPoints" per il lasso
+    if selectedData.get("range"):
+        (x0, x1), (y0, y1) = selectedData["range"]["x"], selectedData["range"]["y"]
+        return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+    if selectedData.get("lassoPoints"):
+        points = list(zip(selectedData["lassoPoints"]["x"], selectedData["lassoPoints"]["y"]))
+        return points if len(points) >= 3 else None
+    return None
+
+@callback(
+    Output('historical-plot', 'figure', allow_duplicate=True),
+    Input('main-map', 'selectedData'),
+    [State('map-type-dropdown', 'value'),
+     State('year-dropdown', 'value'),
+     State('language-dropdown', 'value'),
+     State('wilaya-dropdown', 'value')],
+    prevent_initial_call=True
 )
-def update_historical_plot(clickData, map_type, current_year, language):
+@instrument
+def update_area_history(selectedData, map_type, current_year, language, region=None):
+    if not selectedData:
+        raise PreventUpdate
+    fig = go.Figure()
+    if data_type_mapping.get(map_type, {}).get("type") != "geotiff":
+        fig.update_layout(title=translations[language]["storic_not_available"])
+        return fig
+    polygon = selection_polygon(selectedData)
+    if polygon is None:
+        fig.update_layout(title=translations[language]["select_area_msg"])
+        return fig
+
+    with prefetcher.foreground():
+        cube, error = load_year_cube(map_type, region)
+    if error or cube is None:
+        fig.update_layout(title=f"{translations[language]['error']}: {error}")
+        return fig
+    with stage("transform"):
+        stats = year_cube.area_statistics(cube, year_cube.selection_mask(cube, polygon))
+    if stats is None:
+        fig.update_layout(title=translations[language]["select_area_msg"])
+        return fig
+
+    years = stats["years"]
+    with stage("figure_build"):
+        # Fasce dei percentili (10-90 e 25-75) sotto mediana e media
+        for low, high, label, color in [("p10", "p90", "percentiles_10_90", "rgba(31,119,180,0.15)"),
+                                        ("p25", "p75", "percentiles_25_75", "rgba(31,119,180,0.3)")]:
+            fig.add_trace(go.Scatter(x=years, y=stats[low], mode="lines", line=dict(width=0),
+                                     showlegend=False, hoverinfo="skip"))
+            fig.add_trace(go.Scatter(x=years, y=stats[high], mode="lines", line=dict(width=0),
+                                     fill="tonexty", fillcolor=color, name=translations[language][label]))
+        fig.add_trace(go.Scatter(x=years, y=stats["median"], mode="lines+markers",
+                                 name=translations[language]["median"]))
+        fig.add_trace(go.Scatter(x=years, y=stats["mean"], mode="lines", line=dict(dash="dash"),
+                                 name=translations[language]["mean"]))
+        if current_year in years:
+            index = years.index(current_year)
+            fig.add_trace(go.Scatter(x=[current_year], y=[stats["median"][index]], mode="markers",
+                                     marker=dict(size=12, color="red"),
+                                     name=translations[language]["current_year"]))
+        fig.update_layout(
+            title=f"{translations[language]['area_trend']} ({stats['pixels']} {translations[language]['pixels']})",
+            xaxis_title=translations[language]["year"],
+            yaxis_title=translations[language]["value"],
+            height=700,
+            margin={"r": 10, "t": 50, "l": 10, "b": 10}
+        )
+    return fig
+
+# ====================================================
+# Grafico storico calcolato sul server (fallback della versione clientside)
+# ====================================================
+def update_historical_plot(clickData, map_type, current_year, language, region=None):
     if clickData is None:
         fig = go.Figure()
         fig.update_layout(title=translations[language]["click_pixel_msg"])
@@ -972,29 +1414,30 @@ def update_historical_plot(clickData, map_type, current_year, language):
         fig.update_layout(title=translations[language]["error_click_data"])
         return fig
 
-    years = get_years_for_map_type(map_type)
+    years = get_years_for_map_type(map_type, region)
     values = []
     valid_years = []
     for year in years:
-        data, error = load_data(map_type, year)
+        with prefetcher.foreground():
+            data, error = load_data(map_type, year, region=region)
         if error or data is None:
             values.append(np.nan)
             valid_years.append(year)
             continue
         raster = data
         raster_data = raster.get('data')
-        transform = raster.get('transform')
         if map_type in ["deforestation", "climate_change"]:
             diff = raster.get('difference')
         try:
-            col, row = ~transform * (lon, lat)
-            col = int(round(col))
-            row = int(round(row))
-            if row < 0 or row >= raster_data.shape[0] or col < 0 or col >= raster_data.shape[1]:
+            # Pixel che contiene il punto, tenendo conto dei raster capovolti
+            row, col, inside = grid.raster_geometry(raster).rowcol(lon, lat)
+            if not inside:
                 pixel_value = np.nan
             else:
                 if map_type in ["deforestation", "climate_change"]:
                     pixel_value = diff[row,col]
+                elif raster['nodata'][row, col]:
+                    pixel_value = np.nan
                 else:
                     pixel_value = raster_data[row, col]
         except Exception as e:
@@ -1027,50 +1470,440 @@ def update_historical_plot(clickData, map_type, current_year, language):
     )
     return fig
 
+# ====================================================
+# API REST: serie storiche di molti punti in una chiamata
+# ====================================================
+# GET /api/pixels?layer=gross_primary_production&points=lon,lat;lon,lat[&region=...]
+# oppure POST con JSON {"layer": ..., "points": [[lon, lat], ...], "region": ...}
+# per le liste lunghe (notebook, join con i prezzi WFP). I punti sono lon/lat
+# WGS84, riproiettati nel CRS del raster; i valori vengono letti dal cubo degli
+# anni in cache con un solo indicizzamento vettoriale.
+API_MAX_POINTS = int(os.environ.get("DASHBOARD_API_MAX_POINTS", "100000"))
+
+def parse_points(points):
+    # "lon,lat;lon,lat" oppure [[lon, lat], ...] -> array (n, 2)
+    if isinstance(points, str):
+        points = [point.split(",") for point in points.split(";") if point.strip()]
+    coords = np.asarray(points, dtype="float64")
+    if coords.ndim != 2 or coords.shape[1] != 2 or not np.isfinite(coords).all():
+        raise ValueError("points must be lon,lat pairs")
+    return coords
+
+@instrument
+def pixels_api():
+    from flask import request
+
+    params = dict(request.args)
+    if request.method == "POST":
+        params.update(request.get_json(silent=True) or {})
+    layer = params.get("layer")
+    region = params.get("region") or DEFAULT_REGION
+    if region not in REGIONS:
+        return jsonify({"error": f"Unknown region: {region}"}), 400
+    if data_type_mapping.get(layer, {}).get("type") != "geotiff":
+        return jsonify({"error": f"Unknown raster layer: {layer}"}), 400
+    try:
+        coords = parse_points(params.get("points") or [])
+    except (TypeError, ValueError):
+        return jsonify({"error": "points must be lon,lat pairs separated by ';'"}), 400
+    if len(coords) == 0 or len(coords) > API_MAX_POINTS:
+        return jsonify({"error": f"Between 1 and {API_MAX_POINTS} points are required"}), 400
+
+    with prefetcher.foreground():
+        cube, error = load_year_cube(layer, region)
+    if error or cube is None:
+        return jsonify({"error": error or f"No data available for {layer}"}), 404
+    with stage("transform"):
+        xs, ys = year_cube.lonlat_to_crs(cube, coords[:, 0], coords[:, 1])
+        values = year_cube.sample(cube, xs, ys)
+    with stage("serialize"):
+        # NaN non è JSON valido: pixel senza dato o fuori griglia -> null
+        values = np.where(np.isnan(values), None, values.astype(object)).tolist()
+        return jsonify({
+            "layer": layer,
+            "region": region,
+            "years": cube["years"],
+            "points": coords.tolist(),
+            "values": values,
+        })
+
 # ====================================================
 # Callback per aggiornare il grafico dei prezzi
 # ====================================================
 
-@app.callback(
+@callback(
+    [Output('region-dropdown', 'options'),
+     Output('region-dropdown', 'value'),
+     Output('commodity-dropdown', 'options'),
+     Output('commodity-dropdown', 'value')],
+    [Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')],
+    [State('region-dropdown', 'value'),
+     State('commodity-dropdown', 'value')]
+)
+@instrument
+def populate_price_dropdowns(lang, wilaya, selected_region, selected_commodity):
+    price_df = get_price_df(wilaya)
+    regions = price_df['admin2'].unique()
+    commodities = price_df['commodity'].unique()
+    if selected_region not in regions:
+        selected_region = regions[0] if len(regions) else None
+    if selected_commodity not in commodities:
+        selected_commodity = commodities[0] if len(commodities) else None
+    return ([{'label': region, 'value': region} for region in sorted(regions)], selected_region,
+            [{'label': com, 'value': com} for com in sorted(commodities)], selected_commodity)
+
+# ====================================================
+# Layer climatici sui mercati, sovrapposti al grafico dei prezzi
+# ====================================================
+# La tabella mercato x data x layer (market_join.py) viene costruita una volta
+# per regione dai cubi degli anni; il grafico dei prezzi la filtra soltanto.
+# Un lock per regione: le prime richieste concorrenti aspettano la stessa
+# costruzione invece di ricaricare ognuna tutti i cubi (serve.py la fa nel preload).
+_market_tables = {}
+_market_locks = {}
+_market_lock = threading.Lock()
+
+def market_layers(region=None):
+    # Layer raster con anni di calendario (non gli intervalli delle anomalie)
+    return [map_type for map_type, info in data_type_mapping.items()
+            if info["type"] == "geotiff"
+            and all(isinstance(year, int) for year in get_years_for_map_type(map_type, region))]
+
+def get_market_table(region=None):
+    region = region or DEFAULT_REGION
+    with _market_lock:
+        if region in _market_tables:
+            return _market_tables[region]
+        lock = _market_locks.setdefault(region, threading.Lock())
+    with lock:
+        with _market_lock:
+            if region in _market_tables:
+                return _market_tables[region]
+        cubes = {}
+        for map_type in market_layers(region):
+            with prefetcher.foreground():
+                cube, error = load_year_cube(map_type, region)
+            if not error and cube is not None:
+                cubes[map_type] = cube
+        with stage("transform"):
+            table = market_join.market_table(cubes, get_price_df(region))
+        with _market_lock:
+            _market_tables[region] = table
+    return table
+
+@callback(
+    Output('price-overlay-dropdown', 'options'),
+    [Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value')]
+)
+@instrument
+def populate_price_overlay(lang, wilaya=None):
+    return [{"label": translations[lang]["price_overlay_none"], "value": "none"}] + [
+        {"label": translations[lang][f"dropdown_option_{map_type}"], "value": map_type}
+        for map_type in market_layers(wilaya)
+    ]
+
+@callback(
     Output('price-trend-graph', 'figure'),
     [Input('region-dropdown', 'value'),
-     Input('commodity-dropdown', 'value')]
+     Input('commodity-dropdown', 'value'),
+     Input('price-overlay-dropdown', 'value')],
+    [State('wilaya-dropdown', 'value'),
+     State('language-dropdown', 'value')]
 )
-
-def update_price_graph(selected_region, selected_commodity):
-    filtered_df = price_df[(price_df['admin2'] == selected_region) & (price_df['commodity'] == selected_commodity)]
+@instrument
+def update_price_graph(selected_region, selected_commodity, overlay=None, wilaya=None, lang="en"):
+    if selected_region is None or selected_commodity is None:
+        return go.Figure()
+    import plotly.express as px
+    price_df = get_price_df(wilaya)
+    with stage("transform"):
+        filtered_df = price_df[(price_df['admin2'] == selected_region) & (price_df['commodity'] == selected_commodity)]
     fig = px.line(filtered_df, x='date', y='usdprice',
                   title=f'Price trend of {selected_commodity} - {selected_region}',
                   labels={'usdprice': 'Price (USD)', 'date': 'Data'})
     fig.update_layout(autosize=True, margin={"r":10,"t":50,"l":10,"b":10})
+    if overlay and overlay != "none":
+        table = get_market_table(wilaya)
+        with stage("transform"):
+            layer_df = table[(table['layer'] == overlay) & table['market'].isin(filtered_df['market'].unique())]
+        label = translations[lang or "en"].get(f"dropdown_option_{overlay}", overlay)
+        fig.update_traces(name='Price (USD)', showlegend=True)
+        for market, market_df in layer_df.groupby('market'):
+            fig.add_trace(go.Scatter(x=market_df['date'], y=market_df['value'], mode='lines',
+                                     line=dict(dash='dot', shape='hv'), yaxis='y2',
+                                     name=f"{label} - {market}"))
+        units = units_mapping.get(overlay)
+        fig.update_layout(yaxis2=dict(title=f"{label} ({units})" if units else label,
+                                      overlaying='y', side='right', showgrid=False),
+                          legend=dict(orientation='h', y=-0.2))
     return fig
 
 
+# ====================================================
+# Download in streaming di valori, statistiche dei distretti e prezzi
+# ====================================================
+# dcc.Download spedirebbe l'intero file dentro la risposta della callback:
+# le callback generano solo i link, e i file sono serviti da route Flask che
+# scrivono a blocchi (exports.py), senza costruire tutto in memoria.
+def _download_response(chunks, fmt, filename):
+    from flask import Response, stream_with_context
+    return Response(stream_with_context(exports.stream(chunks, fmt)), mimetype=exports.FORMATS[fmt],
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'})
+
+def _download_params(fmt):
+    # (parametri, errore) comuni alle route dei layer
+    from flask import request
+    if fmt not in exports.FORMATS:
+        return None, (jsonify({"error": f"Unsupported format: {fmt}"}), 400)
+    params = dict(request.args)
+    params["region"] = params.get("region") or DEFAULT_REGION
+    if params["region"] not in REGIONS:
+        return None, (jsonify({"error": f"Unknown region: {params['region']}"}), 400)
+    if params.get("layer") not in data_type_mapping or data_type_mapping[params["layer"]]["type"] != "geotiff":
+        return None, (jsonify({"error": f"Unknown raster layer: {params.get('layer')}"}), 400)
+    return params, None
+
+@instrument
+def download_layer(fmt):
+    params, error = _download_params(fmt)
+    if error:
+        return error
+    layer, region, year = params["layer"], params["region"], params.get("year")
+    if year not in [str(y) for y in get_years_for_map_type(layer, region)]:
+        return jsonify({"error": f"No data available for {layer} in {year}"}), 404
+    _, tif_files = load_available_files(layer, year, region)
+    if not tif_files:
+        return jsonify({"error": f"No file found {layer} in {year}"}), 404
+    bbox = None
+    if params.get("bbox"):
+        try:
+            x0, y0, x1, y1 = [float(v) for v in params["bbox"].split(",")]
+        except ValueError:
+            return jsonify({"error": "bbox must be minx,miny,maxx,maxy"}), 400
+        bbox = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    # Finestra risolta prima della risposta: gli errori diventano 400/404 e non un file troncato
+    root = get_region(region)["root"]
+    try:
+        area = exports.layer_area(tif_files[0], bbox=bbox, clip=params.get("clip"), root=root)
+    except Exception as e:
+        return jsonify({"error": f"Invalid selection: {e}"}), 400
+    if area is None:
+        return jsonify({"error": "The selected area does not overlap the layer"}), 404
+    chunks = exports.raster_chunks(tif_files[0], layer, root=root, area=area)
+    return _download_response(chunks, fmt, f"{region}_{layer}_{year}")
+
+@instrument
+def download_zonal(fmt):
+    params, error = _download_params(fmt)
+    if error:
+        return error
+    layer, region = params["layer"], params["region"]
+    years = [year for year in get_years_for_map_type(layer, region) if year != "N/A"]
+    first, _ = load_data(layer, years[0], region=region) if years else (None, None)
+    if first is None or first.get("crs") is None:
+        return jsonify({"error": f"District statistics not available for {layer}"}), 404
+
+    def rasters():
+        # Un anno alla volta, dalla cache dei raster
+        for year in years:
+            data, error = load_data(layer, year, region=region)
+            if not error and data is not None:
+                yield year, data
+
+    return _download_response(exports.zonal_chunks(rasters(), get_region(region)["root"]), fmt,
+                              f"{region}_{layer}_districts")
+
+@instrument
+def download_prices(fmt):
+    from flask import request
+    if fmt not in exports.FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    region = request.args.get("region") or DEFAULT_REGION
+    if region not in REGIONS or not get_region(region)["price_file"]:
+        return jsonify({"error": f"No price data for region: {region}"}), 404
+    price_path = os.path.join(get_region(region)["root"], get_region(region)["price_file"])
+    admin2, commodity = request.args.get("admin2"), request.args.get("commodity")
+    filename = "_".join(part for part in [region, "prices", admin2, commodity] if part).replace(" ", "_")
+    return _download_response(exports.price_chunks(price_path, admin2, commodity), fmt, filename)
+
+def _download_buttons(label, path, params):
+    from urllib.parse import urlencode
+    query = urlencode({k: v for k, v in params.items() if v is not None})
+    return [dbc.Button(f"{label} ({fmt.upper()})", href=f"{path}.{fmt}?{query}", external_link=True,
+                       color="secondary", outline=True, size="sm", className="me-2 mb-2")
+            for fmt in exports.FORMATS]
+
+@callback(
+    Output('download-links', 'children'),
+    [Input('map-type-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('language-dropdown', 'value'),
+     Input('wilaya-dropdown', 'value'),
+     Input('clip-dropdown', 'value'),
+     Input('main-map', 'relayoutData')]
+)
+@instrument
+def update_download_links(map_type, year, language, region=None, clip=None, relayout=None):
+    if data_type_mapping.get(map_type, {}).get("type") != "geotiff" or year is None:
+        return []
+    region = region or DEFAULT_REGION
+    params = {"layer": map_type, "year": year, "region": region}
+    if clip and clip != "none":
+        params["clip"] = clip
+    # Con la mappa zoomata si esporta solo l'area visibile
+    if relayout and "xaxis.range[0]" in relayout and "yaxis.range[0]" in relayout:
+        params["bbox"] = ",".join(str(relayout[key]) for key in
+                                  ["xaxis.range[0]", "yaxis.range[0]", "xaxis.range[1]", "yaxis.range[1]"])
+    links = _download_buttons(translations[language]["download_layer"], "/download/layer", params)
+    # Statistiche dei distretti solo per i raster georeferenziati (mappa già in cache)
+    data, error = load_data(map_type, year, region=region, max_size=MAP_MAX_SIZE)
+    if not error and data is not None and data.get("crs") is not None:
+        links += _download_buttons(translations[language]["download_zonal"], "/download/zonal",
+                                   {"layer": map_type, "region": region})
+    return links
+
+@callback(
+    Output('price-download', 'children'),
+    [Input('region-dropdown', 'value'),
+     Input('commodity-dropdown', 'value'),
+     Input('language-dropdown', 'value')],
+    State('wilaya-dropdown', 'value')
+)
+@instrument
+def update_price_download(selected_region, selected_commodity, language="en", wilaya=None):
+    if selected_region is None or selected_commodity is None:
+        return []
+    return _download_buttons(translations[language]["download_prices"], "/download/prices",
+                             {"region": wilaya or DEFAULT_REGION, "admin2": selected_region,
+                              "commodity": selected_commodity})
+
+
 # ====================================================
 # Callback per aggiornare le scritte in base alla lingua scelta
 # ====================================================
-@app.callback(
+@callback(
     [Output("header-title", "children"),
      Output("data-type-label", "children"),
      Output("year-label", "children"),
      Output("info-title", "children"),
-     Output("language-label", "children")],
-    Input("language-dropdown", "value")
+     Output("language-label", "children"),
+     Output("wilaya-label", "children"),
+     Output("clip-label", "children")],
+    [Input("language-dropdown", "value"),
+     Input("wilaya-dropdown", "value")]
 )
-def update_language(lang):
-    return (translations[lang]["header"],
+@instrument
+def update_language(lang, region=None):
+    return (translations[lang]["header"].format(region=get_region(region)["name"]),
             translations[lang]["data_type_label"],
             translations[lang]["year_label"],
             translations[lang]["info_title"],
-            translations[lang]["language_label"])
-@app.callback(
+            translations[lang]["language_label"],
+            translations[lang]["region_label"],
+            translations[lang]["clip_label"])
+@callback(
     [Output("storic-data-btn", "children"),
      Output("anomalies-btn", "children")],
     Input("language-dropdown", "value")
 )
+@instrument
 def update_sidebar_buttons(lang):
     return translations[lang]["storic_data_button"], translations[lang]["anomalies_button"]
 
+# ====================================================
+# Statistiche di cache e prefetch (per il tuning)
+# ====================================================
+def prefetch_stats():
+    stats = {"cache": raster_cache.stats(), "prefetch": prefetcher.stats()}
+    if shared_store is not None:
+        stats["shared_store"] = shared_store.stats()
+    return jsonify(stats)
+
+
+def cache_metrics():
+    stats = raster_cache.stats()
+    lines = metrics.gauge_lines("dashboard_raster_cache_bytes", "Byte occupati dalla cache dei raster", {None: stats["bytes"]})
+    lines += metrics.gauge_lines("dashboard_raster_cache_entries", "Raster in cache", {None: stats["entries"]})
+    lines += metrics.gauge_lines("dashboard_prefetch_hit_rate", "Frazione dei prefetch poi usati", {None: stats["prefetch_hit_rate"]})
+    return lines
+
+metrics.register_collector(cache_metrics)
+
+
+# ====================================================
+# App factory: nessun dato viene caricato alla creazione dell'app
+# ====================================================
+def create_app():
+    # Inizializza l'app con un tema Bootstrap
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
+    #app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUX])
+    app.layout = layout
+    app.server.add_url_rule("/prefetch-stats", "prefetch_stats", prefetch_stats)
+    app.server.add_url_rule("/api/pixels", "pixels_api", pixels_api, methods=["GET", "POST"])
+    app.server.add_url_rule("/download/layer.<fmt>", "download_layer", download_layer)
+    app.server.add_url_rule("/download/zonal.<fmt>", "download_zonal", download_zonal)
+    app.server.add_url_rule("/download/prices.<fmt>", "download_prices", download_prices)
+    metrics.init_app(app.server)
+    profiling.init_app(app.server)
+    return app
+
+
+# ====================================================
+# Report dei tempi di avvio (--profile-startup)
+# ====================================================
+def profile_startup(top=25):
+    # -X importtime funziona solo all'avvio dell'interprete: l'import del
+    # modulo viene misurato in un processo separato.
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import dashboard"],
+        cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=src_dir),
+        capture_output=True, text=True
+    )
+    per_package = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line.split(":", 1)[1].split("|")]
+        package = name.split(".")[0]
+        stats = per_package.setdefault(package, {"self_ms": 0.0, "modules": 0})
+        stats["self_ms"] += int(self_us) / 1000
+        stats["modules"] += 1
+    total_ms = sum(stats["self_ms"] for stats in per_package.values())
+
+    print(f"Import di dashboard.py: {total_ms:.1f} ms")
+    print(f"{'package':<30}{'self ms':>10}{'modules':>10}")
+    for package, stats in sorted(per_package.items(), key=lambda item: -item[1]["self_ms"])[:top]:
+        print(f"{package:<30}{stats['self_ms']:>10.1f}{stats['modules']:>10}")
+
+    # Fasi di inizializzazione nel processo corrente
+    phases = [("create_app", STARTUP_TIMINGS["create_app"])]
+    t0 = time.perf_counter()
+    catalog = get_catalog()
+    source = "manifest" if catalog.get("from_manifest") else "scan"
+    phases.append((f"catalog ({source})", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    get_price_df()
+    phases.append(("price data", time.perf_counter() - t0))
+    print()
+    for name, seconds in phases:
+        print(f"{name:<30}{seconds * 1000:>10.1f} ms")
+
+
+STARTUP_TIMINGS = {}
+_t0 = time.perf_counter()
+app = create_app()
+STARTUP_TIMINGS["create_app"] = time.perf_counter() - _t0
+server = app.server
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="Assaba Climatic Data dashboard")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Stampa i tempi di import per modulo e delle fasi di avvio, poi esce")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+    else:
+        app.run(debug=True)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# ====================================================
+# Export batch delle mappe per i report
+# ====================================================
+# Renderizza senza browser ogni coppia (layer, anno) con generate_map_figure e,
+# per i raster georeferenziati, la coropletica della media per distretto.
+# Il catalogo viene letto una volta sola nel processo padre; i worker sono
+# creati con fork e lo ereditano già pronto insieme al modulo dashboard.
+# Un file già esportato e più recente dei suoi input viene saltato.
+#
+#   python export_maps.py --out exports --formats png,html --workers 4
+#
+# PNG e SVG richiedono kaleido (pip install kaleido); HTML funziona sempre.
+# Le coropletiche dei distretti usano una proiezione geo (non mapbox) così
+# l'export statico non dipende dai tile scaricati da internet.
+
+FORMATS = ("png", "svg", "html")
+
+
+def _output_path(out_dir, map_type, year, suffix, fmt):
+    name = map_type if year is None else f"{map_type}_{year}"
+    return os.path.join(out_dir, map_type, f"{name}{suffix}.{fmt}")
+
+
+def _input_files(dashboard, map_type, year, districts):
+    shp_files, tif_files = dashboard.load_available_files(map_type, year)
+    files = list(tif_files or shp_files[:1])
+    if districts:
+        from masks import DISTRICTS_FILE
+        files.append(os.path.join(dashboard.DATA_DIRS["admin_layers"], DISTRICTS_FILE))
+    return files
+
+
+def _up_to_date(paths, inputs):
+    # Senza input esistenti (file rimossi, regione senza admin layers) si riesporta
+    inputs = [p for p in inputs if os.path.exists(p)]
+    if not inputs:
+        return False
+    newest_input = max(os.path.getmtime(p) for p in inputs)
+    return all(os.path.exists(p) and os.path.getmtime(p) >= newest_input for p in paths)
+
+
+def district_figure(dashboard, map_type, year, language):
+    from masks import DISTRICTS_FILE, DISTRICT_NAME_COLUMN, district_labels, load_admin_layer
+
+    data, error = dashboard.load_data(map_type, year)
+    if error or data is None:
+        return None
+    labels = district_labels(data)
+    if labels is None:
+        return None
+    values, valid = data["data"], ~data["nodata"]
+    if map_type in ["deforestation", "climate_change"]:
+        values = data["difference"]
+        valid = np.isfinite(values)
+    valid &= labels > 0
+    districts = load_admin_layer(DISTRICTS_FILE).to_crs(4326)
+    sums = np.bincount(labels[valid], weights=values[valid], minlength=len(districts) + 1)
+    counts = np.bincount(labels[valid], minlength=len(districts) + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    districts = districts.assign(value=means[1:len(districts) + 1])
+
+    import plotly.express as px
+    unit = dashboard.units_mapping.get(map_type, "")
+    fig = px.choropleth(
+        districts,
+        geojson=districts.geometry.__geo_interface__,
+        locations=districts.index,
+        color="value",
+        hover_name=DISTRICT_NAME_COLUMN,
+        color_continuous_scale="Viridis",
+        labels={"value": unit or dashboard.translations[language]["value"]},
+    )
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(
+        title=f"{map_type.replace('_', ' ').title()} - {year} ({dashboard.translations[language]['value']} / district)",
+        height=500,
+        margin={"r": 10, "t": 50, "l": 10, "b": 10},
+    )
+    return fig
+
+
+def _write(fig, path, fmt, scale):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp.{fmt}"
+    if fmt == "html":
+        fig.write_html(tmp, include_plotlyjs="cdn")
+    else:
+        fig.write_image(tmp, format=fmt, scale=scale)
+    os.replace(tmp, path)
+
+
+def export_one(task):
+    # Eseguito nei worker: task = (map_type, year, kind, formats, out_dir, language, force, scale)
+    import dashboard
+
+    map_type, year, kind, formats, out_dir, language, force, scale = task
+    suffix = "_districts" if kind == "districts" else ""
+    paths = [_output_path(out_dir, map_type, year, suffix, fmt) for fmt in formats]
+    t0 = time.perf_counter()
+    try:
+        inputs = _input_files(dashboard, map_type, year if year is not None else "N/A", kind == "districts")
+        if not force and _up_to_date(paths, inputs):
+            return task, "skipped", 0.0
+        if kind == "districts":
+            fig = district_figure(dashboard, map_type, year, language)
+            if fig is None:
+                return task, "no-grid", time.perf_counter() - t0
+        else:
+            fig = dashboard.generate_map_figure(map_type, year if year is not None else "N/A", language)
+        for path, fmt in zip(paths, formats):
+            _write(fig, path, fmt, scale)
+    except Exception as e:
+        return task, f"error: {e}", time.perf_counter() - t0
+    return task, "written", time.perf_counter() - t0
+
+
+def build_tasks(dashboard, layers, formats, out_dir, language, force, scale, districts):
+    tasks = []
+    for map_type, info in dashboard.data_type_mapping.items():
+        if layers and map_type not in layers:
+            continue
+        years = [y for y in dashboard.get_years_for_map_type(map_type) if y != "N/A"]
+        if info["type"] == "shapefile" or not years:
+            tasks.append((map_type, None, "map", formats, out_dir, language, force, scale))
+            continue
+        for year in years:
+            tasks.append((map_type, year, "map", formats, out_dir, language, force, scale))
+            if districts:
+                tasks.append((map_type, year, "districts", formats, out_dir, language, force, scale))
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esporta tutte le mappe (layer, anno) in PNG/SVG/HTML")
+    parser.add_argument("--out", default="exports", help="Cartella di destinazione")
+    parser.add_argument("--formats", default="png,html", help=f"Formati separati da virgola tra {', '.join(FORMATS)}")
+    parser.add_argument("--layers", help="Solo questi layer (separati da virgola)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--scale", type=float, default=2.0, help="Fattore di scala per PNG/SVG")
+    parser.add_argument("--no-districts", action="store_true", help="Non esportare le coropletiche dei distretti")
+    parser.add_argument("--force", action="store_true", help="Riesporta anche i file già aggiornati")
+    args = parser.parse_args()
+
+    formats = tuple(f.strip().lower() for f in args.formats.split(",") if f.strip())
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        sys.exit(f"Formati non supportati: {', '.join(unknown)}")
+    if any(f in ("png", "svg") for f in formats):
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            sys.exit("L'export PNG/SVG richiede kaleido: pip install kaleido (oppure usa --formats html)")
+
+    import dashboard
+    # Il catalogo viene letto (o ricostruito e salvato) una volta qui e ereditato dai worker
+    dashboard.get_catalog()
+    layers = set(args.layers.split(",")) if args.layers else None
+    tasks = build_tasks(dashboard, layers, formats, args.out, args.language, args.force, args.scale,
+                        not args.no_districts)
+
+    counts = {}
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        futures = [pool.submit(export_one, task) for task in tasks]
+        for future in as_completed(futures):
+            task, status, seconds = future.result()
+            map_type, year, kind = task[:3]
+            counts[status.split(":")[0]] = counts.get(status.split(":")[0], 0) + 1
+            print(f"{map_type:<26}{str(year or '-'):<12}{kind:<10}{status} ({seconds:.1f} s)", flush=True)
+    summary = ", ".join(f"{n} {s}" for s, n in sorted(counts.items()))
+    print(f"{len(tasks)} export in {time.perf_counter() - t0:.1f} s: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+
+import numpy as np
+
+import grid
+import masks
+import nodata
+import overviews
+
+# ====================================================
+# Download in streaming (CSV / Parquet)
+# ====================================================
+# I dati esportati non vengono mai costruiti interi in memoria: ogni sorgente
+# è un generatore di blocchi {colonna: array} (righe del raster lette a
+# finestre dal file, un anno alla volta per le statistiche dei distretti, il
+# CSV dei prezzi a pezzi) e i writer trasformano ogni blocco in byte appena
+# pronto. Le route Flask di dashboard.py restituiscono questi generatori come
+# risposta in streaming, quindi anche un raster a piena risoluzione in CSV
+# occupa in memoria un blocco di righe alla volta.
+# Una selezione senza righe dà comunque un CSV con le intestazioni e un
+# Parquet valido (le sorgenti producono almeno un blocco, anche vuoto); un
+# bbox che non tocca il raster è rifiutato dalla route prima di rispondere.
+# Il Parquet richiede pyarrow (un row group per blocco); senza resta il CSV.
+
+# Pixel per blocco (righe intere del raster): la memoria del blocco non dipende dalla larghezza
+EXPORT_CHUNK_PIXELS = int(os.environ.get("DASHBOARD_EXPORT_CHUNK_PIXELS", "65536"))
+PRICE_CHUNK_ROWS = 10000
+
+try:
+    import pyarrow  # noqa: F401
+    USE_ARROW = True
+except ImportError:
+    USE_ARROW = False
+
+FORMATS = {"csv": "text/csv"}
+if USE_ARROW:
+    FORMATS["parquet"] = "application/vnd.apache.parquet"
+
+
+# ====================================================
+# Sorgenti: generatori di blocchi
+# ====================================================
+def _window(src, bbox=None, clip=None, root=masks.DATA_ROOT):
+    # (riga, colonna, altezza, larghezza, maschera bit-packed o None) della parte da esportare
+    row, col, height, width = 0, 0, src.height, src.width
+    mask = None
+    if clip not in (None, "none"):
+        # Come sulla mappa: senza maschera (raster non georeferenziato) si esporta tutto
+        mask = masks.clip_mask(src.transform, src.shape, src.crs, clip, root)
+        if mask is not None:
+            row, col, height, width = mask["window"]
+    if bbox is not None:
+        # Angoli del bbox in (colonna, riga) con la transform inversa: vale anche per i
+        # raster non georeferenziati (transform identità, y verso il basso), dove
+        # windows.from_bounds rifiuta i limiti
+        minx, miny, maxx, maxy = bbox
+        inverse = ~src.transform
+        corners = [inverse * (x, y) for x in (minx, maxx) for y in (miny, maxy)]
+        col0 = max(int(np.floor(min(c[0] for c in corners))), col)
+        row0 = max(int(np.floor(min(c[1] for c in corners))), row)
+        col1 = min(int(np.ceil(max(c[0] for c in corners))), col + width)
+        row1 = min(int(np.ceil(max(c[1] for c in corners))), row + height)
+        if row1 <= row0 or col1 <= col0:
+            return None
+        if mask is not None:
+            # Maschera ritagliata alla finestra comune (bit spacchettati solo qui)
+            inside = masks.unpack(mask)[row0 - row:row1 - row, col0 - col:col1 - col]
+            mask = {"window": (row0, col0, row1 - row0, col1 - col0), "bits": np.packbits(inside, axis=1)}
+        row, col, height, width = row0, col0, row1 - row0, col1 - col0
+    return row, col, height, width, mask
+
+
+def layer_area(tif_file, bbox=None, clip=None, root=masks.DATA_ROOT):
+    # Finestra da esportare (vedi _window), None se il bbox non tocca il raster.
+    # Calcolata dalla route prima di rispondere: un'area vuota diventa un 404
+    with overviews.open_level(tif_file) as src:
+        return _window(src, bbox, clip, root)
+
+
+def raster_chunks(tif_file, map_type=None, bbox=None, clip=None, root=masks.DATA_ROOT, chunk_pixels=EXPORT_CHUNK_PIXELS,
+                  area=None):
+    # Pixel validi del file a piena risoluzione: x, y (centri, CRS del file), value
+    # (+ difference per i raster a due bande). bbox nel CRS del raster, clip come in masks.py;
+    # area (da layer_area) evita di ricalcolare la finestra
+    from rasterio import windows
+
+    with overviews.open_level(tif_file) as src:
+        area = area or _window(src, bbox, clip, root)
+        if area is None:
+            return
+        row, col, height, width, mask = area
+        geometry = grid.geometry(tuple(src.transform)[:6], src.shape)
+        xs = geometry.x[col:col + width]
+        chunk_rows = max(chunk_pixels // width, 1)
+        for start in range(0, height, chunk_rows):
+            rows = min(chunk_rows, height - start)
+            window = windows.Window(col, row + start, width, rows)
+            values, missing = nodata.read_band(src, 1, map_type, window=window)
+            keep = ~missing
+            if mask is not None:
+                keep &= np.unpackbits(mask["bits"][start:start + rows], axis=1, count=width).view(bool)
+            r, c = np.nonzero(keep)
+            chunk = {"x": xs[c], "y": geometry.y[row + start:row + start + rows][r], "value": values[keep]}
+            if src.count > 1:
+                difference, _ = nodata.read_band(src, 2, window=window)
+                chunk["difference"] = difference[keep]
+            yield chunk
+
+
+def zonal_chunks(rasters, root=masks.DATA_ROOT):
+    # Un blocco per anno: conteggio, media, minimo e massimo dei pixel validi per distretto.
+    # rasters: iterabile di (anno, raster caricato da load_data), consumato un anno alla volta
+    names = None
+    empty = True
+    for year, raster in rasters:
+        labels = masks.district_labels(raster, root)
+        if labels is None:
+            continue
+        if names is None:
+            names = np.array(masks.district_names(root), dtype=object)
+        valid = ~raster["nodata"] & (labels > 0)
+        label, values = labels[valid], raster["data"][valid].astype("float64")
+        n = len(names) + 1
+        count = np.bincount(label, minlength=n)
+        total = np.bincount(label, weights=values, minlength=n)
+        minimum = np.full(n, np.inf)
+        maximum = np.full(n, -np.inf)
+        np.minimum.at(minimum, label, values)
+        np.maximum.at(maximum, label, values)
+        present = np.flatnonzero(count[1:]) + 1
+        empty = False
+        yield {
+            "year": np.full(present.size, str(year), dtype=object),
+            "district": names[present - 1],
+            "pixels": count[present],
+            "mean": total[present] / count[present],
+            "minimum": minimum[present],
+            "maximum": maximum[present],
+        }
+    if empty:
+        # Nessun distretto: file con le sole intestazioni
+        yield {"year": np.empty(0, dtype=object), "district": np.empty(0, dtype=object),
+               "pixels": np.empty(0, dtype="int64"), "mean": np.empty(0), "minimum": np.empty(0),
+               "maximum": np.empty(0)}
+
+
+def price_chunks(price_path, admin2=None, commodity=None, chunk_rows=PRICE_CHUNK_ROWS):
+    # Righe del CSV dei prezzi filtrate per sottoregione e prodotto, lette a pezzi
+    import pandas as pd
+
+    selected, frame = False, None
+    for frame in pd.read_csv(price_path, chunksize=chunk_rows, parse_dates=["date"]):
+        if admin2:
+            frame = frame[frame["admin2"] == admin2]
+        if commodity:
+            frame = frame[frame["commodity"] == commodity]
+        if len(frame):
+            selected = True
+            yield {name: frame[name].to_numpy() for name in frame.columns}
+    if not selected and frame is not None:
+        # Nessuna riga selezionata: l'ultimo pezzo filtrato (vuoto) porta colonne e tipi
+        yield {name: frame[name].to_numpy() for name in frame.columns}
+
+
+# ====================================================
+# Writer: blocchi -> byte
+# ====================================================
+def csv_stream(chunks):
+    import pandas as pd
+
+    header = True
+    for chunk in chunks:
+        yield pd.DataFrame(chunk).to_csv(index=False, header=header).encode("utf-8")
+        header = False
+
+
+class _ByteSink:
+    # File in sola scrittura per ParquetWriter: i byte scritti vengono restituiti da drain()
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_stream(chunks):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ByteSink()
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(pd.DataFrame(chunk), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def stream(chunks, fmt):
+    return parquet_stream(chunks) if fmt == "parquet" else csv_stream(chunks)
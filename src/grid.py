@@ -0,0 +1,84 @@
+import functools
+
+import numpy as np
+
+# ====================================================
+# Geometria della griglia di un raster
+# ====================================================
+# Un solo oggetto per griglia (transform, dimensioni, capovolgimento) usato da
+# mappe, click, API e selezioni:
+# - assi x/y ai centri dei pixel (non np.linspace sui bordi di bounds);
+# - conversione vettorizzata coordinate <-> (riga, colonna) con floor, cioè
+#   il pixel che contiene il punto;
+# - i raster delle anomalie e dei cambi di copertura sono capovolti con
+#   np.flipud in load_geotiff: la riga i dell'array è la riga altezza-1-i del
+#   file, e la transform dell'array ne tiene conto.
+# Gli oggetti sono in cache per griglia, quindi anche i loro assi vengono
+# riusati tra un render e l'altro.
+
+
+class GridGeometry:
+    def __init__(self, transform, shape, flipped=False):
+        from affine import Affine
+
+        height, width = shape
+        self.shape = (int(height), int(width))
+        self.flipped = flipped
+        self.file_transform = Affine(*tuple(transform)[:6])
+        # Transform dell'array in memoria (dopo l'eventuale flipud)
+        self.transform = self.file_transform * Affine(1, 0, 0, 0, -1, height) if flipped else self.file_transform
+        self.inverse = ~self.transform
+
+    @property
+    def y_reversed(self):
+        # Nel file la y cresce verso il basso (raster in coordinate pixel, transform
+        # identità): l'asse y della mappa va invertito per avere la prima riga in alto
+        return self.file_transform.e > 0
+
+    @functools.cached_property
+    def x(self):
+        t = self.transform
+        x = t.c + t.a * (np.arange(self.shape[1]) + 0.5)
+        x.setflags(write=False)
+        return x
+
+    @functools.cached_property
+    def y(self):
+        t = self.transform
+        y = t.f + t.e * (np.arange(self.shape[0]) + 0.5)
+        y.setflags(write=False)
+        return y
+
+    def rowcol(self, xs, ys):
+        # (righe, colonne, dentro la griglia) per coordinate scalari o array
+        xs = np.asarray(xs, dtype="float64")
+        ys = np.asarray(ys, dtype="float64")
+        t = self.inverse
+        cols = np.floor(t.a * xs + t.b * ys + t.c)
+        rows = np.floor(t.d * xs + t.e * ys + t.f)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        rows = np.where(inside, rows, 0).astype(np.intp)
+        cols = np.where(inside, cols, 0).astype(np.intp)
+        return rows, cols, inside
+
+    def xy(self, rows, cols):
+        # Centri dei pixel (righe, colonne) nelle coordinate della griglia
+        rows = np.asarray(rows, dtype="float64") + 0.5
+        cols = np.asarray(cols, dtype="float64") + 0.5
+        t = self.transform
+        return t.a * cols + t.b * rows + t.c, t.d * cols + t.e * rows + t.f
+
+    def window(self, row, col, height, width):
+        # Sotto-griglia di una finestra dell'array (es. ritaglio su un distretto)
+        from affine import Affine
+
+        return geometry(tuple(self.transform * Affine.translation(col, row))[:6], (height, width))
+
+
+@functools.lru_cache(maxsize=256)
+def geometry(transform, shape, flipped=False):
+    return GridGeometry(transform, shape, flipped)
+
+
+def raster_geometry(raster, value_key="data"):
+    return geometry(tuple(raster["transform"])[:6], raster[value_key].shape, bool(raster.get("flipped", False)))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+# ====================================================
+# Load test locale con utenti concorrenti
+# ====================================================
+# Rigioca payload _dash-update-component registrati (cambio layer/anno, click
+# sui pixel, confronto, menu dei prezzi) contro un'istanza locale del dashboard
+# avviata con serve.py, simulando N utenti concorrenti. Per ogni callback
+# riporta latenza p50/p95/p99, throughput e tasso di errore.
+#
+#   python loadtest.py --generate                 # payload sintetici dal catalogo
+#   python loadtest.py --record                   # registra i payload navigando nel browser
+#   python loadtest.py --users 20 --duration 60   # avvia serve.py e lancia il test
+#   python loadtest.py --url http://host:8050     # usa un server già avviato
+#   python loadtest.py --synthetic 5000           # dataset sintetico 5000 x 5000 (synthetic.py)
+
+DEFAULT_PAYLOADS = "loadtest_payloads.json"
+UPDATE_PATH = "/_dash-update-component"
+
+
+def _body(app, output, values, changed):
+    # Costruisce il corpo della richiesta come lo invierebbe il renderer Dash
+    spec = app.callback_map[output]
+    outputs = [{"id": part.split(".")[0], "property": part.split(".")[1]}
+               for part in output.strip(".").split("...")]
+    return {
+        "output": output,
+        "outputs": outputs if output.startswith("..") else outputs[0],
+        "inputs": [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in spec["inputs"]],
+        "state": [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in spec["state"]],
+        "changedPropIds": [changed],
+    }
+
+
+def _random_point(raster, rng):
+    minx, miny, maxx, maxy = raster.get("bounds", (-17.0, 16.0, -8.0, 26.0))
+    return {"x": float(rng.uniform(minx, maxx)), "y": float(rng.uniform(miny, maxy))}
+
+
+def build_payloads(seed=0, clicks=3, language="en"):
+    import dashboard
+
+    app = dashboard.app
+    # Dash popola callback_map alla prima richiesta servita
+    app.server.test_client().get("/_dash-dependencies")
+    rng = random.Random(seed)
+    entries = []
+
+    def add(name, output, values, changed):
+        entries.append({"callback": name, "body": _body(app, output, values, changed)})
+
+    lang = {"language-dropdown.value": language, "wilaya-dropdown.value": dashboard.DEFAULT_REGION}
+    def duplicate_output(prefix, input_id):
+        # Output con allow_duplicate: l'id ha un hash, si riconosce dall'input
+        return next(output for output, spec in app.callback_map.items()
+                    if output.startswith(prefix) and any(item["id"] == input_id for item in spec["inputs"]))
+
+    history_output = duplicate_output("historical-plot.figure@", "history-request")
+    area_output = duplicate_output("historical-plot.figure@", "main-map")
+    for map_type, info in dashboard.data_type_mapping.items():
+        years = [y for y in dashboard.get_years_for_map_type(map_type) if y != "N/A"]
+        values = dict(lang, **{"map-type-dropdown.value": map_type})
+        add("update_year_options", "..year-dropdown.options...year-dropdown.value...year-dropdown.disabled..",
+            values, "map-type-dropdown.value")
+        for year in (years or [None]):
+            values = dict(lang, **{"map-type-dropdown.value": map_type, "year-dropdown.value": year})
+            add("update_map", "..main-map.figure...map-info.children...main-map-level.data..", values, "year-dropdown.value")
+            add("update_download_links", "download-links.children", values, "year-dropdown.value")
+        if info["type"] != "geotiff" or not years:
+            continue
+        raster, error = dashboard.load_data(map_type, years[-1])
+        if error or raster is None:
+            continue
+        add("update_pixel_cube", "pixel-cube.data", dict(lang, **{"map-type-dropdown.value": map_type}),
+            "map-type-dropdown.value")
+        # Con il cubo nel browser i click non arrivano al server: qui il percorso di fallback
+        for _ in range(clicks):
+            request = {"clickData": {"points": [_random_point(raster, rng)]}, "map_type": map_type,
+                       "year": years[-1], "language": language, "region": dashboard.DEFAULT_REGION}
+            add("pixel_history_fallback", history_output, {"history-request.data": request}, "history-request.data")
+        # Selezione a box tra due punti casuali
+        a, b = _random_point(raster, rng), _random_point(raster, rng)
+        selection = {"points": [], "range": {"x": sorted([a["x"], b["x"]]), "y": sorted([a["y"], b["y"]])}}
+        add("update_area_history", area_output,
+            dict(lang, **{"main-map.selectedData": selection, "map-type-dropdown.value": map_type,
+                          "year-dropdown.value": years[-1]}), "main-map.selectedData")
+
+    geotiff_types = [t for t, info in dashboard.data_type_mapping.items()
+                     if info["type"] == "geotiff" and dashboard.get_years_for_map_type(t) != ["N/A"]]
+    for _ in range(len(geotiff_types)):
+        type1, type2 = rng.sample(geotiff_types, 2)
+        values = dict(lang, **{
+            "compare-map-type-1.value": type1, "compare-year-1.value": rng.choice(dashboard.get_years_for_map_type(type1)),
+            "compare-map-type-2.value": type2, "compare-year-2.value": rng.choice(dashboard.get_years_for_map_type(type2)),
+        })
+        add("update_compare_maps", "..compare-map-1.figure...compare-map-2.figure..", values, "compare-year-1.value")
+
+    price_df = dashboard.get_price_df()
+    regions = sorted(price_df["admin2"].unique())
+    commodities = sorted(price_df["commodity"].unique())
+    add("populate_price_dropdowns",
+        "..region-dropdown.options...region-dropdown.value...commodity-dropdown.options...commodity-dropdown.value..",
+        lang, "language-dropdown.value")
+    add("populate_price_overlay", "price-overlay-dropdown.options", lang, "language-dropdown.value")
+    overlays = ["none"] + dashboard.market_layers()
+    for _ in range(len(regions)):
+        values = dict(lang, **{"region-dropdown.value": rng.choice(regions), "commodity-dropdown.value": rng.choice(commodities),
+                               "price-overlay-dropdown.value": rng.choice(overlays)})
+        add("update_price_graph", "price-trend-graph.figure", values, "commodity-dropdown.value")
+        add("update_price_download", "price-download.children", values, "commodity-dropdown.value")
+    return entries
+
+
+def record(path, host, port):
+    # Avvia il dashboard e salva ogni richiesta di callback fatta dal browser
+    import dashboard
+    from flask import g, request
+
+    server = dashboard.server
+    lock = threading.Lock()
+    entries = []
+
+    @server.after_request
+    def _record(response):
+        name = g.get("metrics_callback")
+        if request.path.endswith(UPDATE_PATH) and name:
+            with lock:
+                entries.append({"callback": name, "body": request.get_json(silent=True)})
+                with open(path, "w") as f:
+                    json.dump(entries, f)
+        return response
+
+    print(f"Registrazione su {path}: apri http://{host}:{port} e usa il dashboard, Ctrl+C per terminare")
+    dashboard.app.run(host=host, port=port, debug=False)
+
+
+def start_server(port, workers, hot_years):
+    cmd = [sys.executable, "serve.py", "--port", str(port), "--workers", str(workers),
+           "--hot-years", str(hot_years)]
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 600
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"serve.py terminato con codice {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/_dash-layout")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("serve.py non ha risposto entro 600 s")
+
+
+def run_user(url, entries, rng, stop_at, iterations, think, results):
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=120)
+    order = list(range(len(entries)))
+    done = 0
+    while time.monotonic() < stop_at and (iterations is None or done < iterations):
+        rng.shuffle(order)
+        for i in order:
+            if time.monotonic() >= stop_at:
+                break
+            entry = entries[i]
+            data = json.dumps(entry["body"])
+            t0 = time.perf_counter()
+            ok, size = False, 0
+            for attempt in range(2):
+                try:
+                    conn.request("POST", UPDATE_PATH, body=data, headers={"Content-Type": "application/json"})
+                    response = conn.getresponse()
+                    size = len(response.read())
+                    # 204 = PreventUpdate, una risposta valida
+                    ok = response.status in (200, 204)
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # Connessione keep-alive chiusa dal server: riprova una volta su una nuova
+                    conn.close()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    break
+            results.append((entry["callback"], time.perf_counter() - t0, ok, size))
+            if think:
+                time.sleep(rng.expovariate(1.0 / think))
+        done += 1
+    conn.close()
+
+
+def summarize(results, elapsed):
+    report = {}
+    names = sorted({r[0] for r in results})
+    for name in names + ["TOTAL"]:
+        rows = [r for r in results if name == "TOTAL" or r[0] == name]
+        latencies = np.array([r[1] for r in rows])
+        errors = sum(1 for r in rows if not r[2])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(rows) else (0.0, 0.0, 0.0)
+        report[name] = {
+            "requests": len(rows),
+            "p50_ms": p50 * 1000,
+            "p95_ms": p95 * 1000,
+            "p99_ms": p99 * 1000,
+            "throughput_rps": len(rows) / elapsed if elapsed else 0.0,
+            "error_rate": errors / len(rows) if rows else 0.0,
+            "mean_bytes": float(np.mean([r[3] for r in rows])) if rows else 0.0,
+        }
+    return report
+
+
+def print_report(report, elapsed, users):
+    print(f"\n{users} utenti, {elapsed:.1f} s")
+    print(f"{'callback':<28}{'req':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}{'errori':>9}{'KB':>9}")
+    for name, row in report.items():
+        print(f"{name:<28}{row['requests']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+              f"{row['throughput_rps']:>9.2f}{row['error_rate']:>9.1%}{row['mean_bytes'] / 1024:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test del dashboard con utenti concorrenti")
+    parser.add_argument("--payloads", default=DEFAULT_PAYLOADS, help="File JSON con i payload da rigiocare")
+    parser.add_argument("--generate", action="store_true", help="Genera i payload dal catalogo e termina")
+    parser.add_argument("--record", action="store_true", help="Registra i payload dal browser e termina")
+    parser.add_argument("--clicks", type=int, default=3, help="Click sui pixel generati per layer")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="Server già avviato (altrimenti viene lanciato serve.py)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8060)
+    parser.add_argument("--workers", type=int, default=2, help="Worker di serve.py")
+    parser.add_argument("--hot-years", type=int, default=0, help="Passato a serve.py")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60.0, help="Durata massima in secondi")
+    parser.add_argument("--iterations", type=int, help="Passate complete sui payload per utente")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pausa media tra due richieste di un utente")
+    parser.add_argument("--callbacks", help="Rigioca solo queste callback (separate da virgola)")
+    parser.add_argument("--output", help="Salva il report in JSON")
+    parser.add_argument("--synthetic", type=int, metavar="SIZE",
+                        help="Usa un dataset sintetico con raster SIZE x SIZE invece dei dati reali")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "dashboard-synthetic"),
+                        help="Cartella dei dataset sintetici (riusati se già generati)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        import synthetic
+
+        # Prima di qualsiasi import di catalog/dashboard: DATA_ROOT viene letto all'import
+        # ed è ereditato da serve.py
+        root = os.path.join(args.workdir, f"synthetic-{args.synthetic}")
+        os.environ["DASHBOARD_DATA_ROOT"] = root
+        synthetic.build_root(root, args.synthetic, seed=args.synthetic)
+        if args.payloads == DEFAULT_PAYLOADS:
+            args.payloads = os.path.join(root, DEFAULT_PAYLOADS)
+
+    if args.record:
+        record(args.payloads, args.host, args.port)
+        return
+    if args.generate or not os.path.exists(args.payloads):
+        entries = build_payloads(args.seed, args.clicks)
+        with open(args.payloads, "w") as f:
+            json.dump(entries, f)
+        print(f"{len(entries)} payload salvati in {args.payloads}")
+        if args.generate:
+            return
+    with open(args.payloads) as f:
+        entries = json.load(f)
+    if args.callbacks:
+        wanted = set(args.callbacks.split(","))
+        entries = [e for e in entries if e["callback"] in wanted]
+    if not entries:
+        sys.exit("Nessun payload da rigiocare")
+
+    proc = None
+    url = args.url
+    if url is None:
+        proc = start_server(args.port, args.workers, args.hot_years)
+        url = f"http://127.0.0.1:{args.port}"
+    try:
+        results = []
+        t0 = time.monotonic()
+        stop_at = t0 + args.duration
+        threads = [threading.Thread(target=run_user, daemon=True,
+                                    args=(url, entries, random.Random(args.seed + i), stop_at,
+                                          args.iterations, args.think_ms / 1000, results))
+                   for i in range(args.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.monotonic() - t0
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    report = summarize(results, elapsed)
+    print_report(report, elapsed, args.users)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": url, "users": args.users, "elapsed": elapsed, "payloads": args.payloads,
+                       "callbacks": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import warnings
+
+import numpy as np
+
+import grid
+import year_cube
+
+# ====================================================
+# Layer raster campionati sui mercati dei prezzi
+# ====================================================
+# Per ogni mercato del file dei prezzi (latitudine/longitudine) e ogni layer
+# raster con anni di calendario, si legge il valore di ogni anno in un cerchio
+# di MARKET_BUFFER_KM attorno al mercato: media dei pixel validi (classe più
+# frequente per i layer categorici), o il solo pixel del mercato con raggio 0.
+# Il campionamento usa i cubi degli anni già in cache (year_cube.py): per ogni
+# layer una finestra per mercato, tutti gli anni insieme.
+# La tabella finale è lunga (mercato x data x layer), allineata alle date dei
+# prezzi: a ogni data va il valore dell'ultimo anno disponibile fino a quella
+# data, così il grafico dei prezzi può sovrapporre un layer senza ricalcoli.
+
+MARKET_BUFFER_KM = float(os.environ.get("DASHBOARD_MARKET_BUFFER_KM", "5"))
+CATEGORICAL_LAYERS = {"land_cover"}
+KM_PER_DEGREE = 111.32
+TABLE_COLUMNS = ["market", "admin2", "date", "layer", "year", "value"]
+
+
+def markets(price_df):
+    return price_df[["market", "admin2", "latitude", "longitude"]].drop_duplicates("market").reset_index(drop=True)
+
+
+def _radius(crs, lat, buffer_km):
+    # Raggio (x, y) nelle unità del CRS del raster
+    if crs.is_geographic:
+        return buffer_km / (KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6)), buffer_km / KM_PER_DEGREE
+    radius = buffer_km * 1000 / crs.linear_units_factor[1]
+    return radius, radius
+
+
+def _majority(values):
+    # Classe più frequente per ogni anno (righe), ignorando i NaN
+    result = np.full(values.shape[0], np.nan, dtype="float32")
+    for i, row in enumerate(values):
+        row = row[np.isfinite(row)]
+        if row.size:
+            classes, counts = np.unique(row, return_counts=True)
+            result[i] = classes[np.argmax(counts)]
+    return result
+
+
+def sample(cube, lons, lats, buffer_km=MARKET_BUFFER_KM, categorical=False):
+    # (punti x anni) per punti lon/lat WGS84; None se il raster non è georeferenziato
+    if not cube.get("crs"):
+        return None
+    xs, ys = year_cube.lonlat_to_crs(cube, lons, lats)
+    values = cube["cube"]
+    if not buffer_km:
+        return year_cube.sample(cube, xs, ys)
+    geometry = grid.geometry(cube["transform"], values.shape[1:])
+    height, width = values.shape[1:]
+    result = np.full((len(xs), values.shape[0]), np.nan, dtype="float32")
+    for i, (x, y, lat) in enumerate(zip(xs, ys, np.asarray(lats, dtype="float64"))):
+        rx, ry = _radius(cube["crs"], lat, buffer_km)
+        # Finestra che contiene il cerchio, poi i pixel con il centro nel cerchio
+        corners = [geometry.inverse * (x + dx, y + dy) for dx in (-rx, rx) for dy in (-ry, ry)]
+        col0, row0 = (max(int(np.floor(min(c[k] for c in corners))), 0) for k in (0, 1))
+        col1 = min(int(np.ceil(max(c[0] for c in corners))), width)
+        row1 = min(int(np.ceil(max(c[1] for c in corners))), height)
+        if row1 <= row0 or col1 <= col0:
+            continue
+        inside = ((geometry.x[col0:col1] - x) / rx) ** 2 + ((geometry.y[row0:row1, None] - y) / ry) ** 2 <= 1
+        if not inside.any():
+            # Raggio più piccolo di un pixel: il pixel che contiene il mercato
+            result[i] = year_cube.sample(cube, [x], [y])[0]
+            continue
+        window = values[:, row0:row1, col0:col1][:, inside]
+        if categorical:
+            result[i] = _majority(window)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                result[i] = np.nanmean(window, axis=1)
+    return result
+
+
+def market_table(layer_cubes, price_df, buffer_km=MARKET_BUFFER_KM):
+    # layer_cubes: {layer: cubo}; tabella lunga con colonne TABLE_COLUMNS
+    import pandas as pd
+
+    points = markets(price_df)
+    dates = price_df[["market", "date"]].drop_duplicates()
+    dates = dates.assign(year=dates["date"].dt.year.astype("int64")).sort_values("year")
+    frames = []
+    for layer, cube in layer_cubes.items():
+        values = sample(cube, points["longitude"], points["latitude"], buffer_km, layer in CATEGORICAL_LAYERS)
+        if values is None:
+            continue
+        annual = pd.DataFrame(values, columns=[int(year) for year in cube["years"]])
+        annual["market"] = points["market"]
+        annual = annual.melt(id_vars="market", var_name="year", value_name="value")
+        annual = annual.assign(year=annual["year"].astype("int64")).sort_values("year")
+        # Ultimo anno del layer non successivo all'anno della data del prezzo
+        joined = pd.merge_asof(dates, annual.rename(columns={"year": "layer_year"}),
+                               left_on="year", right_on="layer_year", by="market")
+        frames.append(joined.assign(layer=layer, year=joined["layer_year"]))
+    if not frames:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+    table = pd.concat(frames).merge(points[["market", "admin2"]], on="market")
+    return table[TABLE_COLUMNS].sort_values(["layer", "market", "date"]).reset_index(drop=True)
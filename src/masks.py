@@ -0,0 +1,194 @@
+import collections
+import functools
+import os
+import threading
+
+import numpy as np
+
+from catalog import DATA_ROOT, data_dirs
+
+# ====================================================
+# Maschere dei distretti sulle griglie dei raster
+# ====================================================
+# Per ogni griglia raster (transform, shape, crs) i poligoni dei distretti di
+# Assaba vengono rasterizzati una volta sola in una griglia di etichette:
+# 0 = fuori dai distretti, i = indice del distretto + 1.
+
+DISTRICTS_FILE = "Assaba_Districts_layer.shp"
+REGION_FILE = "Assaba_Region_layer.shp"
+DISTRICT_NAME_COLUMN = "ADM3_EN"
+# Griglie tenute in cache (LRU) per le etichette e per le maschere di ritaglio
+MASK_CACHE_SIZE = int(os.environ.get("DASHBOARD_MASK_CACHE_SIZE", "256"))
+
+_labels_cache = collections.OrderedDict()
+_labels_lock = threading.Lock()
+
+
+# Da chiamare con il lock della cache
+def _cache_get(cache, key):
+    if key not in cache:
+        return False, None
+    cache.move_to_end(key)
+    return True, cache[key]
+
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MASK_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+@functools.lru_cache(maxsize=None)
+def load_admin_layer(filename, root=DATA_ROOT):
+    from vector_cache import read_vector
+    return read_vector(os.path.join(data_dirs(root)["admin_layers"], filename))
+
+
+def district_names(root=DATA_ROOT):
+    return list(load_admin_layer(DISTRICTS_FILE, root)[DISTRICT_NAME_COLUMN])
+
+
+def grid_key(raster):
+    crs = raster.get("crs")
+    return (tuple(raster["transform"])[:6], raster["data"].shape, crs.to_wkt() if crs is not None else None)
+
+
+def district_labels(raster, root=DATA_ROOT):
+    # I raster non georeferenziati (anomalie in coordinate pixel) non hanno una griglia utilizzabile
+    if raster.get("crs") is None:
+        return None
+    key = grid_key(raster) + (os.path.abspath(root),)
+    with _labels_lock:
+        found, labels = _cache_get(_labels_cache, key)
+    if found:
+        return labels
+
+    from rasterio import features
+
+    districts = load_admin_layer(DISTRICTS_FILE, root)
+    if districts.crs is not None and districts.crs != raster["crs"]:
+        districts = districts.to_crs(raster["crs"])
+    shapes = ((geom, i + 1) for i, geom in enumerate(districts.geometry) if geom is not None)
+    labels = features.rasterize(shapes, out_shape=raster["data"].shape,
+                                transform=raster["transform"], fill=0, dtype="int16")
+    labels.setflags(write=False)
+    with _labels_lock:
+        _cache_put(_labels_cache, key, labels)
+    return labels
+
+
+# ====================================================
+# Maschere di ritaglio bit-packed (regione intera o singolo distretto)
+# ====================================================
+# Il poligono della regione (REGION_FILE) o di un distretto viene rasterizzato
+# una volta per griglia e solo dentro la finestra del suo bbox. La maschera è
+# salvata con np.packbits (1 bit per pixel, righe impacchettate) insieme
+# all'offset della finestra: ritagliare costa una slice del raster (una vista)
+# o una lettura a finestra, più lo spacchettamento dei bit.
+# target = "region" oppure l'indice del distretto in DISTRICTS_FILE.
+# I raster letti a finestra (zoom) usano la maschera della griglia intera del
+# loro livello, ritagliata sulla finestra: una maschera per griglia, non per vista.
+
+REGION_TARGET = "region"
+
+_clip_cache = collections.OrderedDict()
+_clip_lock = threading.Lock()
+
+
+def clip_targets(root=DATA_ROOT):
+    return [REGION_TARGET] + list(range(len(district_names(root))))
+
+
+def _target_geometry(target, crs, root):
+    if target == REGION_TARGET:
+        layer = load_admin_layer(REGION_FILE, root)
+    else:
+        layer = load_admin_layer(DISTRICTS_FILE, root).iloc[[int(target)]]
+    if layer.crs is not None and crs is not None and layer.crs != crs:
+        layer = layer.to_crs(crs)
+    return layer.geometry.union_all()
+
+
+def clip_mask(transform, shape, crs, target, root=DATA_ROOT):
+    # {"window": (riga, colonna, altezza, larghezza), "bits": uint8 [altezza, ceil(larghezza / 8)],
+    #  "pixels": pixel dentro il poligono}; None se la griglia non è georeferenziata
+    # o il poligono non la interseca
+    if crs is None:
+        return None
+    key = (tuple(transform)[:6], tuple(shape), crs.to_wkt(), str(target), os.path.abspath(root))
+    with _clip_lock:
+        found, mask = _cache_get(_clip_cache, key)
+    if found:
+        return mask
+
+    from rasterio import features, windows
+
+    geometry = _target_geometry(target, crs, root)
+    mask = None
+    if geometry is not None and not geometry.is_empty:
+        height, width = shape
+        # Finestra intera che contiene il bbox, limitata alla griglia
+        window = windows.from_bounds(*geometry.bounds, transform=transform)
+        row, col = max(int(np.floor(window.row_off)), 0), max(int(np.floor(window.col_off)), 0)
+        h = min(int(np.ceil(window.row_off + window.height)), height) - row
+        w = min(int(np.ceil(window.col_off + window.width)), width) - col
+        if h > 0 and w > 0:
+            inside = features.geometry_mask([geometry], out_shape=(h, w), invert=True,
+                                            transform=windows.transform(windows.Window(col, row, w, h), transform))
+            bits = np.packbits(inside, axis=1)
+            bits.setflags(write=False)
+            mask = {"window": (row, col, h, w), "bits": bits, "pixels": int(inside.sum())}
+    with _clip_lock:
+        _cache_put(_clip_cache, key, mask)
+    return mask
+
+
+def window_mask(mask, window):
+    # Parte della maschera dentro window (riga, colonna, altezza, larghezza) della
+    # sua griglia, con la finestra della maschera relativa a window; None se fuori
+    if mask is None:
+        return None
+    row, col, height, width = window
+    mask_row, mask_col, mask_height, mask_width = mask["window"]
+    row0, col0 = max(row, mask_row), max(col, mask_col)
+    row1, col1 = min(row + height, mask_row + mask_height), min(col + width, mask_col + mask_width)
+    if row1 <= row0 or col1 <= col0:
+        return None
+    inside = np.unpackbits(mask["bits"][row0 - mask_row:row1 - mask_row], axis=1,
+                           count=mask_width).view(bool)[:, col0 - mask_col:col1 - mask_col]
+    bits = np.packbits(inside, axis=1)
+    bits.setflags(write=False)
+    return {"window": (row0 - row, col0 - col, row1 - row0, col1 - col0), "bits": bits, "pixels": int(inside.sum())}
+
+
+def raster_clip_mask(raster, target, root=DATA_ROOT):
+    window = raster.get("window")
+    if window is None or raster.get("grid_transform") is None:
+        return clip_mask(raster["transform"], raster["data"].shape, raster.get("crs"), target, root)
+    from affine import Affine
+    row, col, height, width = window
+    if raster.get("flipped"):
+        # La maschera è nell'orientamento del file, come per il raster intero
+        row = raster["grid_shape"][0] - row - height
+    mask = clip_mask(Affine(*tuple(raster["grid_transform"])[:6]), tuple(raster["grid_shape"]),
+                     raster.get("crs"), target, root)
+    return window_mask(mask, (row, col, height, width))
+
+
+def unpack(mask):
+    height, width = mask["window"][2:]
+    return np.unpackbits(mask["bits"], axis=1, count=width).view(bool)
+
+
+def apply_clip(data, mask, fill=np.nan, windowed=False):
+    # data è la griglia intera (se windowed, già la sola finestra della maschera)
+    row, col, height, width = mask["window"]
+    view = data if windowed else data[row:row + height, col:col + width]
+    return np.where(unpack(mask), view, fill)
+
+
+def clip_bounds(mask, transform):
+    from rasterio import windows
+    row, col, height, width = mask["window"]
+    return windows.bounds(windows.Window(col, row, width, height), transform)
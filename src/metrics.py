@@ -0,0 +1,209 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+
+import profiling
+
+# ====================================================
+# Metriche per callback in formato Prometheus
+# ====================================================
+# Ogni callback Dash viene avvolta da instrument(): registra la durata totale,
+# le fasi interne (catalog_lookup, raster_decode, vector_decode, transform,
+# figure_build, serialize), i byte della risposta e gli hit/miss di cache.
+# Le fasi sono attribuite alla callback in corso tramite una ContextVar, così
+# le funzioni di caricamento non devono sapere chi le ha chiamate.
+# Il testo per Prometheus è servito su /metrics (vedi init_app).
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7, 5e7, 1e8)
+
+_current_callback = contextvars.ContextVar("current_callback", default="background")
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, total, count) in items:
+            labels = _format_labels(self.labelnames, key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{{{_format_labels(self.labelnames, key)}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+
+
+callback_seconds = Histogram("dashboard_callback_duration_seconds",
+                             "Durata totale della richiesta di callback", ("callback",), LATENCY_BUCKETS)
+stage_seconds = Histogram("dashboard_callback_stage_seconds",
+                          "Durata delle fasi interne di una callback", ("callback", "stage"), LATENCY_BUCKETS)
+output_bytes = Histogram("dashboard_callback_output_bytes",
+                         "Dimensione della risposta JSON della callback", ("callback",), BYTES_BUCKETS)
+callback_calls = Counter("dashboard_callback_calls_total",
+                         "Invocazioni di callback per esito", ("callback", "status"))
+cache_lookups = Counter("dashboard_cache_lookups_total",
+                        "Lookup in cache per callback ed esito", ("callback", "cache", "result"))
+
+_collectors = []
+
+
+# Funzioni che restituiscono righe aggiuntive (es. gauge sullo stato delle cache)
+def register_collector(collector):
+    _collectors.append(collector)
+
+
+def current_callback():
+    return _current_callback.get()
+
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - t0, callback=_current_callback.get(), stage=name)
+
+
+def record_cache(cache, hit):
+    cache_lookups.inc(callback=_current_callback.get(), cache=cache, result="hit" if hit else "miss")
+
+
+def instrument(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_callback.set(name)
+        t0 = time.perf_counter()
+        status = "ok"
+        try:
+            if profiling.should_profile(name, args):
+                return profiling.profile_call(name, func, args, kwargs)
+            return func(*args, **kwargs)
+        except PreventUpdate:
+            # Uscita normale (es. pan allo stesso livello di overview), non un errore
+            status = "prevented"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            _current_callback.reset(token)
+            callback_calls.inc(callback=name, status=status)
+            _note_request_callback(name, elapsed)
+
+    return wrapper
+
+
+def _note_request_callback(name, elapsed):
+    # Dentro una richiesta Flask memorizza la callback servita: after_request
+    # misura la serializzazione e i byte della risposta
+    from flask import g, has_request_context
+    if has_request_context():
+        g.metrics_callback = name
+        g.metrics_callback_seconds = elapsed
+
+
+def render_prometheus():
+    lines = []
+    for metric in (callback_seconds, stage_seconds, output_bytes, callback_calls, cache_lookups):
+        lines += metric.render()
+    for collector in _collectors:
+        lines += collector()
+    return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name, help_text, values, labelname=None):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for label, value in values.items():
+        if labelname:
+            lines.append(f'{name}{{{labelname}="{_escape(label)}"}} {value}')
+        else:
+            lines.append(f"{name} {value}")
+    return lines
+
+
+def init_app(server):
+    from flask import Response, g, request
+
+    @server.before_request
+    def _metrics_start():
+        if request.path.endswith("_dash-update-component"):
+            g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def _metrics_finish(response):
+        start = g.pop("metrics_start", None)
+        name = g.pop("metrics_callback", None)
+        if start is None or name is None:
+            return response
+        total = time.perf_counter() - start
+        callback_seconds.observe(total, callback=name)
+        # Il tempo fuori dalla funzione è quasi tutto serializzazione JSON della figura
+        serialize = max(total - g.pop("metrics_callback_seconds", 0.0), 0.0)
+        stage_seconds.observe(serialize, callback=name, stage="serialize")
+        if not response.direct_passthrough:
+            output_bytes.observe(response.calculate_content_length() or len(response.get_data()), callback=name)
+        return response
+
+    @server.route("/metrics")
+    def _metrics():
+        return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,65 @@
+import numpy as np
+
+# ====================================================
+# Nodata dei layer, risolto una volta al caricamento
+# ====================================================
+# Per ogni layer i valori sentinella dichiarati qui si sommano al tag nodata
+# del file (e ai NaN già presenti). La maschera risultante viene calcolata una
+# volta quando il raster è letto e salvata con il raster ("nodata", True =
+# pixel senza dato, read-only): statistiche, mappe e serie storica dei pixel
+# usano la maschera invece di riconfrontare l'array a ogni callback.
+
+LAYER_NODATA = {
+    # 65533 = acqua nei prodotti MODIS GPP (65535, il riempimento, è già il nodata del file)
+    "gross_primary_production": (65533,),
+    # Anomalie e cambi di copertura: -1 = fuori area
+    "deforestation": (-1,),
+    "climate_change": (-1,),
+    "land_cover_change": (-1,),
+}
+
+# Per le letture fatte solo dal nome del file (es. script e benchmark)
+FILENAME_LAYERS = {
+    "deforestation": "deforestation",
+    "climatechange": "climate_change",
+    "change_image": "land_cover_change",
+    "_gp": "gross_primary_production",
+}
+
+
+def layer_for_file(filename):
+    name = filename.lower()
+    return next((layer for part, layer in FILENAME_LAYERS.items() if part in name), None)
+
+
+def sentinels(map_type, file_nodata=None):
+    values = list(LAYER_NODATA.get(map_type, ()))
+    if file_nodata is not None and not np.isnan(file_nodata):
+        values.append(file_nodata)
+    return values
+
+
+def nodata_mask(values, sentinel_values):
+    mask = np.isin(values, sentinel_values) if sentinel_values else np.zeros(values.shape, dtype=bool)
+    if values.dtype.kind == "f":
+        mask |= np.isnan(values)
+    return mask
+
+
+def read_band(src, band=1, map_type=None, **kwargs):
+    # (float32 con NaN sui nodata, maschera read-only); kwargs passati a src.read
+    values = src.read(band, **kwargs)
+    mask = nodata_mask(values, sentinels(map_type, src.nodata))
+    values = values.astype("float32")
+    values[mask] = np.nan
+    mask.setflags(write=False)
+    return values, mask
+
+
+def valid_statistics(values, mask):
+    # Min/max/media dei soli pixel validi; None se non ce ne sono
+    valid = values[~mask]
+    if valid.size == 0:
+        return None
+    return {"minimum": float(valid.min()), "maximum": float(valid.max()), "mean": float(valid.mean()),
+            "count": int(valid.size)}
@@ -0,0 +1,77 @@
+import functools
+import math
+import os
+
+# ====================================================
+# Letture dalle overview dei raster
+# ====================================================
+# Per anteprime, mappe poco zoomate e miniature non serve la risoluzione piena:
+# viene letto il livello di overview più grossolano che abbia almeno max_size
+# pixel sul lato lungo. Le overview possono essere interne (COG di cog.py) o
+# esterne (.tif.ovr). In temp_dp ci sono solo i .tif.ovr (il .tif nazionale non
+# è distribuito): in quel caso il .ovr viene aperto direttamente e il suo
+# primo livello fa da risoluzione piena.
+# Le statistiche di banda salvate da GDAL nei .aux.xml (STATISTICS_*) vengono
+# lette senza decodificare i pixel.
+
+
+def source_path(path):
+    # Il .tif se esiste, altrimenti le sue overview esterne
+    if not os.path.exists(path) and os.path.exists(path + ".ovr"):
+        return path + ".ovr"
+    return path
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _levels(path, mtime):
+    import rasterio
+
+    with rasterio.open(path) as src:
+        factors = src.overviews(1)
+        return [(src.height, src.width)] + [(math.ceil(src.height / f), math.ceil(src.width / f)) for f in factors]
+
+
+def levels(path):
+    # [(altezza, larghezza)] dalla risoluzione piena al livello più grossolano
+    path = source_path(path)
+    return _levels(path, _mtime(path))
+
+
+def pick_level(path, max_size):
+    # None = risoluzione piena, altrimenti l'indice per rasterio.open(overview_level=...)
+    if not max_size:
+        return None
+    shapes = levels(path)
+    level = 0
+    for i, (height, width) in enumerate(shapes):
+        if max(height, width) >= max_size:
+            level = i
+    return None if level == 0 else level - 1
+
+
+def open_level(path, overview_level=None):
+    import rasterio
+
+    path = source_path(path)
+    if overview_level is None:
+        return rasterio.open(path)
+    # Il dataset aperto su un livello ha già transform e dimensioni del livello
+    return rasterio.open(path, overview_level=overview_level)
+
+
+def band_statistics(src, band=1):
+    # Statistiche da .aux.xml (o dai metadati interni); None se mancano
+    tags = src.tags(band)
+    try:
+        stats = {name: float(tags[f"STATISTICS_{name.upper()}"]) for name in ("minimum", "maximum", "mean")}
+    except (KeyError, ValueError):
+        return None
+    stats["approximate"] = tags.get("STATISTICS_APPROXIMATE", "NO").upper() == "YES"
+    return stats
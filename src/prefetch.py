@@ -0,0 +1,91 @@
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# ====================================================
+# Prefetch a bassa priorità dei raster adiacenti
+# ====================================================
+# Dopo aver servito (layer, anno) il dashboard chiede al Prefetcher di scaldare
+# la cache con le chiavi vicine. I job girano su un pool piccolo e limitato e
+# cedono il passo finché ci sono richieste in primo piano in corso.
+
+FOREGROUND_POLL_S = 0.05
+FOREGROUND_MAX_WAIT_S = 2.0
+
+
+class Prefetcher:
+    def __init__(self, cache, loader, max_workers=2, max_pending=8, key=None):
+        # loader(*args) carica la chiave passando dalla cache in modalità prefetch;
+        # key(*args) dà la chiave in cache (default: la tupla degli argomenti
+        # convertiti in stringa)
+        self.cache = cache
+        self.loader = loader
+        self.key = key or (lambda *args: tuple(str(a) for a in args))
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._foreground = 0
+        self._stats = {"scheduled": 0, "skipped_cached": 0, "dropped": 0, "errors": 0}
+
+    # Le richieste servite all'utente vanno racchiuse in questo context manager,
+    # così i job di prefetch aspettano che il server sia libero.
+    @contextmanager
+    def foreground(self):
+        with self._lock:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+
+    def schedule(self, keys):
+        for args in keys:
+            key = self.key(*args)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                if key in self.cache:
+                    self._stats["skipped_cached"] += 1
+                    continue
+                if len(self._pending) >= self.max_pending:
+                    self._stats["dropped"] += 1
+                    continue
+                self._pending.add(key)
+                self._stats["scheduled"] += 1
+            self._executor.submit(self._run, key, args)
+
+    def _run(self, key, args):
+        try:
+            waited = 0.0
+            while waited < FOREGROUND_MAX_WAIT_S:
+                with self._lock:
+                    if self._foreground == 0:
+                        break
+                time.sleep(FOREGROUND_POLL_S)
+                waited += FOREGROUND_POLL_S
+            _, error = self.loader(*args)
+            if error:
+                with self._lock:
+                    self._stats["errors"] += 1
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        cache_stats = self.cache.stats()
+        for name in ("prefetch_loads", "prefetch_hits", "prefetch_wasted", "prefetch_hit_rate"):
+            stats[name] = cache_stats[name]
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
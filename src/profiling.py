@@ -0,0 +1,237 @@
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+
+# ====================================================
+# Profiler su richiesta per singole callback
+# ====================================================
+# Si attiva in due modi:
+# - variabile d'ambiente DASHBOARD_PROFILE, es. "update_map:deforestation,update_compare_maps"
+#   (callback[:valore di un argomento]; "all" profila tutte le callback);
+# - flag ?profile=...&token=... nell'URL della pagina (arriva nel Referer delle
+#   richieste _dash-update-component) o della richiesta stessa, con la stessa
+#   sintassi. ?profile=1 profila tutte le callback scatenate da quella pagina.
+# Per ogni invocazione profilata vengono scritti in PROFILE_DIR un file .pstats
+# (cProfile, deterministico) e un file .collapsed con gli stack campionati da un
+# thread separato (formato "collapsed" di flamegraph.pl / speedscope). La pagina
+# /admin/profiles?token=... li elenca.
+# Il flag nell'URL e le pagine /admin/profiles esistono solo se è impostato
+# DASHBOARD_PROFILE_TOKEN e richiedono lo stesso token (parametro token o
+# header X-Profile-Token): senza, un visitatore qualsiasi potrebbe accendere il
+# profiler e leggere percorsi e codice del server.
+
+PROFILE_DIR = os.environ.get("DASHBOARD_PROFILE_DIR", "./profiles")
+PROFILE_KEEP = int(os.environ.get("DASHBOARD_PROFILE_KEEP", "50"))
+SAMPLE_INTERVAL = float(os.environ.get("DASHBOARD_PROFILE_INTERVAL_MS", "5")) / 1000
+# Vuoto = profilazione solo da DASHBOARD_PROFILE, niente flag nell'URL né pagine di admin
+PROFILE_TOKEN = os.environ.get("DASHBOARD_PROFILE_TOKEN", "")
+
+_write_lock = threading.Lock()
+
+
+def parse_rules(spec):
+    rules = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if item in ("1", "all", "true"):
+            rules.append((None, None))
+            continue
+        callback, _, value = item.partition(":")
+        rules.append((callback or None, value or None))
+    return rules
+
+
+ENV_RULES = parse_rules(os.environ.get("DASHBOARD_PROFILE"))
+
+
+def _matches(rules, name, args):
+    values = {str(a) for a in args if isinstance(a, (str, int, float))}
+    for callback, value in rules:
+        if callback is not None and callback != name:
+            continue
+        if value is not None and value not in values:
+            continue
+        return True
+    return False
+
+
+def _valid_token(token):
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def _request_token(query=None):
+    from flask import request
+    token = request.headers.get("X-Profile-Token") or request.args.get("token")
+    if token is None and query is not None:
+        token = query.get("token", [None])[0]
+    return token
+
+
+def _request_rules():
+    from flask import has_request_context, request
+    if not PROFILE_TOKEN or not has_request_context():
+        return []
+    spec = request.args.get("profile")
+    query = None
+    if spec is None and request.referrer:
+        query = parse_qs(urlparse(request.referrer).query)
+        spec = query.get("profile", [None])[0]
+    if spec is None or not _valid_token(_request_token(query)):
+        return []
+    return parse_rules(spec)
+
+
+def should_profile(name, args):
+    return _matches(ENV_RULES, name, args) or _matches(_request_rules(), name, args)
+
+
+class StackSampler(threading.Thread):
+    # Campiona lo stack del thread che esegue la callback ogni SAMPLE_INTERVAL secondi
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _slug(name, args):
+    parts = [name] + [str(a) for a in args if isinstance(a, (str, int, float)) and a is not None]
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", "_".join(parts))[:80]
+
+
+def profile_call(name, func, args, kwargs):
+    import cProfile
+
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - t0
+        sampler.stop()
+        _write_profile(name, args, elapsed, profiler, sampler.stacks)
+
+
+def _write_profile(name, args, elapsed, profiler, stacks):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    base = os.path.join(PROFILE_DIR, f"{stamp}_{os.getpid()}_{_slug(name, args)}")
+    profiler.dump_stats(base + ".pstats")
+    with open(base + ".collapsed", "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    print(f"[profile] {name} {elapsed:.3f} s -> {base}.pstats", flush=True)
+    _prune()
+
+
+def _prune():
+    with _write_lock:
+        try:
+            names = sorted(n for n in os.listdir(PROFILE_DIR) if n.endswith(".pstats"))
+        except FileNotFoundError:
+            return
+        for old in names[:max(len(names) - PROFILE_KEEP, 0)]:
+            for ext in (".pstats", ".collapsed"):
+                try:
+                    os.remove(os.path.join(PROFILE_DIR, old[:-len(".pstats")] + ext))
+                except FileNotFoundError:
+                    pass
+
+
+def list_profiles():
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted((n for n in names if n.endswith(".pstats")), reverse=True):
+        base = name[:-len(".pstats")]
+        path = os.path.join(PROFILE_DIR, name)
+        profiles.append({
+            "name": base,
+            "size": os.path.getsize(path),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(path))),
+            "collapsed": os.path.exists(os.path.join(PROFILE_DIR, base + ".collapsed")),
+        })
+    return profiles
+
+
+def pstats_report(base, top=40):
+    import io
+    import pstats
+
+    out = io.StringIO()
+    stats = pstats.Stats(os.path.join(PROFILE_DIR, base + ".pstats"), stream=out)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+    return out.getvalue()
+
+
+def init_app(server):
+    from urllib.parse import urlencode
+
+    from flask import Response, abort, request, send_from_directory
+    from markupsafe import escape
+
+    if not PROFILE_TOKEN:
+        return
+
+    @server.before_request
+    def _check_token():
+        if request.path.startswith("/admin/profiles") and not _valid_token(_request_token()):
+            abort(403)
+
+    @server.route("/admin/profiles")
+    def _profiles_page():
+        # Il token passato in query viene ripetuto nei link (con l'header non serve)
+        query = f"?{urlencode({'token': request.args['token']})}" if "token" in request.args else ""
+        rows = []
+        for p in list_profiles():
+            links = [f'<a href="/admin/profiles/{p["name"]}.txt{query}">report</a>',
+                     f'<a href="/admin/profiles/{p["name"]}.pstats{query}">pstats</a>']
+            if p["collapsed"]:
+                links.append(f'<a href="/admin/profiles/{p["name"]}.collapsed{query}">collapsed</a>')
+            rows.append(f"<tr><td>{escape(p['created'])}</td><td>{escape(p['name'])}</td>"
+                        f"<td>{p['size'] / 1024:.1f} KB</td><td>{' | '.join(links)}</td></tr>")
+        body = "".join(rows) or '<tr><td colspan="4">Nessun profilo registrato</td></tr>'
+        return ("<html><head><title>Profili</title></head><body>"
+                f"<h2>Profili delle callback ({escape(os.path.abspath(PROFILE_DIR))})</h2>"
+                "<p>Attiva con DASHBOARD_PROFILE=callback[:valore] oppure aprendo il dashboard con ?profile=...&amp;token=...</p>"
+                "<table border=\"1\" cellpadding=\"4\"><tr><th>Data</th><th>Profilo</th><th>Dimensione</th><th></th></tr>"
+                f"{body}</table></body></html>")
+
+    @server.route("/admin/profiles/<name>.txt")
+    def _profile_report(name):
+        if not os.path.exists(os.path.join(PROFILE_DIR, os.path.basename(name) + ".pstats")):
+            abort(404)
+        return Response(pstats_report(os.path.basename(name)), mimetype="text/plain")
+
+    @server.route("/admin/profiles/<path:filename>")
+    def _profile_file(filename):
+        if not filename.endswith((".pstats", ".collapsed")):
+            abort(404)
+        return send_from_directory(os.path.abspath(PROFILE_DIR), filename, as_attachment=filename.endswith(".pstats"))
@@ -0,0 +1,130 @@
+import numpy as np
+
+# ====================================================
+# Raster di indici colore uint8 per le mappe
+# ====================================================
+# Invece di mandare al browser i float del raster (o il risultato di np.interp
+# ricalcolato a ogni render), ogni (layer, anno, scala colori) viene
+# convertito una volta in un raster uint8 di indici di classe:
+# - GPP: classi tra i breakpoint [0, 150, ..., 60000];
+# - land cover: le 17 classi IGBP di MODIS MCD12Q1;
+# - cambi di copertura e anomalie: perdita / nessun cambio / guadagno.
+# L'indice len(colors) indica il nodata e ha colore trasparente. La heatmap
+# riceve z uint8 (1 byte per pixel invece di 4) con una scala colori discreta.
+
+GPP_BREAKPOINTS = [0, 150, 300, 450, 600, 750, 900, 1100, 1500, 4000, 60000]
+
+IGBP_CLASSES = [
+    ("Evergreen Needleleaf Forests", "#05450a"),
+    ("Evergreen Broadleaf Forests", "#086a10"),
+    ("Deciduous Needleleaf Forests", "#54a708"),
+    ("Deciduous Broadleaf Forests", "#78d203"),
+    ("Mixed Forests", "#009900"),
+    ("Closed Shrublands", "#c6b044"),
+    ("Open Shrublands", "#dcd159"),
+    ("Woody Savannas", "#dade48"),
+    ("Savannas", "#fbff13"),
+    ("Grasslands", "#b6ff05"),
+    ("Permanent Wetlands", "#27ff87"),
+    ("Croplands", "#c24f44"),
+    ("Urban and Built-up Lands", "#a5a5a5"),
+    ("Cropland/Natural Vegetation Mosaics", "#ff6d4c"),
+    ("Permanent Snow and Ice", "#69fff8"),
+    ("Barren", "#f9ffa4"),
+    ("Water Bodies", "#1c0dff"),
+]
+
+CHANGE_COLORS = ["red", "lightgray", "green"]
+NODATA_COLOR = "rgba(0,0,0,0)"
+
+
+def _viridis(n):
+    from plotly.colors import sample_colorscale, sequential
+    return sample_colorscale(sequential.Viridis, [i / max(n - 1, 1) for i in range(n)])
+
+
+def _gpp_index(raster):
+    # np.digitize sui breakpoint interni: classe i = [bp[i], bp[i+1])
+    return np.digitize(raster["data"], GPP_BREAKPOINTS[1:-1]).astype("uint8")
+
+
+def _igbp_index(raster):
+    return (np.clip(np.nan_to_num(raster["data"], nan=1), 1, len(IGBP_CLASSES)) - 1).astype("uint8")
+
+
+def _change_index(raster):
+    # Valori 0 / 0.5 / 1 del raster dei cambi di copertura
+    return np.rint(np.nan_to_num(raster["data"], nan=0) * 2).clip(0, 2).astype("uint8")
+
+
+def _anomaly_index(raster):
+    # Stessa logica della vecchia visualization_mask: 1 = pixel con anomalia,
+    # colorata in base al segno della differenza; 0 = nessuna anomalia
+    data, diff = raster["data"], raster["difference"]
+    index = np.full(data.shape, len(CHANGE_COLORS), dtype="uint8")
+    index[(data == 1) & (diff < 0)] = 0
+    index[data == 0] = 1
+    index[(data == 1) & (diff > 0)] = 2
+    return index
+
+
+SCHEMES = {
+    "gross_primary_production": {
+        "name": "gpp_breaks",
+        "index": _gpp_index,
+        "colors": _viridis(len(GPP_BREAKPOINTS) - 1),
+        "labels": [f"{GPP_BREAKPOINTS[i]}-{GPP_BREAKPOINTS[i + 1]}" for i in range(len(GPP_BREAKPOINTS) - 1)],
+    },
+    "land_cover": {
+        "name": "igbp",
+        "index": _igbp_index,
+        "colors": [color for _, color in IGBP_CLASSES],
+        "labels": [label for label, _ in IGBP_CLASSES],
+    },
+    "land_cover_change": {
+        "name": "change",
+        "index": _change_index,
+        "colors": CHANGE_COLORS,
+        "labels": ["0", "0.5", "1"],
+    },
+    "deforestation": {
+        "name": "anomaly",
+        "index": _anomaly_index,
+        "colors": CHANGE_COLORS,
+        "labels": ["-", "0", "+"],
+    },
+}
+SCHEMES["climate_change"] = SCHEMES["deforestation"]
+
+
+def nodata_index(scheme):
+    return len(scheme["colors"])
+
+
+def index_raster(raster, scheme):
+    index = scheme["index"](raster)
+    if "nodata" in raster:
+        index[raster["nodata"]] = nodata_index(scheme)
+    index.setflags(write=False)
+    return index
+
+
+def colorscale(scheme):
+    # Scala a gradini: ogni indice occupa un intervallo di colore uniforme;
+    # l'ultimo gradino (nodata) è trasparente
+    colors = list(scheme["colors"]) + [NODATA_COLOR]
+    n = len(colors)
+    scale = []
+    for i, color in enumerate(colors):
+        scale += [[i / n, color], [(i + 1) / n, color]]
+    return scale
+
+
+def heatmap_style(scheme, title=""):
+    n = len(scheme["colors"])
+    return dict(
+        colorscale=colorscale(scheme),
+        zmin=-0.5, zmax=n + 0.5,
+        showscale=True,
+        colorbar=dict(tickmode="array", tickvals=list(range(n)), ticktext=scheme["labels"], title=title),
+    )
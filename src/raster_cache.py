@@ -0,0 +1,224 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ====================================================
+# Cache LRU thread-safe per i raster già decodificati
+# ====================================================
+# Le chiavi sono tuple (map_type, anno) e i valori sono i dizionari restituiti
+# da load_geotiff. Gli array in cache sono marcati read-only: chi deve
+# modificarli ne fa una copia (es. np.where) invece di scrivere in place.
+
+DEFAULT_CACHE_MB = int(os.environ.get("RASTER_CACHE_MB", "512"))
+
+
+def estimate_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    return 0
+
+
+def freeze_arrays(value):
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for v in value.values():
+            freeze_arrays(v)
+    return value
+
+
+class _Entry:
+    __slots__ = ("value", "nbytes", "prefetched")
+
+    def __init__(self, value, nbytes, prefetched):
+        self.value = value
+        self.nbytes = nbytes
+        self.prefetched = prefetched
+
+
+class RasterCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_MB * 1024 * 1024, on_evict=None, on_lookup=None):
+        self.max_bytes = max_bytes
+        # on_evict(key, value) viene chiamata fuori dal lock per ogni entry rimossa,
+        # on_lookup(key, hit) per ogni lookup in primo piano (non di prefetch)
+        self.on_evict = on_evict
+        self.on_lookup = on_lookup
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "prefetch_loads": 0,
+            "prefetch_hits": 0,
+            "prefetch_wasted": 0,
+        }
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries or key in self._inflight
+
+    def get_or_load(self, key, loader, prefetch=False):
+        # loader() deve restituire la coppia (valore, errore) come load_geotiff;
+        # gli errori non vengono messi in cache.
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    if not prefetch:
+                        self._stats["hits"] += 1
+                        if entry.prefetched:
+                            self._stats["prefetch_hits"] += 1
+                            entry.prefetched = False
+                    value = entry.value
+                    break
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    if prefetch:
+                        self._stats["prefetch_loads"] += 1
+                    else:
+                        self._stats["misses"] += 1
+                    value = None
+                    break
+            # Un altro thread (spesso il prefetcher) sta già caricando la stessa chiave
+            event.wait()
+            with self._lock:
+                if key not in self._entries:
+                    # Il caricamento concorrente è fallito: riprova in proprio
+                    continue
+
+        if not prefetch and self.on_lookup is not None:
+            self.on_lookup(key, value is not None)
+        if value is not None:
+            return value, None
+
+        try:
+            value, error = loader()
+            if error is None and value is not None:
+                self._insert(key, freeze_arrays(value), prefetch)
+            return value, error
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _insert(self, key, value, prefetched):
+        nbytes = estimate_nbytes(value)
+        removed = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+                removed.append((key, old.value))
+            self._entries[key] = _Entry(value, nbytes, prefetched)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+                if evicted.prefetched:
+                    self._stats["prefetch_wasted"] += 1
+                removed.append((evicted_key, evicted.value))
+        self._notify_evicted(removed)
+
+    def _notify_evicted(self, removed):
+        if self.on_evict is None:
+            return
+        for key, value in removed:
+            self.on_evict(key, value)
+
+    def clear(self):
+        with self._lock:
+            removed = [(key, entry.value) for key, entry in self._entries.items()]
+            self._entries.clear()
+            self._bytes = 0
+        self._notify_evicted(removed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        loads = stats["prefetch_loads"]
+        stats["prefetch_hit_rate"] = stats["prefetch_hits"] / loads if loads else 0.0
+        return stats
+
+
+# ====================================================
+# Una cache per regione
+# ====================================================
+# Ogni regione ha la propria RasterCache, così i raster di una regione non
+# espellono quelli di un'altra. Le cache vengono create alla prima richiesta e
+# solo le max_regions usate più di recente restano attive: il budget totale è
+# quindi limitato a max_regions cache, qualunque sia il numero di regioni servite.
+# Le chiavi sono tuple il cui primo elemento è l'id della regione.
+
+MAX_ACTIVE_REGIONS = int(os.environ.get("RASTER_CACHE_REGIONS", "4"))
+
+
+class RegionCaches:
+    def __init__(self, factory, max_regions=MAX_ACTIVE_REGIONS):
+        # factory(region) crea la RasterCache di una regione
+        self.factory = factory
+        self.max_regions = max_regions
+        self._caches = OrderedDict()
+        self._lock = threading.Lock()
+        self._regions_evicted = 0
+
+    def cache(self, region):
+        retired = []
+        with self._lock:
+            cache = self._caches.get(region)
+            if cache is None:
+                cache = self._caches[region] = self.factory(region)
+                while len(self._caches) > self.max_regions:
+                    retired.append(self._caches.popitem(last=False)[1])
+                    self._regions_evicted += 1
+            else:
+                self._caches.move_to_end(region)
+        for old in retired:
+            old.clear()
+        return cache
+
+    def __contains__(self, key):
+        with self._lock:
+            cache = self._caches.get(key[0])
+        return cache is not None and key in cache
+
+    def get_or_load(self, key, loader, prefetch=False):
+        return self.cache(key[0]).get_or_load(key, loader, prefetch=prefetch)
+
+    def clear(self):
+        with self._lock:
+            caches = list(self._caches.values())
+            self._caches.clear()
+        for cache in caches:
+            cache.clear()
+
+    def stats(self):
+        with self._lock:
+            caches = dict(self._caches)
+            regions_evicted = self._regions_evicted
+        per_region = {region: cache.stats() for region, cache in caches.items()}
+        totals = {name: sum(s[name] for s in per_region.values())
+                  for name in ("hits", "misses", "evictions", "prefetch_loads", "prefetch_hits",
+                               "prefetch_wasted", "entries", "bytes", "max_bytes")}
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+        loads = totals["prefetch_loads"]
+        totals["prefetch_hit_rate"] = totals["prefetch_hits"] / loads if loads else 0.0
+        totals["regions_evicted"] = regions_evicted
+        totals["regions"] = per_region
+        return totals
@@ -0,0 +1,76 @@
+import json
+import os
+
+from catalog import DATA_ROOT, LAYER_SUBDIRS, PRICE_DATA_FILE
+
+# ====================================================
+# Catalogo delle regioni
+# ====================================================
+# Ogni regione dichiara la propria cartella dati, i layer (tipo -> sottocartella),
+# l'estensione, il centro/zoom della mappa e i default dell'interfaccia.
+# Le regioni vengono lette da un file JSON (DASHBOARD_REGIONS_FILE, vedi
+# regions.example.json); senza file resta la sola regione di Assaba.
+# I dati di una regione vengono caricati solo quando qualcuno la seleziona.
+
+REGIONS_FILE = os.environ.get("DASHBOARD_REGIONS_FILE", "./regions.json")
+
+REGION_DEFAULTS = {
+    "layers": LAYER_SUBDIRS,
+    "center": None,
+    "zoom": 6,
+    "bbox": None,
+    "default_map_type": "admin_layers",
+    "price_file": None,
+}
+
+BUILTIN_REGIONS = {
+    "assaba": {
+        "name": "Assaba",
+        "root": DATA_ROOT,
+        "center": {"lat": 16.7, "lon": -11.5},
+        "bbox": [-12.9, 15.1, -10.5, 18.4],
+        "price_file": PRICE_DATA_FILE,
+    },
+}
+
+
+def _complete(region_id, config):
+    region = dict(REGION_DEFAULTS, **config)
+    region["id"] = region_id
+    region.setdefault("name", region_id.replace("_", " ").title())
+    region["layers"] = dict(region["layers"])
+    if region["center"] is None and region["bbox"] is not None:
+        minx, miny, maxx, maxy = region["bbox"]
+        region["center"] = {"lat": (miny + maxy) / 2, "lon": (minx + maxx) / 2}
+    if region["center"] is None:
+        region["center"] = BUILTIN_REGIONS["assaba"]["center"]
+    return region
+
+
+def load_regions(path=REGIONS_FILE):
+    try:
+        with open(path) as f:
+            configs = json.load(f)["regions"]
+    except FileNotFoundError:
+        configs = BUILTIN_REGIONS
+    # Le cartelle relative sono relative al file delle regioni
+    base = os.path.dirname(os.path.abspath(path))
+    regions = {}
+    for region_id, config in configs.items():
+        config = dict(config)
+        if configs is not BUILTIN_REGIONS and not os.path.isabs(config["root"]):
+            config["root"] = os.path.normpath(os.path.join(base, config["root"]))
+        regions[region_id] = _complete(region_id, config)
+    return regions
+
+
+REGIONS = load_regions()
+DEFAULT_REGION = os.environ.get("DASHBOARD_DEFAULT_REGION", next(iter(REGIONS)))
+
+
+def get_region(region_id=None):
+    return REGIONS[region_id or DEFAULT_REGION]
+
+
+def region_options():
+    return [{"label": region["name"], "value": region_id} for region_id, region in REGIONS.items()]
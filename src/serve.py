@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+# ====================================================
+# Server di produzione: preload nel processo padre e fork dei worker
+# ====================================================
+# Il padre costruisce catalogo, dati dei prezzi, maschere dei distretti e i
+# raster "caldi", poi fa fork di N worker che ereditano tutto copy-on-write.
+# L'avvio di N worker costa quindi un solo caricamento dei dati.
+#
+# Per non sporcare le pagine condivise dopo il fork:
+# - gli array in cache sono read-only, quindi i buffer numpy non vengono mai scritti;
+# - gc.freeze() sposta tutti gli oggetti creati nel padre nella generazione
+#   permanente: il garbage collector dei figli non ne visita (e quindi non ne
+#   scrive) le intestazioni. I refcount toccano solo le piccole intestazioni
+#   degli ndarray, mai i buffer dei dati.
+# Nel padre non deve girare nessun thread al momento del fork (niente prefetch).
+
+
+def preload(hot_years, log):
+    import dashboard
+    from masks import district_labels
+
+    t0 = time.perf_counter()
+    catalog = dashboard.get_catalog()
+    log(f"catalog: {len(catalog['layers'])} layer ({'manifest' if catalog.get('from_manifest') else 'scan'})")
+    price_df = dashboard.get_price_df()
+    log(f"price data: {len(price_df)} righe")
+
+    loaded = 0
+    grids = 0
+    for map_type, info in dashboard.data_type_mapping.items():
+        if info["type"] != "geotiff":
+            continue
+        years = [y for y in dashboard.get_years_for_map_type(map_type) if y != "N/A"]
+        if hot_years > 0:
+            years = years[-hot_years:]
+        for year in years:
+            # Stesso livello di overview della mappa a zoom pieno (chiave letta da update_map)
+            data, error = dashboard.load_data(map_type, year, max_size=dashboard.MAP_MAX_SIZE)
+            if error or data is None:
+                log(f"  {map_type} {year}: {error}")
+                continue
+            loaded += 1
+            try:
+                if district_labels(data) is not None:
+                    grids += 1
+            except Exception as e:
+                log(f"  maschere distretti {map_type} {year}: {e}")
+    # Tabella dei layer sui mercati per il grafico dei prezzi (altrimenti costruita alla prima richiesta)
+    try:
+        log(f"layer sui mercati: {len(dashboard.get_market_table())} righe")
+    except Exception as e:
+        log(f"  layer sui mercati: {e}")
+    # Dash registra le callback alla prima richiesta servita: farlo qui evita che
+    # le prime richieste concorrenti di un worker trovino callback_map incompleta
+    dashboard.server.test_client().get("/_dash-dependencies")
+    stats = dashboard.raster_cache.stats()
+    log(f"raster caldi: {loaded} ({stats['bytes'] / 1e6:.1f} MB), griglie distretti: {grids}")
+    log(f"preload completato in {time.perf_counter() - t0:.2f} s")
+    return dashboard.app
+
+
+def run_worker(app, sock, threaded):
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app.server, threaded=threaded, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def spawn_worker(app, sock, threaded):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, threaded)
+        except SystemExit as e:
+            code = e.code or 0
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Avvia il dashboard con preload dei dati e worker forkati")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--hot-years", type=int, default=0,
+                        help="Anni più recenti da precaricare per ogni layer raster (0 = tutti)")
+    parser.add_argument("--no-threads", action="store_true", help="Ogni worker serve una richiesta alla volta")
+    args = parser.parse_args()
+
+    def log(message):
+        print(f"[serve {os.getpid()}] {message}", flush=True)
+
+    app = preload(args.hot_years, log)
+
+    # Il socket viene aperto dal padre e condiviso da tutti i worker
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    for _ in range(args.workers):
+        workers[spawn_worker(app, sock, not args.no_threads)] = time.monotonic()
+    log(f"{len(workers)} worker in ascolto su http://{args.host}:{args.port}")
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        log(f"worker {pid} terminato (status {status}), riavvio")
+        # Evita un loop di fork se il worker muore subito all'avvio
+        if time.monotonic() - started < 1.0:
+            time.sleep(1.0)
+        workers[spawn_worker(app, sock, not args.no_threads)] = time.monotonic()
+
+    sock.close()
+    log("arrestato")
+
+
+if __name__ == "__main__":
+    main()
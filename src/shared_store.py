@@ -0,0 +1,249 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+# ====================================================
+# Store condiviso tra processi per i raster decodificati
+# ====================================================
+# Con più worker (gunicorn) ogni processo decodificherebbe e terrebbe in RAM la
+# propria copia di ogni raster. Qui il primo worker che chiede un raster lo
+# decodifica e lo scrive come .npy in una cartella di cache locale; tutti gli
+# altri lo aprono con np.load(mmap_mode="r"), quindi condividono le stesse
+# pagine della page cache (zero-copy).
+#
+# Struttura su disco:
+#   <cache_dir>/<digest>.lock          flock: LOCK_EX per decodifica/eviction, LOCK_SH per l'attach
+#   <cache_dir>/<digest>/meta.json     scritto per ultimo: se esiste l'entry è completa
+#   <cache_dir>/<digest>/<campo>.npy   un file per ogni array del raster
+#   <cache_dir>/<digest>/refs/<pid>    un riferimento per ogni processo che ha l'entry mappata
+#
+# L'eviction rimuove solo le entry senza riferimenti di processi vivi. Su POSIX
+# un file già mappato resta valido anche dopo l'unlink.
+
+SHARED_CACHE_DIR = os.environ.get("RASTER_SHARED_CACHE_DIR")
+SHARED_CACHE_MB = int(os.environ.get("RASTER_SHARED_CACHE_MB", "4096"))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _encode_meta(value):
+    meta = {}
+    for name, field in value.items():
+        if isinstance(field, np.ndarray) or name == "shared_digest":
+            continue
+        if name == "crs":
+            meta[name] = field.to_wkt() if field is not None else None
+        elif name in ("bounds", "transform", "grid_transform"):
+            meta[name] = list(field)[:6]
+        else:
+            meta[name] = field
+    return meta
+
+
+def _decode_meta(meta):
+    from affine import Affine
+    from rasterio.coords import BoundingBox
+    from rasterio.crs import CRS
+
+    value = dict(meta)
+    if value.get("crs") is not None:
+        value["crs"] = CRS.from_wkt(value["crs"])
+    if value.get("bounds") is not None:
+        value["bounds"] = BoundingBox(*value["bounds"])
+    for name in ("transform", "grid_transform"):
+        if value.get(name) is not None:
+            value[name] = Affine(*value[name])
+    # JSON restituisce le tuple come liste: finestra e griglia entrano nelle chiavi delle cache
+    for name in ("window", "grid_shape"):
+        if value.get(name) is not None:
+            value[name] = tuple(value[name])
+    return value
+
+
+class SharedRasterStore:
+    def __init__(self, cache_dir, max_bytes=SHARED_CACHE_MB * 1024 * 1024):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self._attached = set()
+        self._lock = threading.Lock()
+        self._stats = {"attached": 0, "decoded": 0, "evicted": 0, "errors": 0}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atexit.register(self.release_all)
+
+    def _digest(self, key, source_path):
+        stat = os.stat(source_path)
+        raw = json.dumps([list(map(str, key)), os.path.abspath(source_path), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, digest)
+
+    def _open_lock(self, digest):
+        return open(os.path.join(self.cache_dir, f"{digest}.lock"), "a+")
+
+    # Restituisce (valore, errore) come load_geotiff; decoder(source_path) viene
+    # chiamato solo dal primo processo che chiede la chiave.
+    def get_or_decode(self, key, source_path, decoder):
+        try:
+            digest = self._digest(key, source_path)
+        except OSError:
+            return decoder(source_path)
+
+        with self._open_lock(digest) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            value = self._attach(digest)
+            if value is not None:
+                return value, None
+            # Upgrade a lock esclusivo: un solo processo decodifica
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            value = self._attach(digest)
+            if value is not None:
+                return value, None
+            value, error = decoder(source_path)
+            if error or value is None:
+                return value, error
+            try:
+                self._write(digest, value)
+            except OSError:
+                with self._lock:
+                    self._stats["errors"] += 1
+                return value, None
+            with self._lock:
+                self._stats["decoded"] += 1
+            attached = self._attach(digest)
+        self._evict_if_needed()
+        return (attached if attached is not None else value), None
+
+    def _attach(self, digest):
+        entry_dir = self._entry_dir(digest)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            value = _decode_meta(meta["fields"])
+            for name in meta["arrays"]:
+                value[name] = np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r")
+            os.makedirs(os.path.join(entry_dir, "refs"), exist_ok=True)
+            # os.getpid() e non un valore salvato: lo store può essere creato prima del fork
+            with open(os.path.join(entry_dir, "refs", str(os.getpid())), "w"):
+                pass
+            os.utime(meta_path)
+            value["shared_digest"] = digest
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._lock:
+            self._attached.add(digest)
+            self._stats["attached"] += 1
+        return value
+
+    def _write(self, digest, value):
+        entry_dir = self._entry_dir(digest)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(os.path.join(entry_dir, "refs"))
+        arrays = []
+        nbytes = 0
+        for name, field in value.items():
+            if isinstance(field, np.ndarray):
+                np.save(os.path.join(entry_dir, f"{name}.npy"), np.ascontiguousarray(field))
+                arrays.append(name)
+                nbytes += field.nbytes
+        meta = {"arrays": arrays, "nbytes": nbytes, "fields": _encode_meta(value)}
+        tmp_path = os.path.join(entry_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, "meta.json"))
+
+    # Da chiamare quando il processo non usa più l'entry (es. eviction dalla cache locale)
+    def release(self, value):
+        digest = value.get("shared_digest") if isinstance(value, dict) else None
+        if digest:
+            self._release_digest(digest)
+
+    def _release_digest(self, digest):
+        with self._lock:
+            self._attached.discard(digest)
+        try:
+            os.remove(os.path.join(self._entry_dir(digest), "refs", str(os.getpid())))
+        except OSError:
+            pass
+
+    def release_all(self):
+        with self._lock:
+            digests = list(self._attached)
+        for digest in digests:
+            self._release_digest(digest)
+
+    def _live_refs(self, digest):
+        refs_dir = os.path.join(self._entry_dir(digest), "refs")
+        live = 0
+        try:
+            names = os.listdir(refs_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if name.isdigit() and _pid_alive(int(name)):
+                live += 1
+            else:
+                # Riferimento lasciato da un worker terminato
+                try:
+                    os.remove(os.path.join(refs_dir, name))
+                except OSError:
+                    pass
+        return live
+
+    def _entries(self):
+        entries = []
+        for digest in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, digest, "meta.json")
+            try:
+                stat = os.stat(meta_path)
+                with open(meta_path) as f:
+                    nbytes = json.load(f)["nbytes"]
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((stat.st_mtime, digest, nbytes))
+        return entries
+
+    def _evict_if_needed(self):
+        entries = self._entries()
+        total = sum(nbytes for _, _, nbytes in entries)
+        # Dalla meno recentemente usata; quelle ancora mappate da qualcuno restano
+        for _, digest, nbytes in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with self._open_lock(digest) as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if self._live_refs(digest):
+                    continue
+                # Il file .lock resta: altri processi potrebbero averlo già aperto
+                shutil.rmtree(self._entry_dir(digest), ignore_errors=True)
+            total -= nbytes
+            with self._lock:
+                self._stats["evicted"] += 1
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self._stats)
+            stats["attached_here"] = len(self._attached)
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(nbytes for _, _, nbytes in entries)
+        stats["max_bytes"] = self.max_bytes
+        return stats
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+
+import numpy as np
+
+# ====================================================
+# Dataset sintetici con la struttura di Datasets_Hackathon
+# ====================================================
+# Genera tutti i layer del dashboard (precipitazioni, GPP, popolazione, land
+# cover IGBP, anomalie a due bande, cambi di copertura), i confini
+# amministrativi, strade e corsi d'acqua e il CSV dei prezzi, per benchmark e
+# load test senza i dati reali e a qualsiasi dimensione (fino a 20000 x 20000).
+# - Tutto è vettorizzato e i raster sono scritti a blocchi di righe allineati
+#   ai tile, quindi la memoria non dipende dalla dimensione del raster.
+# - Stesso seed = stessi file. La struttura spaziale (campo liscio, centri
+#   urbani, fiume) dipende solo dal seed del dataset ed è coerente tra layer e
+#   anni; ogni anno aggiunge la propria variazione.
+# - I valori imitano i file reali: tipi, nodata (65533 = acqua nel GPP,
+#   -1 = fuori area nelle anomalie), classi IGBP, città con strade e mercati.
+#
+#   python synthetic.py /tmp/synthetic-2000 --size 2000
+
+SYNTHETIC_BOUNDS = (-12.85, 15.10, -10.55, 18.35)
+SYNTHETIC_YEARS = [2019, 2020, 2021]
+# Pixel per blocco scritto (arrotondato a righe intere di tile)
+CHUNK_PIXELS = int(os.environ.get("DASHBOARD_SYNTHETIC_CHUNK_PIXELS", str(2 * 1024 * 1024)))
+TILE = 256
+
+# Tipo, bande e nodata dei GeoTIFF per layer, come nei file reali
+LAYER_SPECS = {
+    "climate_precipitations": ("float32", 1, -3.4028234663852886e+38),
+    "population_density": ("float32", 1, -3.4028234663852886e+38),
+    "gross_primary_production": ("uint16", 1, 65535),
+    "land_cover": ("uint8", 1, 255),
+    "deforestation": ("int16", 2, None),
+    "climate_change": ("int16", 2, None),
+    "land_cover_change": ("float32", 1, None),
+}
+
+# Nomi dei file per layer e anno (o coppia di anni) riconosciuti dal catalogo
+FILE_NAMES = {
+    "climate_precipitations": "{year}R.tif",
+    "population_density": "Assaba_Pop_{year}.tif",
+    "gross_primary_production": "{year}_GP.tif",
+    "land_cover": "{year}LCT.tif",
+    "deforestation": "deforestation_{year}.tif",
+    "climate_change": "climatechange_{year}.tif",
+    "land_cover_change": "change_image_{year}.tif",
+}
+PAIR_LAYERS = ("deforestation", "climate_change", "land_cover_change")
+
+# Classi IGBP (MCD12Q1) usate per il land cover
+BARREN, OPEN_SHRUBLANDS, GRASSLANDS, SAVANNAS, CROPLANDS, URBAN, WATER = 16, 7, 10, 9, 12, 13, 17
+
+COMMODITIES = [
+    ("cereals and tubers", "Rice (imported)", "KG", 30.0),
+    ("cereals and tubers", "Sorghum", "KG", 15.0),
+    ("oil and fats", "Oil (vegetable)", "L", 50.0),
+    ("miscellaneous food", "Sugar", "KG", 35.0),
+]
+MRU_PER_USD = 36.0
+
+
+# ====================================================
+# Struttura spaziale condivisa (solo dal seed del dataset)
+# ====================================================
+def smooth_field(seed, rows, cols, row_offset, height, width, cells=8):
+    # Campo liscio in [0, 1]: interpolazione bilineare di una griglia grossolana
+    # casuale, identica per ogni blocco con lo stesso seed (float32 come il resto del blocco)
+    coarse = np.random.default_rng(seed).random((cells + 1, cells + 1), dtype="float32")
+    y = (np.arange(row_offset, row_offset + rows, dtype="float32") / max(height - 1, 1)) * cells
+    x = (np.arange(cols, dtype="float32") / max(width - 1, 1)) * cells
+    y0 = np.minimum(y.astype(int), cells - 1)
+    x0 = np.minimum(x.astype(int), cells - 1)
+    fy = (y - y0)[:, None]
+    fx = (x - x0)[None, :]
+    top = coarse[y0][:, x0] * (1 - fx) + coarse[y0][:, x0 + 1] * fx
+    bottom = coarse[y0 + 1][:, x0] * (1 - fx) + coarse[y0 + 1][:, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def urban_centres(seed, count=6):
+    # (count, 4): x, y in frazioni dell'estensione (y dall'alto), picco di
+    # popolazione (pers/km²) e raggio caratteristico (frazione del lato)
+    rng = np.random.default_rng(seed + 101)
+    return np.column_stack([
+        rng.uniform(0.1, 0.9, count),
+        rng.uniform(0.1, 0.9, count),
+        rng.uniform(200, 3000, count),
+        rng.uniform(0.01, 0.04, count),
+    ])
+
+
+def river_x(seed, fy):
+    # Ascissa (frazione) del fiume principale per ordinate fy (frazioni dall'alto)
+    phase = float(np.random.default_rng(seed + 202).uniform(0, 2 * np.pi))
+    return 0.5 + 0.12 * np.sin(2 * np.pi * 1.5 * np.asarray(fy) + phase)
+
+
+def _grid(row, rows, height, width):
+    # Coordinate frazionarie dei centri dei pixel del blocco: (rows, 1) e (1, width)
+    fy = ((np.arange(row, row + rows, dtype="float32") + 0.5) / height)[:, None]
+    fx = ((np.arange(width, dtype="float32") + 0.5) / width)[None, :]
+    return fy, fx
+
+
+def _urban_density(seed, fy, fx):
+    density = np.zeros(np.broadcast_shapes(fy.shape, fx.shape), dtype="float32")
+    for cx, cy, peak, radius in urban_centres(seed).tolist():
+        density += peak * np.exp(-np.hypot(fx - cx, fy - cy) / radius)
+    return density
+
+
+def _noise(seed, row, rows, width):
+    # Rumore uniforme per pixel generato a fasce di TILE righe con seed (seed, fascia):
+    # lo stesso pixel ha lo stesso valore qualunque sia la dimensione dei blocchi
+    first = row // TILE * TILE
+    bands = [np.random.default_rng([seed, start]).random((TILE, width), dtype="float32")
+             for start in range(first, row + rows, TILE)]
+    return np.concatenate(bands)[row - first:row - first + rows]
+
+
+def _edge(fx):
+    # Colonne ai bordi est/ovest fuori dall'area analizzata (-1 nei raster delle anomalie)
+    return ((fx < 0.02) | (fx > 0.98))[0]
+
+
+def _river_distance(seed, fy, fx):
+    return np.abs(fx - river_x(seed, fy))
+
+
+# ====================================================
+# Blocchi dei layer raster
+# ====================================================
+def layer_block(layer, row, rows, height, width, seed=0, year=0):
+    # Bande (lista di array rows x width) del blocco di righe [row, row + rows)
+    fy, fx = _grid(row, rows, height, width)
+    field = smooth_field(seed, rows, width, row, height, width)
+    # Variazione dell'anno: un secondo campo liscio e rumore per pixel
+    year_seed = seed * 1000 + year
+    year_field = smooth_field(year_seed, rows, width, row, height, width, cells=4)
+    noise = _noise(year_seed, row, rows, width)
+    # Precipitazioni del Sahel: più piogge a sud
+    rain = np.clip(0.6 * fy + 0.25 * field + 0.15 * year_field, 0, 1)
+    river = _river_distance(seed, fy, fx)
+
+    if layer == "climate_precipitations":
+        return [(50 + 500 * rain + 30 * (noise - 0.5)).astype("float32")]
+    if layer == "population_density":
+        rural = 5 + 40 * field
+        return [((rural + _urban_density(seed, fy, fx)) * (0.7 + 0.6 * noise)).astype("float32")]
+    if layer == "gross_primary_production":
+        gpp = 150 + 2500 * rain * (0.6 + 0.4 * field) * (0.8 + 0.4 * noise) + 1500 * (river < 0.02)
+        band = np.clip(gpp, 0, 60000).astype("uint16")
+        band[river < 0.004] = 65533
+        return [band]
+    if layer == "land_cover":
+        band = np.select([rain < 0.35, rain < 0.5, rain < 0.7], [BARREN, OPEN_SHRUBLANDS, GRASSLANDS],
+                         SAVANNAS).astype("uint8")
+        band[river < 0.02] = CROPLANDS
+        band[river < 0.004] = WATER
+        band[_urban_density(seed, fy, fx) > 400] = URBAN
+        return [band]
+    if layer in ("deforestation", "climate_change"):
+        # Banda 1: 1 = anomalia, 0 = nessuna, -1 = fuori area; banda 2: differenza
+        change = np.where(noise > 0.9, 1, 0).astype("int16")
+        change[:, _edge(fx)] = -1
+        diff = ((year_field - 0.5) * 200 * (change == 1)).astype("int16")
+        return [change, diff]
+    if layer == "land_cover_change":
+        band = np.choose(np.minimum((noise * 10).astype(int), 9),
+                         [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5, 1.0, 1.0]).astype("float32")
+        band[:, _edge(fx)] = -1
+        return [band]
+    raise ValueError(f"layer sconosciuto: {layer}")
+
+
+def layer_array(layer, height, width, seed=0, year=0):
+    # Layer intero in memoria (per raster piccoli, es. dati simulati degli script)
+    return layer_block(layer, 0, height, height, width, seed, year)
+
+
+def write_tif(path, layer, size, seed=0, year=0, bounds=SYNTHETIC_BOUNDS):
+    import rasterio
+    from rasterio.transform import from_bounds
+
+    dtype, count, nodata = LAYER_SPECS[layer]
+    profile = {
+        "driver": "GTiff", "width": size, "height": size, "count": count, "dtype": dtype,
+        "crs": "EPSG:4326", "transform": from_bounds(*bounds, size, size),
+        "tiled": True, "blockxsize": TILE, "blockysize": TILE, "compress": "deflate", "BIGTIFF": "IF_SAFER",
+    }
+    if nodata is not None:
+        profile["nodata"] = nodata
+    # Blocchi di righe intere di tile: ogni tile viene scritto una volta sola
+    chunk_rows = max(CHUNK_PIXELS // size // TILE, 1) * TILE
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, size, chunk_rows):
+            rows = min(chunk_rows, size - row)
+            window = rasterio.windows.Window(0, row, size, rows)
+            for band, values in enumerate(layer_block(layer, row, rows, size, size, seed, year), start=1):
+                dst.write(values, band, window=window)
+
+
+# ====================================================
+# Vettoriali e prezzi
+# ====================================================
+def _to_lonlat(fx, fy, bounds):
+    minx, miny, maxx, maxy = bounds
+    return minx + np.asarray(fx) * (maxx - minx), maxy - np.asarray(fy) * (maxy - miny)
+
+
+def districts(seed=0, bounds=SYNTHETIC_BOUNDS, grid_shape=(5, 5), per_moughataa=5):
+    # Distretti come celle di una griglia con i nodi interni spostati a caso:
+    # celle adiacenti condividono i lati, quindi coprono la regione senza buchi
+    import geopandas as gpd
+    from shapely.geometry import Polygon
+
+    ny, nx = grid_shape
+    rng = np.random.default_rng(seed + 303)
+    gy, gx = np.meshgrid(np.linspace(0, 1, ny + 1), np.linspace(0, 1, nx + 1), indexing="ij")
+    jitter = rng.uniform(-0.3, 0.3, (2, ny + 1, nx + 1)) * np.array([1 / ny, 1 / nx])[:, None, None]
+    jitter[:, [0, -1], :] = 0
+    jitter[:, :, [0, -1]] = 0
+    lon, lat = _to_lonlat(gx + jitter[1], gy + jitter[0], bounds)
+    rows = []
+    for i in range(ny):
+        for j in range(nx):
+            ring = [(lon[i, j], lat[i, j]), (lon[i, j + 1], lat[i, j + 1]),
+                    (lon[i + 1, j + 1], lat[i + 1, j + 1]), (lon[i + 1, j], lat[i + 1, j])]
+            k = i * nx + j
+            moughataa = k // per_moughataa
+            rows.append({"FID_1": k, "ADM3_EN": f"District {k + 1:02d}", "ADM3_PCODE": f"SY{k + 1:04d}",
+                         "ADM2_EN": f"Moughataa {moughataa + 1}", "ADM2_PCODE": f"SY{moughataa + 1:02d}",
+                         "ADM1_EN": "Synthetic", "ADM1_PCODE": "SY", "geometry": Polygon(ring)})
+    return gpd.GeoDataFrame(rows, crs="EPSG:4326")
+
+
+def regions(district_gdf):
+    region = district_gdf.dissolve(by=["ADM2_EN", "ADM2_PCODE", "ADM1_EN", "ADM1_PCODE"], as_index=False)
+    region["FID_1"] = range(len(region))
+    region["ADM0_EN"], region["ADM0_PCODE"] = "Mauritania", "MR"
+    return region[["FID_1", "ADM2_EN", "ADM2_PCODE", "ADM1_EN", "ADM1_PCODE", "ADM0_EN", "ADM0_PCODE", "geometry"]]
+
+
+def roads(seed=0, bounds=SYNTHETIC_BOUNDS):
+    # Strade principali tra città vicine (ordinate lungo x)
+    import geopandas as gpd
+    from shapely.geometry import LineString
+
+    centres = urban_centres(seed)
+    centres = centres[np.argsort(centres[:, 0])]
+    lon, lat = _to_lonlat(centres[:, 0], centres[:, 1], bounds)
+    rows = [{"ID_": i, "NAME1_": f"Route {i + 1}", "TYPE": "Primary Route",
+             "LONG": float(np.hypot(lon[i + 1] - lon[i], lat[i + 1] - lat[i]) * 111.32),
+             "geometry": LineString([(lon[i], lat[i]), (lon[i + 1], lat[i + 1])])}
+            for i in range(len(centres) - 1)]
+    return gpd.GeoDataFrame(rows, crs="EPSG:4326")
+
+
+def streams(seed=0, bounds=SYNTHETIC_BOUNDS, tributaries=12, vertices=50):
+    # Il fiume principale dei raster più affluenti: passeggiate casuali (cumsum) che lo raggiungono
+    import geopandas as gpd
+    from shapely.geometry import LineString
+
+    rng = np.random.default_rng(seed + 404)
+    fy = np.linspace(0, 1, vertices * 4)
+    lines = [("Main river", "river", np.column_stack(_to_lonlat(river_x(seed, fy), fy, bounds)))]
+    for k in range(tributaries):
+        y_end = rng.uniform(0.05, 0.95)
+        x_end = river_x(seed, y_end)
+        side = rng.choice([-1, 1])
+        x_start = np.clip(x_end + side * rng.uniform(0.1, 0.4), 0, 1)
+        steps = rng.normal(0, 0.01, (vertices, 2)).cumsum(axis=0)
+        # La passeggiata viene riportata agli estremi con una correzione lineare
+        t = np.linspace(0, 1, vertices)[:, None]
+        start = np.array([x_start, np.clip(y_end + rng.uniform(-0.2, 0.2), 0, 1)])
+        path = start + t * (np.array([x_end, y_end]) - start) + steps - t * steps[-1]
+        path = np.clip(path, 0, 1)
+        lines.append((f"Oued {k + 1}", "stream", np.column_stack(_to_lonlat(path[:, 0], path[:, 1], bounds))))
+    rows = [{"FID_1": i, "name": name, "name_en": name, "waterway": kind, "geometry": LineString(coords)}
+            for i, (name, kind, coords) in enumerate(lines)]
+    return gpd.GeoDataFrame(rows, crs="EPSG:4326")
+
+
+def prices(seed=0, years=SYNTHETIC_YEARS, bounds=SYNTHETIC_BOUNDS, district_gdf=None, markets=2):
+    # Prezzi mensili (il 15 del mese) nelle città più grandi, con la colonna
+    # admin2 presa dalla moughataa che contiene il mercato
+    import pandas as pd
+    from shapely.geometry import Point
+
+    rng = np.random.default_rng(seed + 505)
+    centres = urban_centres(seed)
+    centres = centres[np.argsort(-centres[:, 2])][:markets]
+    lon, lat = _to_lonlat(centres[:, 0], centres[:, 1], bounds)
+    district_gdf = district_gdf if district_gdf is not None else districts(seed, bounds)
+    dates = pd.date_range(f"{min(years)}-01-01", f"{max(years)}-12-01", freq="MS") + pd.Timedelta(days=14)
+    frames = []
+    for m in range(len(centres)):
+        inside = district_gdf[district_gdf.contains(Point(lon[m], lat[m]))]
+        admin2 = inside["ADM2_EN"].iloc[0] if len(inside) else f"Moughataa {m + 1}"
+        for category, commodity, unit, base in COMMODITIES:
+            # Random walk moltiplicativo con stagionalità (picco prima del raccolto)
+            walk = np.exp(np.cumsum(rng.normal(0, 0.03, len(dates))))
+            season = 1 + 0.08 * np.sin(2 * np.pi * (dates.month.to_numpy() - 5) / 12)
+            price = np.round(base * walk * season, 1)
+            frames.append(pd.DataFrame({
+                "date": dates.strftime("%Y-%m-%d"), "admin1": "Synthetic", "admin2": admin2,
+                "market": f"Market {m + 1}", "latitude": lat[m], "longitude": lon[m], "category": category,
+                "commodity": commodity, "unit": unit, "priceflag": "actual", "pricetype": "Retail",
+                "currency": "MRU", "price": price, "usdprice": np.round(price / MRU_PER_USD, 4),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+# ====================================================
+# Cartella completa con la struttura di Datasets_Hackathon
+# ====================================================
+def build_root(root, size, years=SYNTHETIC_YEARS, seed=0, bounds=SYNTHETIC_BOUNDS):
+    # Riusa la cartella se è già completa (marker .complete)
+    if os.path.exists(os.path.join(root, ".complete")):
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    from catalog import LAYER_SUBDIRS, PRICE_DATA_FILE
+    from masks import DISTRICTS_FILE, REGION_FILE
+
+    dirs = {name: os.path.join(root, subdir) for name, subdir in LAYER_SUBDIRS.items()}
+    for directory in dirs.values():
+        os.makedirs(directory, exist_ok=True)
+
+    district_gdf = districts(seed, bounds)
+    district_gdf.to_file(os.path.join(dirs["admin_layers"], DISTRICTS_FILE))
+    regions(district_gdf).to_file(os.path.join(dirs["admin_layers"], REGION_FILE))
+    roads(seed, bounds).to_file(os.path.join(dirs["streams_roads"], "Main_Road.shp"))
+    streams(seed, bounds).to_file(os.path.join(dirs["streams_roads"], "Streamwater.shp"))
+    prices(seed, years, bounds, district_gdf).to_csv(os.path.join(root, PRICE_DATA_FILE), index=False)
+
+    for layer, pattern in FILE_NAMES.items():
+        if layer in PAIR_LAYERS:
+            stamps = [f"{start}_{end}" for start, end in zip(years, years[1:])]
+        else:
+            stamps = [str(year) for year in years]
+        for stamp in stamps:
+            write_tif(os.path.join(dirs[layer], pattern.format(year=stamp)), layer, size, seed,
+                      int(stamp[:4]), bounds)
+    open(os.path.join(root, ".complete"), "w").close()
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un dataset sintetico con la struttura di Datasets_Hackathon")
+    parser.add_argument("root", help="Cartella di destinazione")
+    parser.add_argument("--size", type=int, default=1000, help="Lato dei raster in pixel")
+    parser.add_argument("--years", default=",".join(str(y) for y in SYNTHETIC_YEARS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    years = [int(y) for y in args.years.split(",") if y.strip()]
+    print(build_root(args.root, args.size, years, args.seed))
+
+
+if __name__ == "__main__":
+    main()
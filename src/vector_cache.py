@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import hashlib
+import os
+
+from catalog import DATA_ROOT
+
+# ====================================================
+# Cache dei vettori convertiti (FlatGeobuf / GeoParquet)
+# ====================================================
+# Gli shapefile vengono convertiti una volta (python vector_cache.py) in:
+# - FlatGeobuf (default): indice spaziale R-tree impacchettato nel file, con il
+#   bbox di ogni feature; una lettura con bbox legge solo le feature che lo intersecano;
+# - GeoParquet: colonna "bbox" di copertura per feature, usata da read_parquet(bbox=...).
+# read_vector() usa la versione convertita se esiste ed è più recente dello
+# shapefile (e dei suoi .dbf/.shx/.prj), altrimenti legge lo shapefile come prima.
+
+VECTOR_CACHE_DIR = os.environ.get("DASHBOARD_VECTOR_CACHE_DIR", "./.vector_cache")
+VECTOR_FORMAT = os.environ.get("DASHBOARD_VECTOR_FORMAT", "fgb")
+FORMAT_EXTENSIONS = {"fgb": ".fgb", "parquet": ".parquet"}
+SIDECAR_EXTENSIONS = (".shp", ".dbf", ".shx", ".prj", ".cpg")
+
+try:
+    import pyarrow  # noqa: F401
+    USE_ARROW = True
+except ImportError:
+    USE_ARROW = False
+
+
+def cache_path(source_path, fmt=VECTOR_FORMAT, cache_dir=VECTOR_CACHE_DIR):
+    abs_source = os.path.abspath(source_path)
+    digest = hashlib.sha1(abs_source.encode()).hexdigest()[:10]
+    stem = os.path.splitext(os.path.basename(abs_source))[0]
+    return os.path.join(cache_dir, f"{stem}-{digest}{FORMAT_EXTENSIONS[fmt]}")
+
+
+def _source_mtime(source_path):
+    base = os.path.splitext(source_path)[0]
+    return max(os.path.getmtime(base + ext) for ext in SIDECAR_EXTENSIONS if os.path.exists(base + ext))
+
+
+def fresh_cache(source_path, fmt=VECTOR_FORMAT, cache_dir=VECTOR_CACHE_DIR):
+    path = cache_path(source_path, fmt, cache_dir)
+    if os.path.exists(path) and os.path.getmtime(path) >= _source_mtime(source_path):
+        return path
+    return None
+
+
+def convert(source_path, fmt=VECTOR_FORMAT, cache_dir=VECTOR_CACHE_DIR):
+    import geopandas as gpd
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(source_path, fmt, cache_dir)
+    gdf = gpd.read_file(source_path, engine="pyogrio", use_arrow=USE_ARROW)
+    tmp = path + ".tmp"
+    if fmt == "fgb":
+        # SPATIAL_INDEX=YES scrive l'indice packed Hilbert R-tree con i bbox delle feature
+        gdf.to_file(tmp, driver="FlatGeobuf", engine="pyogrio", SPATIAL_INDEX="YES")
+    else:
+        gdf.to_parquet(tmp, write_covering_bbox=True, schema_version="1.1.0")
+    os.replace(tmp, path)
+    return path, len(gdf)
+
+
+def bbox_in_crs(bbox, crs, bbox_crs="EPSG:4326"):
+    # pyogrio e read_parquet filtrano nel CRS del layer
+    if bbox is None or crs is None:
+        return bbox
+    import geopandas as gpd
+    import shapely
+    return tuple(gpd.GeoSeries([shapely.box(*bbox)], crs=bbox_crs).to_crs(crs).total_bounds)
+
+
+def read_vector(source_path, bbox=None, bbox_crs="EPSG:4326"):
+    import geopandas as gpd
+    import pyogrio
+
+    for fmt in (VECTOR_FORMAT,) + tuple(f for f in FORMAT_EXTENSIONS if f != VECTOR_FORMAT):
+        path = fresh_cache(source_path, fmt)
+        if path is None:
+            continue
+        if fmt == "parquet":
+            if bbox is None:
+                return gpd.read_parquet(path)
+            return gpd.read_parquet(path, bbox=bbox_in_crs(bbox, _parquet_crs(path), bbox_crs))
+        crs = pyogrio.read_info(path)["crs"]
+        # Con Arrow, GDAL restituisce WKB troncato quando il bbox non interseca
+        # nessuna feature del FlatGeobuf: qui il percorso classico è comunque
+        # veloce perché l'indice spaziale limita le feature lette
+        return gpd.read_file(path, engine="pyogrio", bbox=bbox_in_crs(bbox, crs, bbox_crs))
+
+    crs = pyogrio.read_info(source_path)["crs"]
+    return gpd.read_file(source_path, engine="pyogrio", use_arrow=USE_ARROW, bbox=bbox_in_crs(bbox, crs, bbox_crs))
+
+
+def _parquet_crs(path):
+    # Legge il CRS dai metadati "geo" senza caricare il file
+    import json
+    import pyarrow.parquet as pq
+    from pyproj import CRS
+
+    geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+    crs = geo["columns"][geo["primary_column"]].get("crs", "OGC:CRS84")
+    return CRS.from_user_input(crs) if crs is not None else None
+
+
+def ingest(root=DATA_ROOT, fmt=VECTOR_FORMAT, cache_dir=VECTOR_CACHE_DIR, force=False):
+    results = []
+    for shp in sorted(glob.glob(os.path.join(root, "**", "*.shp"), recursive=True)):
+        if not force and fresh_cache(shp, fmt, cache_dir):
+            results.append((shp, cache_path(shp, fmt, cache_dir), None))
+            continue
+        path, count = convert(shp, fmt, cache_dir)
+        results.append((shp, path, count))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converte gli shapefile in FlatGeobuf/GeoParquet indicizzati")
+    parser.add_argument("--root", default=DATA_ROOT, help="Cartella dei dataset da scandire")
+    parser.add_argument("--format", choices=sorted(FORMAT_EXTENSIONS), default=VECTOR_FORMAT)
+    parser.add_argument("--cache-dir", default=VECTOR_CACHE_DIR)
+    parser.add_argument("--force", action="store_true", help="Riconverte anche i file aggiornati")
+    args = parser.parse_args()
+
+    for shp, path, count in ingest(args.root, args.format, args.cache_dir, args.force):
+        status = "aggiornato" if count is None else f"{count} feature"
+        print(f"{os.path.relpath(shp, args.root)} -> {path} ({status})")
+
+
+if __name__ == "__main__":
+    main()
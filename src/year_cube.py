@@ -0,0 +1,139 @@
+import base64
+import os
+import warnings
+import zlib
+
+import numpy as np
+
+import grid
+
+# ====================================================
+# Cubo degli anni di un layer (anni x righe x colonne)
+# ====================================================
+# Tutti gli anni di un layer impilati in un solo array float32 (NaN = nodata),
+# sulla stessa griglia. Serve alla serie storica dei pixel: per regioni
+# piccole come Assaba il cubo viene quantizzato a uint16, compresso con zlib
+# e spedito una volta al browser (dcc.Store), dove una callback clientside
+# (assets/pixel_history.js) disegna la serie al click senza chiamare il server.
+# Oltre CLIENT_CUBE_MB (dimensione non compressa) resta la callback sul server.
+
+CLIENT_CUBE_MB = float(os.environ.get("DASHBOARD_CLIENT_CUBE_MB", "16"))
+NODATA_CODE = 65535
+
+
+def stack(rasters, value_key="data"):
+    # rasters: lista di (anno, raster) caricati da load_data; None se le griglie differiscono
+    shapes = {raster[value_key].shape for _, raster in rasters}
+    if len(shapes) != 1:
+        return None
+    first = rasters[0][1]
+    values = []
+    for _, raster in rasters:
+        layer = raster[value_key]
+        if value_key == "data" and "nodata" in raster:
+            layer = np.where(raster["nodata"], np.nan, layer)
+        values.append(layer.astype("float32", copy=False))
+    return {
+        "cube": np.stack(values),
+        "years": [year for year, _ in rasters],
+        # Transform dell'array (già capovolto se il raster lo è)
+        "transform": tuple(grid.raster_geometry(first, value_key).transform)[:6],
+        "crs": first.get("crs"),
+        "bounds": tuple(first["bounds"]),
+    }
+
+
+def lonlat_to_crs(cube, lons, lats):
+    # Coordinate WGS84 -> CRS del raster (es. sinusoidale MODIS); invariate se
+    # il raster non ha CRS o è già geografico
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    crs = cube.get("crs")
+    if not crs or crs.is_geographic:
+        return lons, lats
+    from rasterio.warp import transform
+
+    xs, ys = transform("EPSG:4326", crs, lons, lats)
+    return np.asarray(xs), np.asarray(ys)
+
+
+def sample(cube, xs, ys):
+    # Valori di tutti gli anni per molti punti insieme: (punti x anni), NaN fuori griglia.
+    # xs/ys nel CRS del raster; righe/colonne dalla geometria della griglia (grid.py)
+    values = cube["cube"]
+    rows, cols, inside = grid.geometry(cube["transform"], values.shape[1:]).rowcol(xs, ys)
+    rows, cols, inside = rows.ravel(), cols.ravel(), inside.ravel()
+    result = np.full((inside.size, values.shape[0]), np.nan, dtype="float32")
+    result[inside] = values[:, rows[inside], cols[inside]].T
+    return result
+
+
+def selection_mask(cube, polygon):
+    # Pixel (centri) dentro il poligono [(x, y), ...] nel CRS del raster;
+    # rasterize lavora in C anche per selezioni di centinaia di migliaia di pixel
+    from affine import Affine
+    from rasterio.features import rasterize
+
+    ring = [tuple(map(float, point)) for point in polygon]
+    ring.append(ring[0])
+    _, height, width = cube["cube"].shape
+    mask = rasterize([({"type": "Polygon", "coordinates": [ring]}, 1)], out_shape=(height, width),
+                     transform=Affine(*cube["transform"]), fill=0, dtype="uint8")
+    return mask.astype(bool)
+
+
+AREA_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def area_statistics(cube, mask):
+    # Media, mediana e percentili dei pixel selezionati per ogni anno: una sola
+    # maschera applicata a tutto il cubo, ritagliato prima sulla finestra della selezione
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return None
+    window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+    values = cube["cube"][:, window[0], window[1]][:, mask[window]]
+    count = np.isfinite(values).sum(axis=1)
+    with warnings.catch_warnings():
+        # Anni senza pixel validi nella selezione -> NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(values, axis=1)
+        percentiles = np.nanpercentile(values, AREA_PERCENTILES, axis=1)
+    stats = {"years": cube["years"], "pixels": int(values.shape[1]), "count": count.tolist(), "mean": mean.tolist()}
+    for q, row in zip(AREA_PERCENTILES, percentiles):
+        stats["median" if q == 50 else f"p{q}"] = row.tolist()
+    return stats
+
+
+def quantize(cube):
+    # uint16 con offset/scala; senza perdita se i valori sono interi in 0..65534 dal minimo
+    valid = np.isfinite(cube)
+    if not valid.any():
+        return np.full(cube.shape, NODATA_CODE, dtype="<u2"), 0.0, 1.0
+    low, high = float(cube[valid].min()), float(cube[valid].max())
+    integers = np.array_equal(cube[valid], np.round(cube[valid]))
+    scale = 1.0 if integers and high - low <= NODATA_CODE - 1 else max(high - low, 1e-12) / (NODATA_CODE - 1)
+    codes = np.full(cube.shape, NODATA_CODE, dtype="<u2")
+    codes[valid] = np.round((cube[valid] - low) / scale).astype("<u2")
+    return codes, low, scale
+
+
+def client_payload(cube, map_type, region):
+    # Dizionario JSON per il dcc.Store; None se il cubo è troppo grande per il browser
+    values = cube["cube"]
+    if values.size * 2 > CLIENT_CUBE_MB * 1024 * 1024:
+        return None
+    codes, offset, scale = quantize(values)
+    return {
+        "map_type": map_type,
+        "region": region,
+        "years": cube["years"],
+        "shape": list(values.shape),
+        "transform": list(cube["transform"]),
+        "offset": offset,
+        "scale": scale,
+        "nodata": NODATA_CODE,
+        # zlib = formato "deflate" di DecompressionStream nel browser
+        "data": base64.b64encode(zlib.compress(codes.tobytes(), 6)).decode("ascii"),
+    }